@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 The Kapitan Authors
+# SPDX-FileCopyrightText: 2020 The Kapitan Authors <kapitan-admins@googlegroups.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+end-to-end benchmark of kapitan compile on synthetic inventories.
+
+For each number of targets, generates a project with benchmarks.inventory_generator
+and times rendering the inventory with each inventory backend, and a full
+`kapitan compile`, split into its phases with the --profile-out trace.
+Results are written as JSON to compare kapitan versions. Run from the
+repository root:
+
+    python -m benchmarks.compile_benchmark --targets 10 100 1000 --output results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from benchmarks.inventory_generator import INPUT_TYPES, generate_project
+from kapitan import cached
+from kapitan.cli import main as kapitan_main
+from kapitan.resources import get_inventory
+from kapitan.version import VERSION
+
+BACKENDS = ("reclass", "omegaconf")
+
+
+def time_get_inventory(backend):
+    """returns the seconds get_inventory() takes to render the inventory with backend"""
+    cached.reset_cache()
+    cached.args["all"] = argparse.Namespace(reclass=backend == "reclass", omegaconf=backend == "omegaconf")
+    start = time.perf_counter()
+    get_inventory("inventory")
+    return time.perf_counter() - start
+
+
+def time_compile(parallelism, trace_path):
+    """returns the seconds of a kapitan compile, and of each of its phases from the trace"""
+    cached.reset_cache()
+    sys.argv = ["kapitan", "compile", "--ignore-version-check", "--parallelism", str(parallelism)]
+    sys.argv += ["--profile-out", trace_path]
+    start = time.perf_counter()
+    kapitan_main()
+    total = time.perf_counter() - start
+
+    with open(trace_path) as fp:
+        events = json.load(fp)["traceEvents"]
+    # phases are the spans recorded by this process
+    phases = defaultdict(float)
+    for event in events:
+        if event["ph"] == "X" and event["pid"] == os.getpid():
+            phases[event["name"]] += event["dur"] / 1e6
+    return total, dict(phases)
+
+
+def run(num_targets, args):
+    """returns the best timings of args.repeat runs on a project with num_targets targets"""
+    cwd = os.getcwd()
+    temp_path = tempfile.mkdtemp()
+    try:
+        generate_project(temp_path, num_targets, args.classes, args.depth, args.parameters, args.inputs)
+        os.chdir(temp_path)
+
+        inventory_timings = {}
+        for backend in args.backends:
+            try:
+                inventory_timings[backend] = min(time_get_inventory(backend) for _ in range(args.repeat))
+            except Exception as e:
+                inventory_timings[backend] = {"error": str(e)}
+
+        compile_runs = [
+            time_compile(args.parallelism, os.path.join(temp_path, "trace.json")) for _ in range(args.repeat)
+        ]
+        total, phases = min(compile_runs, key=lambda compile_run: compile_run[0])
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(temp_path)
+        cached.reset_cache()
+
+    return {
+        "targets": num_targets,
+        "get_inventory": inventory_timings,
+        "compile": {"total": total, "phases": phases},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--targets", type=int, nargs="+", default=[10, 100], help="numbers of targets")
+    parser.add_argument("--classes", type=int, default=5, help="class chains included by each target")
+    parser.add_argument("--depth", type=int, default=3, help="inheritance depth of each class chain")
+    parser.add_argument("--parameters", type=int, default=100, help="parameters added by each class")
+    parser.add_argument(
+        "--inputs", nargs="+", default=list(INPUT_TYPES), choices=INPUT_TYPES, help="input types to compile"
+    )
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--parallelism", type=int, default=4, help="compile parallelism")
+    parser.add_argument("--repeat", type=int, default=1, help="keep the fastest of this many runs")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {
+        "kapitan_version": VERSION,
+        "python_version": platform.python_version(),
+        "settings": {
+            "classes": args.classes,
+            "depth": args.depth,
+            "parameters": args.parameters,
+            "inputs": args.inputs,
+            "parallelism": args.parallelism,
+            "repeat": args.repeat,
+        },
+        "results": [],
+    }
+    for num_targets in args.targets:
+        result = run(num_targets, args)
+        results["results"].append(result)
+        print(
+            "{:>6} targets: compile {:.2f}s, get_inventory {}".format(
+                num_targets,
+                result["compile"]["total"],
+                ", ".join(
+                    "{} {}".format(
+                        backend, "{:.2f}s".format(timing) if isinstance(timing, float) else "failed"
+                    )
+                    for backend, timing in result["get_inventory"].items()
+                ),
+            )
+        )
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
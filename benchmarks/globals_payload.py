@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 The Kapitan Authors
+# SPDX-FileCopyrightText: 2020 The Kapitan Authors <kapitan-admins@googlegroups.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+benchmark of the data pickled to hand targets to compile workers.
+
+Compares passing the cached globals with every task (globals_cached) with
+saving them once with save_globals() (globals_path), for synthetic inventories
+of increasing size. Run from the repository root:
+
+    python -m benchmarks.globals_payload --targets 10 100 1000 --params 100
+"""
+
+import argparse
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from functools import partial
+
+from kapitan import cached
+from kapitan.refs.base import RefController
+from kapitan.targets import compile_target, save_globals
+
+
+def synthetic_inventory(num_targets, num_params):
+    """returns an inventory with num_targets targets of num_params parameters each"""
+    nodes = {}
+    for index in range(num_targets):
+        name = "target-{}".format(index)
+        parameters = {
+            "kapitan": {
+                "vars": {"target": name},
+                "compile": [{"input_type": "jsonnet", "input_paths": ["main.jsonnet"], "output_path": "."}],
+            },
+            "components": {
+                "component-{}".format(param): {"image": "image:{}".format(param), "replicas": param}
+                for param in range(num_params)
+            },
+        }
+        nodes[name] = {"classes": ["common"], "parameters": parameters}
+    return {"nodes": nodes}
+
+
+def task_payload(worker, target_objs):
+    """returns the total size and pickling time of handing each of target_objs to worker"""
+    size = 0
+    start = time.perf_counter()
+    for target_obj in target_objs:
+        # the pool pickles the function and its arguments for each task
+        size += len(pickle.dumps((worker, (target_obj,)), pickle.HIGHEST_PROTOCOL))
+    return size, time.perf_counter() - start
+
+
+def run(num_targets, num_params):
+    """returns the payload of both ways to hand num_targets targets to the compile workers"""
+    cached.reset_cache()
+    cached.inv = synthetic_inventory(num_targets, num_params)
+    target_objs = [node["parameters"]["kapitan"] for node in cached.inv["nodes"].values()]
+    ref_controller = RefController("refs")
+    worker_kwargs = {"search_paths": ["."], "compile_path": "compiled", "inventory_path": "inventory"}
+
+    worker = partial(
+        compile_target, ref_controller=ref_controller, globals_cached=cached.as_dict(), **worker_kwargs
+    )
+    per_task_size, per_task_time = task_payload(worker, target_objs)
+
+    temp_path = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        globals_path = save_globals(temp_path, ref_controller)
+        save_time = time.perf_counter() - start
+        # the globals and the inventory nodes store
+        globals_size = sum(os.path.getsize(os.path.join(temp_path, name)) for name in os.listdir(temp_path))
+        worker = partial(compile_target, ref_controller=None, globals_path=globals_path, **worker_kwargs)
+        once_size, once_time = task_payload(worker, target_objs)
+    finally:
+        shutil.rmtree(temp_path)
+
+    return {
+        "targets": num_targets,
+        "params": num_params,
+        "globals_per_task": {"bytes": per_task_size, "seconds": round(per_task_time, 4)},
+        "globals_once": {
+            "bytes": once_size + globals_size,
+            "seconds": round(once_time + save_time, 4),
+            "globals_bytes": globals_size,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--targets", type=int, nargs="+", default=[10, 100, 1000], help="numbers of targets")
+    parser.add_argument("--params", type=int, default=100, help="number of parameters per target")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = [run(num_targets, args.params) for num_targets in args.targets]
+    for result in results:
+        print(
+            "{targets:>6} targets: {per_task:>14,d} bytes pickled per run with globals per task, "
+            "{once:>12,d} with globals once".format(
+                targets=result["targets"],
+                per_task=result["globals_per_task"]["bytes"],
+                once=result["globals_once"]["bytes"],
+            )
+        )
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 The Kapitan Authors
+# SPDX-FileCopyrightText: 2020 The Kapitan Authors <kapitan-admins@googlegroups.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+generator of synthetic kapitan projects for benchmarks.
+
+Each target includes a number of class chains, each class including the
+previous one up to the inheritance depth and adding a tree of parameters,
+and compiles a mix of jsonnet, jinja2, kadet and copy inputs reading them.
+Targets can also export their name and read the names of all targets with
+a reclass inventory query.
+"""
+
+import math
+import os
+
+import yaml
+
+INPUT_TYPES = ("jsonnet", "jinja2", "kadet", "copy")
+
+# keys per level of the parameter trees
+FANOUT = 10
+
+JSONNET_COMPONENT = """local kap = import "lib/kapitan.libjsonnet";
+local inv = kap.inventory();
+
+{
+  [name]: inv.parameters[name]
+  for name in std.objectFields(inv.parameters)
+  if std.startsWith(name, "chain")
+}
+"""
+
+JINJA2_TEMPLATE = """# {{ inventory.parameters.kapitan.vars.target }}
+
+{% for name, chain in inventory.parameters.items() if name.startswith("chain") %}
+- {{ name }}: level {{ chain.level }}
+{% endfor %}
+"""
+
+KADET_COMPONENT = """from kapitan.inputs import kadet
+
+inv = kadet.inventory()
+
+
+def main():
+    output = {}
+    for name, chain in inv.parameters.items():
+        if name.startswith("chain"):
+            output[name] = kadet.BaseObj.from_dict(chain.to_dict())
+    return output
+"""
+
+COPY_FILE = """apiVersion: v1
+kind: ConfigMap
+metadata:
+  name: static
+data:
+  key: value
+"""
+
+
+def parameter_tree(size, prefix="key"):
+    """returns a nested dict with size leaves and FANOUT keys per level"""
+    if size <= FANOUT:
+        return {"{}{}".format(prefix, index): "value{}".format(index) for index in range(size)}
+    child_size = math.ceil(size / FANOUT)
+    tree = {}
+    for index, child_start in enumerate(range(0, size, child_size)):
+        tree["{}{}".format(prefix, index)] = parameter_tree(min(child_size, size - child_start), prefix)
+    return tree
+
+
+def compile_items(inputs):
+    """returns the compile list of the targets for the input types in inputs"""
+    items = {
+        "jsonnet": {
+            "input_type": "jsonnet",
+            "input_paths": ["components/bench.jsonnet"],
+            "output_path": "jsonnet",
+            "output_type": "yaml",
+        },
+        "jinja2": {"input_type": "jinja2", "input_paths": ["templates/README.md"], "output_path": "docs"},
+        "kadet": {
+            "input_type": "kadet",
+            "input_paths": ["components/bench_kadet"],
+            "output_path": "kadet",
+            "output_type": "yaml",
+        },
+        "copy": {"input_type": "copy", "input_paths": ["files/static.yaml"], "output_path": "copy"},
+    }
+    return [items[input_type] for input_type in inputs]
+
+
+def write_yaml(path, obj):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fp:
+        yaml.safe_dump(obj, fp, default_flow_style=False)
+
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fp:
+        fp.write(content)
+
+
+def generate_project(path, targets=10, classes=5, depth=3, parameters=100, inputs=INPUT_TYPES, queries=False):
+    """
+    writes a kapitan project to path with targets targets, each including classes
+    chains of depth classes with parameters parameters each, and compiling inputs.
+    With queries, each target exports its name and reads those of all targets
+    """
+    if depth < 1:
+        raise ValueError("Inheritance depth must be at least 1")
+    for input_type in inputs:
+        if input_type not in INPUT_TYPES:
+            raise ValueError(
+                "Unknown input type {}, supported: {}".format(input_type, ", ".join(INPUT_TYPES))
+            )
+
+    classes_path = os.path.join(path, "inventory", "classes", "bench")
+    for chain in range(classes):
+        for level in range(depth):
+            class_obj = {
+                "parameters": {
+                    "chain{}".format(chain): {
+                        # overridden at every level
+                        "level": level,
+                        "level{}".format(level): parameter_tree(parameters),
+                    }
+                }
+            }
+            if level > 0:
+                class_obj["classes"] = ["bench.chain{}.level{}".format(chain, level - 1)]
+            write_yaml(
+                os.path.join(classes_path, "chain{}".format(chain), "level{}.yml".format(level)), class_obj
+            )
+
+    write_yaml(
+        os.path.join(classes_path, "components.yml"),
+        {"parameters": {"kapitan": {"compile": compile_items(inputs)}}},
+    )
+
+    target_classes = ["bench.chain{}.level{}".format(chain, depth - 1) for chain in range(classes)]
+    target_classes.append("bench.components")
+    if queries:
+        write_yaml(
+            os.path.join(classes_path, "queries.yml"),
+            {
+                "exports": {"target": "${kapitan:vars:target}"},
+                "parameters": {"targets": "$[ exports:target ]"},
+            },
+        )
+        target_classes.append("bench.queries")
+    for target in range(targets):
+        name = "target{}".format(target)
+        write_yaml(
+            os.path.join(path, "inventory", "targets", name + ".yml"),
+            {"classes": target_classes, "parameters": {"kapitan": {"vars": {"target": name}}}},
+        )
+
+    write_file(os.path.join(path, "components", "bench.jsonnet"), JSONNET_COMPONENT)
+    write_file(os.path.join(path, "templates", "README.md"), JINJA2_TEMPLATE)
+    write_file(os.path.join(path, "components", "bench_kadet", "__init__.py"), KADET_COMPONENT)
+    write_file(os.path.join(path, "files", "static.yaml"), COPY_FILE)
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 The Kapitan Authors
+# SPDX-FileCopyrightText: 2020 The Kapitan Authors <kapitan-admins@googlegroups.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+micro-benchmarks of the functions showing up in compile profiles.
+
+Each benchmark runs a function on a realistic payload (a list of Kubernetes
+manifests, a large inventory node) until --min-time has passed and reports
+operations per second, the peak memory of a single run and the number of
+blocks it allocated that are still alive after it. Run from the repository root:
+
+    python -m benchmarks.micro_benchmark --manifests 5000 --node-keys 50000 --output micro.json
+"""
+
+import argparse
+import copy
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from math import inf
+
+import yaml
+
+from benchmarks.inventory_generator import generate_project, parameter_tree
+from kapitan.refs.base import RefController, Revealer
+from kapitan.refs.base64 import Base64Ref
+from kapitan.resources import JSONNET_CACHE, search_imports
+from kapitan.utils import PrettyDumper, deep_get, dictionary_hash, directory_hash, prune_empty
+
+# refs used by the manifests, created in the refs path of the benchmark
+REF_TAGS = ["?{{base64:bench/secret{}}}".format(index) for index in range(10)]
+
+
+def kubernetes_manifests(count):
+    """returns count Kubernetes manifests, with refs and empty values as produced by components"""
+    manifests = []
+    for index in range(count):
+        name = "app{}".format(index)
+        labels = {"app": name, "team": "team{}".format(index % 10), "tier": "backend"}
+        container = {
+            "name": name,
+            "image": "registry.example.com/{}:1.0.{}".format(name, index),
+            "args": ["--port=8080", "--log-level=info"],
+            "env": [
+                {"name": "PASSWORD", "value": REF_TAGS[index % len(REF_TAGS)]},
+                {"name": "MODE", "value": "production"},
+            ],
+            "ports": [{"containerPort": 8080, "name": "http"}],
+            "resources": {"limits": {"cpu": "500m", "memory": "512Mi"}, "requests": {}},
+            "volumeMounts": [],
+        }
+        manifests.append(
+            {
+                "apiVersion": "apps/v1",
+                "kind": "Deployment",
+                "metadata": {"name": name, "labels": labels, "annotations": {}},
+                "spec": {
+                    "replicas": 1 + index % 3,
+                    "selector": {"matchLabels": labels},
+                    "template": {
+                        "metadata": {"labels": labels},
+                        "spec": {"containers": [container], "volumes": []},
+                    },
+                },
+            }
+        )
+    return manifests
+
+
+def measure(func, setup=None, min_time=1.0):
+    """
+    runs func(*setup()) until min_time has passed, setup is not timed.
+    Returns the operations per second, the peak memory of one run, and the blocks allocated
+    by one run that are still alive after it, including its result
+    """
+    runs = 0
+    elapsed = 0.0
+    while runs == 0 or elapsed < min_time:
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        func(*args)
+        elapsed += time.perf_counter() - start
+        runs += 1
+
+    args = setup() if setup else ()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = func(*args)
+    after = tracemalloc.take_snapshot()
+    del result
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    allocated_blocks = sum(
+        stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0
+    )
+
+    return {
+        "runs": runs,
+        "ops_per_sec": runs / elapsed,
+        "peak_bytes": peak,
+        "allocated_blocks": allocated_blocks,
+    }
+
+
+def benchmarks(temp_path, args):
+    """returns a dict of benchmark name to (func, setup)"""
+    manifests = kubernetes_manifests(args.manifests)
+    node = {"parameters": parameter_tree(args.node_keys)}
+
+    ref_controller = RefController(os.path.join(temp_path, "refs"))
+    for index, tag in enumerate(REF_TAGS):
+        ref_controller[tag] = Base64Ref(b"secret" + str(index).encode())
+    revealer = Revealer(ref_controller)
+    compiled_manifests = revealer.compile_obj(copy.deepcopy(manifests))
+
+    manifests_path = os.path.join(temp_path, "manifests")
+    os.makedirs(manifests_path)
+    for index, manifest in enumerate(manifests[: args.files]):
+        with open(os.path.join(manifests_path, "manifest{}.yml".format(index)), "w") as fp:
+            yaml.dump(manifest, fp, Dumper=PrettyDumper, default_flow_style=False)
+
+    # a jsonnet library imported from a search path
+    lib_path = os.path.join(temp_path, "lib")
+    os.makedirs(lib_path)
+    with open(os.path.join(lib_path, "bench.libsonnet"), "w") as fp:
+        fp.write(json.dumps({"manifests": manifests[:100]}))
+    search_paths = [temp_path]
+
+    def dump_yaml(obj):
+        yaml.dump_all(obj, io.StringIO(), Dumper=PrettyDumper, default_flow_style=False, width=inf)
+
+    def search_imports_cold():
+        JSONNET_CACHE.clear()
+        return ()
+
+    def deep_get_all(node, keys_list):
+        for keys in keys_list:
+            deep_get(node, keys)
+
+    # lookups of every first-level key, as done when resolving inventory paths
+    keys_list = [["parameters", key] for key in node["parameters"]]
+
+    suite = {
+        "revealer_compile_obj": (
+            lambda obj: revealer.compile_obj(obj, target_name="bench"),
+            lambda: (copy.deepcopy(manifests),),
+        ),
+        "revealer_reveal_obj": (revealer.reveal_obj, lambda: (copy.deepcopy(compiled_manifests),)),
+        "pretty_dumper_yaml": (dump_yaml, lambda: (manifests,)),
+        "prune_empty": (prune_empty, lambda: (manifests,)),
+        "dictionary_hash": (dictionary_hash, lambda: (node,)),
+        "directory_hash": (directory_hash, lambda: (manifests_path,)),
+        "deep_get": (deep_get_all, lambda: (node, keys_list)),
+        "search_imports": (
+            lambda: search_imports(temp_path, "lib/bench.libsonnet", search_paths),
+            None,
+        ),
+        "search_imports_cold": (
+            lambda: search_imports(temp_path, "lib/bench.libsonnet", search_paths),
+            search_imports_cold,
+        ),
+    }
+
+    try:
+        from kapitan.inventory.omegaconf_inv import OmegaConfBackend
+        from kapitan.inventory.resolvers import register_resolvers
+
+        inventory_path = os.path.join(temp_path, "project", "inventory")
+        generate_project(
+            os.path.join(temp_path, "project"),
+            targets=1,
+            classes=10,
+            depth=3,
+            parameters=args.node_keys // 30,
+        )
+        backend = OmegaConfBackend(inventory_path)
+        register_resolvers(inventory_path)
+
+        def load_target_setup():
+            # classes are cached by the backend between targets
+            OmegaConfBackend.classes_cache = {}
+            return (backend.get_selected_targets()[0],)
+
+        suite["omegaconf_load_target"] = (backend.load_target, load_target_setup)
+    except Exception as e:
+        suite["omegaconf_load_target"] = e
+
+    return suite
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--manifests", type=int, default=5000, help="number of Kubernetes manifests")
+    parser.add_argument("--node-keys", type=int, default=50000, help="number of keys in the inventory node")
+    parser.add_argument("--files", type=int, default=500, help="number of files hashed by directory_hash")
+    parser.add_argument("--min-time", type=float, default=1.0, help="minimum seconds to run each benchmark")
+    parser.add_argument("--only", nargs="+", metavar="NAME", help="only run these benchmarks")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    temp_path = tempfile.mkdtemp()
+    results = {}
+    try:
+        for name, bench in benchmarks(temp_path, args).items():
+            if args.only and name not in args.only:
+                continue
+            try:
+                if isinstance(bench, Exception):
+                    raise bench
+                func, setup = bench
+                result = measure(func, setup, args.min_time)
+            except Exception as e:
+                results[name] = {"error": str(e)}
+                print("{:<24} failed: {}".format(name, e))
+                continue
+            results[name] = result
+            print(
+                "{:<24} {:>12.2f} ops/sec {:>12,d} bytes peak {:>10,d} blocks".format(
+                    name, result["ops_per_sec"], result["peak_bytes"], result["allocated_blocks"]
+                )
+            )
+    finally:
+        shutil.rmtree(temp_path)
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 The Kapitan Authors
+# SPDX-FileCopyrightText: 2020 The Kapitan Authors <kapitan-admins@googlegroups.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+benchmark of rendering reclass inventories serially and with --reclass-parallel.
+
+Generates a project with benchmarks.inventory_generator and times rendering its
+reclass inventory in the main process, and on pools of compile processes started
+beforehand, as by kapitan compile. Run from the repository root:
+
+    python -m benchmarks.reclass_parallel --targets 2000 --processes 4 8
+
+With --queries, every target reads the exports of all targets with an inventory query.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.inventory_generator import generate_project
+from kapitan import cached
+from kapitan.inventory.reclass import ReclassBackend
+from kapitan.targets import worker_pool
+
+
+def time_inventory(backend, repeat):
+    """returns the fastest of repeat renders of the inventory of backend, and the number of nodes"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        inventory = backend.inventory()
+        timings.append(time.perf_counter() - start)
+    return min(timings), len(inventory["nodes"])
+
+
+def run(inventory_path, processes, repeat=1, start_method=None):
+    """returns the serial render time of inventory_path, and the parallel one for each number of processes"""
+    serial, num_nodes = time_inventory(ReclassBackend(inventory_path, False), repeat)
+    result = {"nodes": num_nodes, "serial": round(serial, 4), "parallel": {}}
+    for num_processes in processes:
+        pool = worker_pool(num_processes, start_method=start_method)
+        cached.pool = pool
+        try:
+            parallel, _ = time_inventory(ReclassBackend(inventory_path, False, parallel=True), repeat)
+        finally:
+            cached.pool = None
+            pool.terminate()
+            pool.join()
+        result["parallel"][num_processes] = round(parallel, 4)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--targets", type=int, default=2000, help="number of targets")
+    parser.add_argument("--classes", type=int, default=5, help="class chains included by each target")
+    parser.add_argument("--depth", type=int, default=3, help="inheritance depth of each class chain")
+    parser.add_argument("--parameters", type=int, default=100, help="parameters added by each class")
+    parser.add_argument("--processes", type=int, nargs="+", default=[4], help="numbers of processes")
+    parser.add_argument("--repeat", type=int, default=1, help="keep the fastest of this many renders")
+    parser.add_argument("--queries", action="store_true", help="add an inventory query to every target")
+    parser.add_argument("--start-method", choices=("spawn", "forkserver"), default="spawn")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    temp_path = tempfile.mkdtemp()
+    try:
+        generate_project(
+            temp_path, args.targets, args.classes, args.depth, args.parameters, queries=args.queries
+        )
+        result = run(os.path.join(temp_path, "inventory"), args.processes, args.repeat, args.start_method)
+    finally:
+        shutil.rmtree(temp_path)
+
+    print("{:>6} nodes serial: {:.2f}s".format(result["nodes"], result["serial"]))
+    for num_processes, parallel in result["parallel"].items():
+        print(
+            "{:>6} nodes on {} processes: {:.2f}s ({:.1f}x)".format(
+                result["nodes"], num_processes, parallel, result["serial"] / parallel
+            )
+        )
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(result, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
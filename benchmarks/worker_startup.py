@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 The Kapitan Authors
+# SPDX-FileCopyrightText: 2020 The Kapitan Authors <kapitan-admins@googlegroups.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+benchmark of the time compile processes take to start.
+
+For each start method of --worker-start-method, starts pools of compile
+processes and measures the seconds until every process has imported kapitan
+and is ready for its first target. The first pool of the forkserver also
+starts the forkserver, later pools reuse it, as with --watch and recycled
+workers. Run from the repository root:
+
+    python -m benchmarks.worker_startup --processes 4 8 --pools 3
+"""
+
+import argparse
+import json
+import time
+
+from kapitan.targets import worker_context
+
+START_METHODS = ("spawn", "forkserver")
+
+
+def worker_ready(ready_queue):
+    """pool initializer reporting when a process is ready for its first target"""
+    # compile tasks need the compile functions, imported by spawned processes when unpickling them
+    import kapitan.targets  # noqa: F401
+
+    ready_queue.put(time.time())
+
+
+def time_pool_startup(context, processes):
+    """returns the seconds until all processes of a new pool of context are ready"""
+    ready_queue = context.SimpleQueue()
+    start = time.time()
+    pool = context.Pool(processes, initializer=worker_ready, initargs=(ready_queue,))
+    try:
+        ready = [ready_queue.get() for _ in range(processes)]
+    finally:
+        pool.terminate()
+        pool.join()
+    return max(ready) - start
+
+
+def run(start_method, processes, pools):
+    """returns the startup time of pools consecutive pools of processes processes"""
+    context = worker_context(start_method)
+    timings = [time_pool_startup(context, processes) for _ in range(pools)]
+    return {
+        "start_method": start_method,
+        "processes": processes,
+        "first_pool": round(timings[0], 4),
+        "next_pools": round(min(timings[1:]), 4) if len(timings) > 1 else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--processes", type=int, nargs="+", default=[4], help="numbers of processes")
+    parser.add_argument("--pools", type=int, default=3, help="pools started per start method")
+    parser.add_argument(
+        "--start-methods", nargs="+", default=list(START_METHODS), choices=START_METHODS, help="start methods"
+    )
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    for processes in args.processes:
+        for start_method in args.start_methods:
+            result = run(start_method, processes, args.pools)
+            results.append(result)
+            print(
+                "{:>4} processes {:<10}: first pool {:.2f}s, next pools {}".format(
+                    processes,
+                    start_method,
+                    result["first_pool"],
+                    "{:.2f}s".format(result["next_pools"]) if result["next_pools"] is not None else "-",
+                )
+            )
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,8 @@
 
 "cached module"
 
+import multiprocessing.pool
+
 inv = {}
 inv_cache = {}
 gpg_obj = None
@@ -19,10 +21,19 @@ revealer_obj = None
 args = {}  # args won't need resetting
 inv_sources = set()
 pool = None
+# paths and inventories read by the target being compiled, None when not recorded
+read_set = None
+
+
+def running_pool():
+    """returns pool if it is set and accepts tasks, None otherwise"""
+    if pool is not None and pool._state == multiprocessing.pool.RUN:
+        return pool
+    return None
 
 
 def reset_cache():
-    global inv, inv_cache, gpg_obj, gkms_obj, awskms_obj, azkms_obj, dot_kapitan, ref_controller_obj, revealer_obj, inv_sources
+    global inv, inv_cache, gpg_obj, gkms_obj, awskms_obj, azkms_obj, dot_kapitan, ref_controller_obj, revealer_obj, inv_sources, read_set
 
     inv = {}
     inv_cache = {}
@@ -34,6 +45,7 @@ def reset_cache():
     dot_kapitan = {}
     ref_controller_obj = None
     revealer_obj = None
+    read_set = None
 
 
 def from_dict(cache_dict):
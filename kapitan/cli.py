@@ -25,9 +25,10 @@ from kapitan.lint import start_lint
 from kapitan.refs.base import RefController, Revealer
 from kapitan.refs.cmd_parser import handle_refs_command
 from kapitan.resources import generate_inventory, resource_callbacks, search_imports
-from kapitan.targets import compile_targets, schema_validate_compiled
+from kapitan.targets import compile_targets, merge_shards, schema_validate_compiled
 from kapitan.utils import check_version, from_dot_kapitan, searchvar
 from kapitan.version import DESCRIPTION, PROJECT_NAME, VERSION
+from kapitan.watch import watch_targets
 
 
 def trigger_eval(args):
@@ -54,6 +55,21 @@ def trigger_eval(args):
         print(json_output)
 
 
+def parse_shard(value):
+    """parses --shard I/N into (I, N), where I is 1-based"""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("{} is not formatted like I/N, e.g. 3/8".format(value))
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError("shard index must be between 1 and {}".format(count))
+    return index, count
+
+
+def trigger_merge(args):
+    merge_shards(args.shard_paths, args.output_path)
+
+
 def trigger_compile(args):
     search_paths = [os.path.abspath(path) for path in args.search_paths]
 
@@ -65,7 +81,15 @@ def trigger_compile(args):
     cached.ref_controller_obj = ref_controller
     cached.revealer_obj = Revealer(ref_controller)
 
-    compile_targets(
+    # targets to profile can be comma separated, e.g. --profile-targets foo,bar
+    profile_targets = args.profile_targets
+    if isinstance(profile_targets, str):
+        profile_targets = [profile_targets]
+    profile_targets = [name for arg in profile_targets for name in arg.split(",") if name]
+
+    # --watch keeps compiling the targets affected by changes
+    compile_func = watch_targets if args.watch else compile_targets
+    compile_func(
         args.inventory_path,
         search_paths,
         args.output_path,
@@ -80,6 +104,7 @@ def trigger_compile(args):
         cache_paths=args.cache_paths,
         fetch=args.fetch,
         force_fetch=args.force_fetch,
+        fetch_overlap=args.fetch_overlap,
         validate=args.validate,
         schemas_path=args.schemas_path,
         jinja2_filters=args.jinja2_filters,
@@ -88,6 +113,20 @@ def trigger_compile(args):
         helm_refs=args.helm_refs,
         helm_refs_base64=args.helm_refs_base64,
         compose_node_name=args.compose_node_name,
+        atomic_output=args.atomic_output,
+        parallel_inputs=args.parallel_inputs,
+        profile_out=args.profile_out,
+        profile_targets=profile_targets,
+        profile_memory=args.profile_memory,
+        manifest=args.manifest,
+        stream_inventory=args.stream_inventory,
+        shard=args.shard,
+        shard_by_duration=args.shard_by_duration,
+        keep_going=args.keep_going,
+        worker_max_targets=args.worker_max_targets,
+        worker_max_memory=args.worker_max_memory,
+        worker_start_method=args.worker_start_method,
+        async_output=args.async_output,
     )
 
 
@@ -150,6 +189,20 @@ def build_parser():
         action="store_true",
         default=from_dot_kapitan("inventory_backend", "migrate", False),
     )
+    inventory_backend_group.add_argument(
+        "--inventory-cache",
+        help="save the rendered inventory to {} and only render targets again "
+        "when their inventory files change".format(defaults.INVENTORY_CACHE_PATH),
+        action="store_true",
+        default=from_dot_kapitan("inventory_backend", "inventory-cache", False),
+    )
+    inventory_backend_group.add_argument(
+        "--reclass-parallel",
+        help="render the nodes of the reclass inventory in parallel on the compile processes, "
+        "or on a process per CPU outside of kapitan compile. Each process parses the classes it needs again",
+        action="store_true",
+        default=from_dot_kapitan("inventory_backend", "reclass-parallel", False),
+    )
 
     eval_parser = subparser.add_parser(
         "eval", aliases=["e"], help="evaluate jsonnet file", parents=[logger_parser]
@@ -230,6 +283,13 @@ def build_parser():
         action="store_true",
         default=from_dot_kapitan("compile", "force-fetch", False),
     )
+    compile_parser.add_argument(
+        "--fetch-overlap",
+        help="compile the targets that don't declare or read a dependency while it is fetched,\
+        instead of after all fetches, default is False",
+        action="store_true",
+        default=from_dot_kapitan("compile", "fetch-overlap", False),
+    )
     compile_parser.add_argument(
         "--validate",
         help="validate compile output against schemas as specified in inventory",
@@ -314,6 +374,131 @@ def build_parser():
         default=from_dot_kapitan("compile", "compose-node-name", False),
     )
 
+    compile_parser.add_argument(
+        "--atomic-output",
+        help="stage compiled targets next to the output path and move them into place with renames\
+        instead of copying them, default is False",
+        action="store_true",
+        default=from_dot_kapitan("compile", "atomic-output", False),
+    )
+
+    compile_parser.add_argument(
+        "--watch",
+        help="keep running and recompile the targets affected by changes in the inventory\
+        and search paths, can't be used with --fetch, default is False",
+        action="store_true",
+        default=from_dot_kapitan("compile", "watch", False),
+    )
+
+    compile_parser.add_argument(
+        "--parallel-inputs",
+        help="compile the inputs of a target in parallel, unless their paths overlap,\
+        default is False",
+        action="store_true",
+        default=from_dot_kapitan("compile", "parallel-inputs", False),
+    )
+
+    compile_parser.add_argument(
+        "--profile-out",
+        metavar="PATH",
+        help="write a timeline of the compilation to PATH in the Chrome trace event format,\
+        viewable in chrome://tracing or Perfetto",
+        default=from_dot_kapitan("compile", "profile-out", None),
+    )
+
+    compile_parser.add_argument(
+        "--profile-targets",
+        help="profile the compilation of targets with cProfile and write the stats\
+        to profiles/ in the output path, default is none",
+        type=str,
+        nargs="+",
+        default=from_dot_kapitan("compile", "profile-targets", []),
+        metavar="TARGET",
+    )
+
+    compile_parser.add_argument(
+        "--profile-memory",
+        help="also trace the memory allocations of profiled targets with tracemalloc,\
+        default is False",
+        action="store_true",
+        default=from_dot_kapitan("compile", "profile-memory", False),
+    )
+
+    compile_parser.add_argument(
+        "--stream-inventory",
+        help="render the inventory of each target in the compile processes and compile it\
+        right away, instead of rendering the whole inventory first, default is False",
+        action="store_true",
+        default=from_dot_kapitan("compile", "stream-inventory", False),
+    )
+
+    compile_parser.add_argument(
+        "--manifest",
+        help="write the sha256, size and producing target and input of every compiled file\
+        to .kapitan_manifest.json in the compiled path, default is False",
+        action="store_true",
+        default=from_dot_kapitan("compile", "manifest", False),
+    )
+
+    compile_parser.add_argument(
+        "--shard",
+        metavar="I/N",
+        type=parse_shard,
+        help="only compile shard I of N deterministic shards of the targets, e.g. 3/8,\
+        merge the outputs of all shards with 'kapitan merge'",
+        default=from_dot_kapitan("compile", "shard", None),
+    )
+
+    compile_parser.add_argument(
+        "--shard-by-duration",
+        help="balance --shard by the compile durations saved in .kapitan_cache by --cache,\
+        which must be the same on every machine, default is False",
+        action="store_true",
+        default=from_dot_kapitan("compile", "shard-by-duration", False),
+    )
+
+    compile_parser.add_argument(
+        "--keep-going",
+        help="keep compiling the other targets when a target fails, write their output\
+        and report all failed targets at the end, default is False",
+        action="store_true",
+        default=from_dot_kapitan("compile", "keep-going", False),
+    )
+
+    compile_parser.add_argument(
+        "--worker-max-targets",
+        type=int,
+        metavar="INT",
+        help="replace a compile process with a new one after it compiled INT targets,\
+        or compile list items with --parallel-inputs, default is none",
+        default=from_dot_kapitan("compile", "worker-max-targets", None),
+    )
+
+    compile_parser.add_argument(
+        "--worker-max-memory",
+        type=int,
+        metavar="MIB",
+        help="replace a compile process with a new one once its resident memory is above MIB\
+        after a target, ignored where the resident memory can't be read, e.g. on macOS, default is none",
+        default=from_dot_kapitan("compile", "worker-max-memory", None),
+    )
+
+    compile_parser.add_argument(
+        "--worker-start-method",
+        choices=["spawn", "forkserver"],
+        help="start compile processes with spawn, which imports kapitan in every process,\
+        or forkserver, which imports it once and forks the processes, default is spawn",
+        default=from_dot_kapitan("compile", "worker-start-method", "spawn"),
+    )
+
+    compile_parser.add_argument(
+        "--async-output",
+        help="write compiled files in a background thread of each compile process\
+        while the next files are rendered, default is False",
+        action="store_true",
+        default=from_dot_kapitan("compile", "async-output", False),
+    )
+
     compile_parser.add_argument(
         "--schemas-path",
         default=from_dot_kapitan("validate", "schemas-path", "./schemas"),
@@ -379,6 +564,14 @@ def build_parser():
         default=from_dot_kapitan("inventory", "target-name", ""),
         help="set target name, default is all targets",
     )
+    inventory_parser.add_argument(
+        "--affected-by",
+        nargs="+",
+        default=from_dot_kapitan("inventory", "affected-by", []),
+        metavar="PATH",
+        help="list the targets rendered from the inventory files or directories PATH, "
+        "using the index saved to {}".format(defaults.INVENTORY_CACHE_PATH),
+    )
     inventory_parser.add_argument(
         "--inventory-path",
         default=from_dot_kapitan("inventory", "inventory-path", "./inventory"),
@@ -610,6 +803,27 @@ def build_parser():
         default=from_dot_kapitan("inventory", "omegaconf", False),
     )
 
+    merge_parser = subparser.add_parser(
+        "merge",
+        help="merge the outputs of compile --shard into one compiled directory",
+        parents=[logger_parser],
+    )
+    merge_parser.set_defaults(func=trigger_merge, name="merge")
+
+    merge_parser.add_argument(
+        "shard_paths",
+        nargs="+",
+        metavar="SHARD_PATH",
+        help="output paths of compile --shard",
+    )
+    merge_parser.add_argument(
+        "--output-path",
+        type=str,
+        default=from_dot_kapitan("compile", "output-path", "."),
+        metavar="PATH",
+        help='set output path, default is "."',
+    )
+
     init_parser = subparser.add_parser(
         "init",
         help="initialize a directory with the recommended kapitan project skeleton.",
@@ -18,3 +18,6 @@ FILE_PATH_FORMAT = "v{}-%s/{}.json" % SCHEMA_TYPE
 
 # default path from where user defined custom filters are read
 DEFAULT_JINJA2_FILTERS_PATH = os.path.join("lib", "jinja2_filters.py")
+
+# default path of the rendered inventories saved by --inventory-cache
+INVENTORY_CACHE_PATH = ".kapitan_inventory_cache"
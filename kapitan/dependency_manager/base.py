@@ -35,6 +35,16 @@ def fetch_dependencies(output_path, target_objs, save_dir, force, pool):
     all dependencies are first fetched into save_dir, after which they are copied to their respective output_path.
     overwites older version of existing dependencies if force fetced
     """
+    for fetch, dep_mappings in dependency_fetches(output_path, target_objs, save_dir, force):
+        [p.get() for p in pool.imap_unordered(fetch, dep_mappings) if p]
+
+
+def dependency_fetches(output_path, target_objs, save_dir, force):
+    """
+    returns (fetch, dep_mappings) for the http, git and helm dependencies in target_objs.
+    fetch is run with each (source, deps) item of dep_mappings to fetch source into save_dir
+    and copy it to the output_path of each of deps
+    """
     # there could be multiple dependency items per source_uri due to reclass inheritance or
     # other user requirements. So create a mapping from source_uri to a set of dependencies with
     # that source_uri
@@ -85,9 +95,11 @@ def fetch_dependencies(output_path, target_objs, save_dir, force, pool):
     git_worker = partial(fetch_git_dependency, save_dir=save_dir, force=force)
     http_worker = partial(fetch_http_dependency, save_dir=save_dir, force=force)
     helm_worker = partial(fetch_helm_chart, save_dir=save_dir, force=force)
-    [p.get() for p in pool.imap_unordered(http_worker, http_deps.items()) if p]
-    [p.get() for p in pool.imap_unordered(git_worker, git_deps.items()) if p]
-    [p.get() for p in pool.imap_unordered(helm_worker, helm_deps.items()) if p]
+    return [
+        (http_worker, list(http_deps.items())),
+        (git_worker, list(git_deps.items())),
+        (helm_worker, list(helm_deps.items())),
+    ]
 
 
 def fetch_git_dependency(dep_mapping, save_dir, force, item_type="Dependency"):
@@ -7,10 +7,15 @@
 
 import base64
 import glob
+import hashlib
+import io
 import itertools
 import json
 import logging
 import os
+import stat
+import threading
+from collections import Counter, deque
 from collections.abc import Mapping
 from math import inf
 
@@ -18,11 +23,15 @@ import toml
 import yaml
 
 from kapitan.errors import CompileError, KapitanError
+from kapitan.profiling import span
 from kapitan.refs.base import Revealer
-from kapitan.utils import PrettyDumper
+from kapitan.utils import PrettyDumper, file_sha256, record_read
 
 logger = logging.getLogger(__name__)
 
+# bytes of compiled files waiting to be written by the OutputWriter of a process
+OUTPUT_WRITER_MAX_BYTES = 64 * 2**20
+
 
 class InputType(object):
     def __init__(self, type_name, compile_path, search_paths, ref_controller):
@@ -43,6 +52,9 @@ class InputType(object):
         # expand any globbed paths, taking into account provided search paths
         input_paths = []
         for input_path in comp_obj["input_paths"]:
+            for path in self.search_paths:
+                # record the directory globbed paths are looked up in, so new matches are noticed
+                record_read(os.path.join(path, glob_base(input_path)))
             globbed_paths = [glob.glob(os.path.join(path, input_path)) for path in self.search_paths]
             inputs = list(itertools.chain.from_iterable(globbed_paths))
             # remove duplicate inputs
@@ -116,43 +128,52 @@ class CompilingFile(object):
         target_name = self.kwargs.get("target_name", None)
 
         if reveal:
-            self.fp.write(self.revealer.reveal_raw(data))
+            with span("reveal refs", "refs", file=self.fp.name):
+                data = self.revealer.reveal_raw(data)
         else:
-            self.fp.write(self.revealer.compile_raw(data, target_name=target_name))
+            with span("compile refs", "refs", file=self.fp.name):
+                data = self.revealer.compile_raw(data, target_name=target_name)
+        self.fp.write(data)
+
+    def compile_refs(self, obj):
+        """returns obj with its refs compiled, or revealed if reveal is set"""
+        reveal = self.kwargs.get("reveal", False)
+        target_name = self.kwargs.get("target_name", None)
+        if reveal:
+            with span("reveal refs", "refs", file=self.fp.name):
+                return self.revealer.reveal_obj(obj)
+        with span("compile refs", "refs", file=self.fp.name):
+            return self.revealer.compile_obj(obj, target_name=target_name)
 
     def write_yaml(self, obj):
         """recursively compile or reveal refs and convert obj to yaml and write to file"""
         indent = self.kwargs.get("indent", 2)
-        reveal = self.kwargs.get("reveal", False)
         helm_refs_base64 = self.kwargs.get("helm_refs_base64", False)
-        target_name = self.kwargs.get("target_name", None)
-        if reveal:
-            obj = self.revealer.reveal_obj(obj)
-        else:
-            obj = self.revealer.compile_obj(obj, target_name=target_name)
+        obj = self.compile_refs(obj)
 
         if helm_refs_base64:
             obj = check_data_for_b64(obj)
 
         if obj:
-            if isinstance(obj, Mapping):
-                yaml.dump(
-                    obj,
-                    stream=self.fp,
-                    indent=indent,
-                    Dumper=PrettyDumper,
-                    default_flow_style=False,
-                    width=inf,
-                )
-            else:
-                yaml.dump_all(
-                    obj,
-                    stream=self.fp,
-                    indent=indent,
-                    Dumper=PrettyDumper,
-                    default_flow_style=False,
-                    width=inf,
-                )
+            with span("yaml dump", "serialize", file=self.fp.name):
+                if isinstance(obj, Mapping):
+                    yaml.dump(
+                        obj,
+                        stream=self.fp,
+                        indent=indent,
+                        Dumper=PrettyDumper,
+                        default_flow_style=False,
+                        width=inf,
+                    )
+                else:
+                    yaml.dump_all(
+                        obj,
+                        stream=self.fp,
+                        indent=indent,
+                        Dumper=PrettyDumper,
+                        default_flow_style=False,
+                        width=inf,
+                    )
 
             logger.debug("Wrote %s", self.fp.name)
         else:
@@ -161,39 +182,56 @@ class CompilingFile(object):
     def write_json(self, obj):
         """recursively hash or reveal refs and convert obj to json and write to file"""
         indent = self.kwargs.get("indent", 2)
-        reveal = self.kwargs.get("reveal", False)
-        target_name = self.kwargs.get("target_name", None)
-        if reveal:
-            obj = self.revealer.reveal_obj(obj)
-        else:
-            obj = self.revealer.compile_obj(obj, target_name=target_name)
+        obj = self.compile_refs(obj)
         if obj:
-            json.dump(obj, self.fp, indent=indent)
+            with span("json dump", "serialize", file=self.fp.name):
+                json.dump(obj, self.fp, indent=indent)
             logger.debug("Wrote %s", self.fp.name)
         else:
             logger.debug("%s is Empty, skipped writing output", self.fp.name)
 
     def write_toml(self, obj):
         """recursively compile or reveal refs and convert obj to toml and write to file"""
-        reveal = self.kwargs.get("reveal", False)
-        target_name = self.kwargs.get("target_name", None)
-        if reveal:
-            obj = self.revealer.reveal_obj(obj)
-        else:
-            obj = self.revealer.compile_obj(obj, target_name=target_name)
+        obj = self.compile_refs(obj)
         if obj:
-            toml.dump(obj, self.fp)
+            with span("toml dump", "serialize", file=self.fp.name):
+                toml.dump(obj, self.fp)
             logger.debug("Wrote %s", self.fp.name)
         else:
             logger.debug("%s is Empty, skipped writing output", self.fp.name)
 
 
+class CompiledBuffer(io.StringIO):
+    """in-memory file for CompiledFile, named after the file it will be written to"""
+
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+
+
 class CompiledFile(object):
+    # set by compile_target() for each target: files staged under stage_path
+    # are compared against their counterpart under reference_path
+    stage_path = None
+    reference_path = None
+    # hardlink unchanged files to their reference instead of writing them,
+    # only safe when no later input modifies files in place
+    link_unchanged = False
+    # counts files "written" and "unchanged" since the last reset
+    stats = Counter()
+    # if not None, the sha256, size, mtime and compile list item of the files written
+    # since the last reset, by path relative to stage_path
+    files = None
+    input_index = None
+    # if not None, the OutputWriter writing files in the background
+    writer = None
+
     def __init__(self, name, ref_controller, **kwargs):
         self.name = name
         self.fp = None
         self.ref_controller = ref_controller
         self.kwargs = kwargs
+        self.input_index = CompiledFile.input_index
 
     def __enter__(self):
         mode = self.kwargs.get("mode", "r")
@@ -201,12 +239,168 @@ class CompiledFile(object):
         # make sure directory for file exists
         os.makedirs(os.path.dirname(self.name), exist_ok=True)
 
-        self.fp = open(self.name, mode)
+        if mode == "w":
+            # render in memory, the file is only written on exit if its content changed
+            self.fp = CompiledBuffer(self.name)
+        else:
+            self.fp = open(self.name, mode)
         return CompilingFile(self, self.fp, self.ref_controller, **self.kwargs)
 
-    def __exit__(self, *args):
+    def __exit__(self, exc_type, *args):
+        if isinstance(self.fp, CompiledBuffer) and exc_type is None:
+            if CompiledFile.writer is not None:
+                CompiledFile.writer.write(self, self.fp.getvalue().encode())
+            else:
+                self.write_if_changed(self.fp.getvalue().encode())
         self.fp.close()
 
+    def reference_name(self):
+        """returns the path of the previously compiled counterpart of this file"""
+        if self.stage_path and self.reference_path:
+            rel_name = os.path.relpath(self.name, self.stage_path)
+            if rel_name.split(os.sep)[0] != os.pardir:
+                return os.path.join(self.reference_path, rel_name)
+        return self.name
+
+    def write_if_changed(self, data):
+        """
+        writes data to file unless its reference already holds the same content
+        and file_mode. Unchanged files keep the mtime of their reference
+        """
+        self._write_if_changed(data)
+        if CompiledFile.files is not None:
+            name = os.path.relpath(self.name, self.stage_path) if self.stage_path else self.name
+            CompiledFile.files[name] = {
+                "sha256": hashlib.sha256(data).hexdigest(),
+                "size": len(data),
+                "mtime_ns": os.stat(self.name).st_mtime_ns,
+                "input_index": self.input_index,
+            }
+
+    def _write_if_changed(self, data):
+        file_mode = self.kwargs.get("file_mode", None)
+        reference_name = self.reference_name()
+        try:
+            reference_stat = os.stat(reference_name)
+            unchanged = (
+                reference_stat.st_size == len(data)
+                and (file_mode is None or stat.S_IMODE(reference_stat.st_mode) == file_mode)
+                and file_sha256(reference_name) == hashlib.sha256(data).hexdigest()
+            )
+        except OSError:
+            unchanged = False
+
+        if unchanged:
+            CompiledFile.stats["unchanged"] += 1
+            if os.path.realpath(reference_name) == os.path.realpath(self.name):
+                logger.debug("%s is unchanged, skipped writing", self.name)
+                return
+            if self.link_unchanged:
+                try:
+                    self._unlink_shared()
+                    os.link(reference_name, self.name)
+                    logger.debug("%s is unchanged, linked to %s", self.name, reference_name)
+                    return
+                except OSError:
+                    pass
+        else:
+            CompiledFile.stats["written"] += 1
+
+        # never write through a link to a reference file
+        self._unlink_shared()
+        with open(self.name, "wb") as fp:
+            fp.write(data)
+        if file_mode is not None:
+            os.chmod(self.name, file_mode)
+        if unchanged:
+            os.utime(self.name, ns=(reference_stat.st_atime_ns, reference_stat.st_mtime_ns))
+
+    def _unlink_shared(self):
+        """removes file if it exists and is a hardlink shared with another path"""
+        try:
+            if os.lstat(self.name).st_nlink > 1:
+                os.unlink(self.name)
+        except FileNotFoundError:
+            pass
+
+
+class OutputWriter(object):
+    """
+    writes compiled files in a background thread, so that the next files are rendered
+    while earlier ones are written. Writing blocks while max_bytes of files are waiting
+    """
+
+    # the writer of this process, see get()
+    _writer = None
+
+    def __init__(self, max_bytes=OUTPUT_WRITER_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.queue = deque()
+        # files queued or being written, and their size
+        self.pending = 0
+        self.pending_bytes = 0
+        self.error = None
+        self.condition = threading.Condition()
+        # a forked process doesn't have the thread of its parent
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self._run, name="kapitan-output-writer", daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def get(cls):
+        """returns the writer of this process"""
+        if cls._writer is None or cls._writer.pid != os.getpid():
+            cls._writer = cls()
+        return cls._writer
+
+    def write(self, compiled_file, data):
+        """queues data to be written with compiled_file.write_if_changed()"""
+        with self.condition:
+            # a file larger than max_bytes waits for the queue to be empty
+            while self.pending and self.pending_bytes + len(data) > self.max_bytes:
+                self.condition.wait()
+            self.queue.append((compiled_file, data))
+            self.pending += 1
+            self.pending_bytes += len(data)
+            self.condition.notify_all()
+
+    def flush(self, raise_error=True):
+        """waits until the queued files are written, and raises the first error writing them"""
+        with self.condition:
+            while self.pending:
+                self.condition.wait()
+            error, self.error = self.error, None
+        if error is not None and raise_error:
+            raise error
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                compiled_file, data = self.queue.popleft()
+            # files queued after an error are dropped, the target failed
+            if self.error is None:
+                try:
+                    with span("write", "output", file=compiled_file.name):
+                        compiled_file.write_if_changed(data)
+                except Exception as e:
+                    self.error = e
+            with self.condition:
+                self.pending -= 1
+                self.pending_bytes -= len(data)
+                self.condition.notify_all()
+
+
+def glob_base(input_path):
+    """returns the longest leading part of input_path without glob patterns"""
+    base_parts = []
+    for part in input_path.split("/"):
+        if glob.has_magic(part):
+            break
+        base_parts.append(part)
+    return "/".join(base_parts)
+
 
 def check_data_for_b64(yml_obj):
     """
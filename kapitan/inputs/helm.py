@@ -8,6 +8,7 @@
 import base64
 import logging
 import os
+import shutil
 import tempfile
 
 import yaml
@@ -16,6 +17,7 @@ from kapitan.errors import CompileError, HelmTemplateError
 from kapitan.helm_cli import helm_cli
 from kapitan.inputs.base import CompiledFile, InputType
 from kapitan.inputs.kadet import BaseModel, BaseObj, Dict
+from kapitan.utils import record_read
 
 logger = logging.getLogger(__name__)
 
@@ -72,46 +74,53 @@ class Helm(InputType):
                 + f" The search paths were: {self.search_paths}."
             )
         self.file_path = file_path
+        for values_file in self.helm_values_files or []:
+            record_read(values_file)
 
         temp_dir = tempfile.mkdtemp()
         os.makedirs(os.path.dirname(compile_path), exist_ok=True)
-        # save the template output to temp dir first
-        _, error_message = self.render_chart(
-            chart_dir=file_path,
-            output_path=temp_dir,
-            helm_path=self.helm_path,
-            helm_params=self.helm_params,
-            helm_values_file=self.helm_values_file,
-            helm_values_files=self.helm_values_files,
-        )
-        if error_message:
-            raise HelmTemplateError(error_message)
+        try:
+            # save the template output to temp dir first
+            _, error_message = self.render_chart(
+                chart_dir=file_path,
+                output_path=temp_dir,
+                helm_path=self.helm_path,
+                helm_params=self.helm_params,
+                helm_values_file=self.helm_values_file,
+                helm_values_files=self.helm_values_files,
+            )
+            if error_message:
+                raise HelmTemplateError(error_message)
+
+            walk_root_files = os.walk(temp_dir)
+            for current_dir, _, files in walk_root_files:
+                for file in files:  # go through all the template files
+                    rel_dir = os.path.relpath(current_dir, temp_dir)
+                    rel_file_name = os.path.join(rel_dir, file)
+                    full_file_name = os.path.join(current_dir, file)
+                    with open(full_file_name, "r") as f:
+                        item_path = os.path.join(compile_path, rel_file_name)
+                        os.makedirs(os.path.dirname(item_path), exist_ok=True)
+                        with CompiledFile(
+                            item_path,
+                            self.ref_controller,
+                            mode="w",
+                            reveal=reveal,
+                            target_name=target_name,
+                            helm_refs_base64=helm_refs_base64,
+                            indent=indent,
+                        ) as fp:
+                            yml_obj = list(yaml.safe_load_all(f))
+                            if helm_refs:
+                                yml_obj = check_data_for_b64(yml_obj)
+                            fp.write_yaml(yml_obj)
+                            logger.debug("Wrote file %s to %s", full_file_name, item_path)
+        finally:
+            shutil.rmtree(temp_dir)
+            if self.helm_values_file:
+                os.remove(self.helm_values_file)
+                self.helm_values_file = None  # reset this
 
-        walk_root_files = os.walk(temp_dir)
-        for current_dir, _, files in walk_root_files:
-            for file in files:  # go through all the template files
-                rel_dir = os.path.relpath(current_dir, temp_dir)
-                rel_file_name = os.path.join(rel_dir, file)
-                full_file_name = os.path.join(current_dir, file)
-                with open(full_file_name, "r") as f:
-                    item_path = os.path.join(compile_path, rel_file_name)
-                    os.makedirs(os.path.dirname(item_path), exist_ok=True)
-                    with CompiledFile(
-                        item_path,
-                        self.ref_controller,
-                        mode="w",
-                        reveal=reveal,
-                        target_name=target_name,
-                        helm_refs_base64=helm_refs_base64,
-                        indent=indent,
-                    ) as fp:
-                        yml_obj = list(yaml.safe_load_all(f))
-                        if helm_refs:
-                            yml_obj = check_data_for_b64(yml_obj)
-                        fp.write_yaml(yml_obj)
-                        logger.debug("Wrote file %s to %s", full_file_name, item_path)
-
-        self.helm_values_file = None  # reset this
         self.helm_params = {}
         self.helm_values_files = []
 
@@ -223,11 +232,14 @@ def render_chart(
 
     # If output_path is '-', output is a string with rendered chart
     if output_path == "-":
-        _, helm_output = tempfile.mkstemp(".helm_output.yml", text=True)
-        with open(helm_output, "w+") as f:
-            error_message = helm_cli(helm_path, args, stdout=f)
-            f.seek(0)
-            return (f.read(), error_message)
+        fd, helm_output = tempfile.mkstemp(".helm_output.yml", text=True)
+        try:
+            with os.fdopen(fd, "w+") as f:
+                error_message = helm_cli(helm_path, args, stdout=f)
+                f.seek(0)
+                return (f.read(), error_message)
+        finally:
+            os.remove(helm_output)
 
     if output_file:
         with open(os.path.join(output_path, output_file), "wb") as f:
@@ -244,8 +256,8 @@ def write_helm_values_file(helm_values: dict):
     Dump helm values into a yaml file whose path will
     be passed over to helm binary
     """
-    _, helm_values_file = tempfile.mkstemp(".helm_values.yml", text=True)
-    with open(helm_values_file, "w") as fp:
+    fd, helm_values_file = tempfile.mkstemp(".helm_values.yml", text=True)
+    with os.fdopen(fd, "w") as fp:
         yaml.safe_dump(helm_values, fp)
 
     return helm_values_file
@@ -274,9 +286,13 @@ class HelmChart(BaseModel):
         helm_values_file = None
         if self.helm_values != {}:
             helm_values_file = write_helm_values_file(self.helm_values)
-        output, error_message = render_chart(
-            self.chart_dir, "-", self.helm_path, self.helm_params, helm_values_file, None
-        )
+        try:
+            output, error_message = render_chart(
+                self.chart_dir, "-", self.helm_path, self.helm_params, helm_values_file, None
+            )
+        finally:
+            if helm_values_file:
+                os.remove(helm_values_file)
         if error_message:
             raise HelmTemplateError(error_message)
 
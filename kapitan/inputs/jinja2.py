@@ -53,13 +53,17 @@ class Jinja2(InputType):
             if self.strip_postfix and item_key.endswith(self.stripped_postfix):
                 item_key = item_key.rstrip(self.stripped_postfix)
             full_item_path = os.path.join(compile_path, item_key)
+            mode = item_value["mode"]
             with CompiledFile(
-                full_item_path, self.ref_controller, mode="w", reveal=reveal, target_name=target_name
+                full_item_path,
+                self.ref_controller,
+                mode="w",
+                reveal=reveal,
+                target_name=target_name,
+                file_mode=mode,
             ) as fp:
                 fp.write(item_value["content"])
-                mode = item_value["mode"]
-                os.chmod(full_item_path, mode)
-                logger.debug("Wrote %s with mode %.4o", full_item_path, mode)
+            logger.debug("Wrote %s with mode %.4o", full_item_path, mode)
 
     def default_output_type(self):
         # no output_type options for jinja2
@@ -19,7 +19,7 @@ from kapitan import cached
 from kapitan.errors import CompileError
 from kapitan.inputs.base import CompiledFile, InputType
 from kapitan.resources import inventory as inventory_func
-from kapitan.utils import prune_empty
+from kapitan.utils import prune_empty, record_read
 
 # Set external kadet exception to kapitan.error.CompileError
 kadet.ABORT_EXCEPTION_TYPE = CompileError
@@ -73,6 +73,7 @@ def load_from_search_paths(module_name):
     for path in search_paths.get():
         try:
             _path = os.path.join(path, module_name)
+            record_read(_path)
             mod, spec = module_from_path(_path, check_name=module_name)
             spec.loader.exec_module(mod)
             return mod
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 The Kapitan Authors
+# SPDX-FileCopyrightText: 2020 The Kapitan Authors <kapitan-admins@googlegroups.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"persistent cache of rendered inventories, invalidated by the files of the inventory"
+
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+from kapitan.errors import InventoryError
+from kapitan.version import VERSION
+
+logger = logging.getLogger(__name__)
+
+# changed when the content of cache files changes
+CACHE_FORMAT = 2
+
+
+def file_digest(path):
+    """returns the sha256 hex digest of the content of path"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(2**20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_outside(relpath):
+    """returns True if relpath, relative to a directory, is outside of it"""
+    return relpath == os.pardir or relpath.startswith(os.pardir + os.sep)
+
+
+def source_index(sources):
+    """returns a dict of each file in sources to the sorted names of the nodes rendered from it"""
+    if sources is None:
+        return None
+    index = {}
+    for name, paths in sources.items():
+        for path in paths:
+            index.setdefault(path, []).append(name)
+    return {path: sorted(names) for path, names in index.items()}
+
+
+def inventory_files(inventory_path, saved_files=None):
+    """
+    returns a dict of the path relative to inventory_path of each file in it to its
+    (size, mtime_ns, sha256 digest). Hidden files and directories are skipped.
+    Digests are taken from saved_files for files whose size and mtime did not change
+    """
+    saved_files = saved_files or {}
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(inventory_path):
+        dirnames[:] = sorted(dirname for dirname in dirnames if not dirname.startswith("."))
+        for filename in filenames:
+            if filename.startswith("."):
+                continue
+            path = os.path.join(dirpath, filename)
+            stat = os.stat(path)
+            relpath = os.path.relpath(path, inventory_path)
+            saved = saved_files.get(relpath)
+            if saved and saved[:2] == (stat.st_size, stat.st_mtime_ns):
+                files[relpath] = saved
+            else:
+                files[relpath] = (stat.st_size, stat.st_mtime_ns, file_digest(path))
+    return files
+
+
+class InventoryCache:
+    """
+    Inventory rendered by backend, saved to a file in cache_path with the size, mtime and
+    sha256 digest of each file of the inventory it was rendered from.
+    When files changed, only the nodes rendered from them are rendered again if the backend
+    tells the files of its nodes, the whole inventory otherwise.
+    The index of each file to the nodes rendered from it, transitively through classes,
+    is saved as well and answers affected_by().
+    With cache_path None, nothing is saved and the inventory and index are only kept in memory
+    """
+
+    def __init__(self, backend, cache_path):
+        self.backend = backend
+        self.inventory_path = os.path.abspath(backend.inventory_path)
+        self.key = (
+            CACHE_FORMAT,
+            VERSION,
+            type(backend).__name__,
+            self.inventory_path,
+            backend.ignore_class_notfound,
+            tuple(sorted(getattr(backend, "targets", None) or ())),
+        )
+        self.path = None
+        if cache_path is not None:
+            key_digest = hashlib.sha256(repr(self.key).encode()).hexdigest()[:16]
+            self.path = os.path.join(cache_path, "inventory-{}.pickle".format(key_digest))
+        # file -> names of the nodes rendered from it, set by get()
+        self.index = None
+
+    def load(self):
+        """returns the saved cache, None if there is none or it was saved for another key"""
+        if self.path is None:
+            return None
+        try:
+            with open(self.path, "rb") as fp:
+                saved = pickle.load(fp)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.debug("Inventory cache: ignoring unreadable %s: %s", self.path, e)
+            return None
+        if not isinstance(saved, dict) or saved.get("key") != self.key:
+            return None
+        return saved
+
+    def save(self, files, sources, inventory):
+        """writes the cache atomically, warns if it can't be written"""
+        if self.path is None:
+            return
+        saved = {
+            "key": self.key,
+            "files": files,
+            "sources": sources,
+            "index": self.index,
+            "inventory": inventory,
+        }
+        cache_dir = os.path.dirname(self.path)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=cache_dir, prefix=".inventory-")
+            try:
+                with os.fdopen(fd, "wb") as fp:
+                    pickle.dump(saved, fp, pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_path, self.path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except OSError as e:
+            logger.warning("Inventory cache: could not write %s: %s", self.path, e)
+
+    def node_sources(self, nodes):
+        """
+        returns a dict of each node name in nodes to the paths relative to inventory_path
+        of the files it was rendered from, None if the backend can't tell them
+        or if any of them is outside of inventory_path
+        """
+        sources = {}
+        for name, node in nodes.items():
+            paths = self.backend.node_sources(name, node)
+            if paths is None:
+                return None
+            relpaths = [os.path.relpath(os.path.abspath(path), self.inventory_path) for path in paths]
+            if any(is_outside(relpath) for relpath in relpaths):
+                logger.debug("Inventory cache: %s is rendered from files outside of the inventory", name)
+                return None
+            sources[name] = relpaths
+        return sources
+
+    def render(self):
+        """returns the whole inventory rendered by the backend, and the files of its nodes"""
+        inventory = self.backend.inventory()
+        return inventory, self.node_sources(inventory["nodes"])
+
+    def update(self, saved, changed):
+        """
+        returns the saved inventory with the nodes rendered from changed files rendered again,
+        and the files of its nodes. Returns None when the changes can't be scoped to nodes
+        """
+        sources = saved["sources"]
+        index = saved["index"]
+        if sources is None:
+            return None
+        nodes = saved["inventory"]["nodes"]
+        if any(node.get("exports") for node in nodes.values()):
+            # exports are read by inventory queries of other nodes
+            return None
+
+        names = list(self.backend.target_names())
+        affected = {name for name in names if name not in sources}
+        for path in changed:
+            affected.update(index.get(path, ()))
+        affected = [name for name in names if name in affected]
+        rendered = {name: self.backend.render_target(name) for name in affected}
+        rendered_sources = self.node_sources(rendered)
+        if rendered_sources is None or any(node.get("exports") for node in rendered.values()):
+            return None
+
+        # files of the nodes rendered again, before and after the changes, and of removed nodes
+        scoped = set()
+        for name in affected:
+            scoped.update(sources.get(name, ()))
+            scoped.update(rendered_sources[name])
+        for name in set(sources) - set(names):
+            scoped.update(sources[name])
+        if not changed <= scoped:
+            # e.g. a config file, or a class that was not found
+            return None
+
+        logger.debug("Inventory cache: rendered %d of %d targets again", len(affected), len(names))
+        nodes = {name: rendered[name] if name in rendered else nodes[name] for name in names}
+        sources = {name: rendered_sources[name] if name in rendered else sources[name] for name in names}
+        return self.backend.inventory_from_nodes(nodes), sources
+
+    def get(self):
+        """returns the inventory, from the cache when its files did not change"""
+        saved = self.load()
+        saved_files = saved["files"] if saved else None
+        files = inventory_files(self.inventory_path, saved_files)
+
+        if saved is None:
+            logger.debug("Inventory cache: no cache for %s, rendering inventory", self.inventory_path)
+            inventory, sources = self.render()
+        else:
+            changed = {
+                path
+                for path in files.keys() | saved_files.keys()
+                if files.get(path, (None,))[-1] != saved_files.get(path, (None,))[-1]
+            }
+            if not changed:
+                logger.debug("Inventory cache: using cached inventory for %s", self.inventory_path)
+                inventory, sources = saved["inventory"], saved["sources"]
+                if files == saved_files:
+                    self.index = saved["index"]
+                    return inventory
+            else:
+                logger.debug("Inventory cache: %d files changed in %s", len(changed), self.inventory_path)
+                updated = self.update(saved, changed)
+                inventory, sources = updated if updated else self.render()
+
+        self.index = source_index(sources)
+        self.save(files, sources, inventory)
+        return inventory
+
+    def affected_by(self, paths):
+        """
+        returns the sorted names of the targets rendered from any of paths, files or directories.
+        Paths in the inventory path that no target was rendered from, e.g. reclass-config.yml
+        or a removed class, affect all targets. Paths outside of it affect none
+        """
+        inventory = self.get()
+        if self.index is None:
+            raise InventoryError(
+                "{} doesn't tell the files targets are rendered from".format(type(self.backend).__name__)
+            )
+        affected = set()
+        for path in paths:
+            relpath = os.path.relpath(os.path.abspath(path), self.inventory_path)
+            if is_outside(relpath):
+                continue
+            sources = [
+                source
+                for source in self.index
+                if relpath in (os.curdir, source) or source.startswith(relpath + os.sep)
+            ]
+            if not sources:
+                affected.update(inventory["nodes"])
+            for source in sources:
+                affected.update(self.index[source])
+        return sorted(affected)
@@ -22,6 +22,9 @@ from kapitan.inventory.resolvers import register_resolvers
 
 logger = logging.getLogger(__name__)
 
+# fewer targets are rendered in this process, as rendering them takes less than starting processes
+MP_MIN_TARGETS = 32
+
 
 class InventoryTarget:
     targets_path: str
@@ -124,16 +127,23 @@ class OmegaConfBackend:
         self.classes_searchpath = os.path.join(inventory_path, "classes")
         InventoryTarget.targets_path = self.targets_searchpath
         InventoryClass.classes_path = self.classes_searchpath
+        # target name -> target file, set by target_names()
+        self.target_paths = None
+
+    def __setstate__(self, state):
+        # the paths set on the target and class types by __init__ are not pickled
+        self.__dict__.update(state)
+        InventoryTarget.targets_path = self.targets_searchpath
+        InventoryClass.classes_path = self.classes_searchpath
 
     def inventory(self):
         register_resolvers(self.inventory_path)
         selected_targets = self.get_selected_targets()
 
-        # TODO: add flag for multiprocessing
-        use_mp = True
+        use_mp = len(selected_targets) >= MP_MIN_TARGETS
 
+        nodes = {}
         if not use_mp:
-            nodes = {}
             # load targets one by one
             for target in selected_targets:
                 try:
@@ -142,43 +152,65 @@ class OmegaConfBackend:
                 except Exception as e:
                     raise InventoryError(f"{target.name}: {e}")
         else:
-            # load targets parallel
-            # t = time()
-            manager = mp.Manager()  # bottleneck --> 90 % of the inventory time
-            # print(time() - t)
-
-            nodes = manager.dict()
-            mp.set_start_method("spawn", True)  # platform independent
-
-            if cached.pool:
-                r = cached.pool.map_async(
-                    self.inventory_worker, [(self, target, nodes) for target in selected_targets]
-                )
-                r.wait()
+            # load targets parallel, workers return the rendered nodes
+            worker_args = [(self, target) for target in selected_targets]
+            pool = cached.running_pool()
+            if pool:
+                rendered = pool.map(self.inventory_worker, worker_args)
             else:
-                with mp.Pool(len(selected_targets)) as pool:
-                    r = pool.map_async(
-                        self.inventory_worker, [(self, target, nodes) for target in selected_targets]
-                    )
-                    r.wait()
+                # platform independent
+                with mp.get_context("spawn").Pool(min(len(selected_targets), os.cpu_count())) as pool:
+                    rendered = pool.map(self.inventory_worker, worker_args)
+            for target_name, node in rendered:
+                if node is not None:
+                    nodes[target_name] = node
 
         # using nodes for reclass legacy code
-        nodes = dict(nodes)
+        return {"nodes": nodes}
 
-        # using nodes for reclass legacy code
+    def target_names(self):
+        """returns the names of the selected targets, without rendering them"""
+        if self.target_paths is None:
+            self.target_paths = {target.name: target.path for target in self.get_selected_targets()}
+        return list(self.target_paths)
+
+    def render_target(self, target_name):
+        """renders and returns the node of the selected target target_name"""
+        if self.target_paths is None:
+            self.target_names()
+        if target_name not in self.target_paths:
+            raise KeyError(target_name)
+        target_path = self.target_paths[target_name]
+        target = InventoryTarget(os.path.splitext(os.path.basename(target_path))[0], target_path)
+        target.name = target_name
+        try:
+            register_resolvers(self.inventory_path)
+            self.load_target(target)
+        except Exception as e:
+            raise InventoryError(f"{target_name}: {e}")
+        return {"parameters": target.parameters}
+
+    def node_sources(self, target_name, node):
+        """returns None, nodes don't tell the classes they were rendered from"""
+        return None
+
+    def inventory_from_nodes(self, nodes):
+        """returns the inventory of nodes, as returned by inventory()"""
         return {"nodes": nodes}
 
     @staticmethod
     def inventory_worker(zipped_args):
+        """returns the name and node of the target in zipped_args, and None for the node if it fails"""
+        start = time()
+        self, target = zipped_args
         try:
-            start = time()
-            self, target, nodes = zipped_args
             register_resolvers(self.inventory_path)
             self.load_target(target)
-            nodes[target.name] = {"parameters": target.parameters}
             logger.info(f"Rendered {target.name} ({time()-start:.2f}s)")
+            return target.name, {"parameters": target.parameters}
         except Exception as e:
             logger.error(f"{target.name}: {e}")
+            return target.name, None
 
     def lint(self):
         temp = tempfile.mktemp()
@@ -6,14 +6,19 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import logging
+import math
+import multiprocessing
 import os
+import uuid
 
 import reclass
 import reclass.core
 import yaml
-from reclass.errors import NotFoundError, ReclassException
+from reclass.errors import InterpolationError, NotFoundError, ReclassException
 
+from kapitan import cached
 from kapitan.errors import InventoryError
+from kapitan.inventory.store import RenderedNodes
 
 try:
     from yaml import CSafeLoader as YamlLoader
@@ -23,27 +28,210 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# chunks of nodes rendered in parallel per worker process, to balance the workers
+RENDER_CHUNKS_PER_PROCESS = 4
+
+# id of the parallel render, reclass core and query inventory of this worker process,
+# set by render_nodes_worker()
+_worker_core = (None, None, None)
+
+
+def render_node(core, target_name, query_inventory=None):
+    """
+    returns the node of target_name rendered by core as core.nodeinfo() does, and the exports
+    of all nodes read by inventory queries. These are rendered for the first node with queries
+    unless passed as query_inventory, as core.inventory() renders them once for all nodes
+    """
+    try:
+        node = core._node_entity(target_name)
+        node.initialise_interpolation()
+        if node.parameters.has_inv_query and query_inventory is None:
+            query_inventory = core._get_inventory(True, "", None)
+        node.interpolate(query_inventory)
+    except InterpolationError as e:
+        e.nodename = target_name
+        raise
+    return core._nodeinfo_as_dict(target_name, node), query_inventory
+
+
+def render_nodes_worker(args):
+    """
+    renders the nodes of target_names with backend in a worker process, and returns them as a dict.
+    The reclass core, the classes it parsed and the exports read by inventory queries are reused
+    by the chunks of the same render
+    """
+    global _worker_core
+    backend, render_id, target_names = args
+    core_render_id, core, query_inventory = _worker_core
+    if core_render_id == render_id:
+        backend._core = core
+        backend._query_inventory = query_inventory
+    nodes = {target_name: backend.render_target(target_name) for target_name in target_names}
+    _worker_core = (render_id, backend._core, backend._query_inventory)
+    return nodes
+
 
 class ReclassBackend:
     inventory_path: str
     targets_searchpath: str
     classes_searchpath: str
     ignore_class_notfound: bool
+    targets: list
+
+    parallel: bool
 
-    def __init__(self, inventory_path: str, ignore_class_notfound: bool):
+    def __init__(
+        self, inventory_path: str, ignore_class_notfound: bool, targets: list = [], parallel: bool = False
+    ):
         logger.debug("Using reclass as inventory backend")
         self.inventory_path = inventory_path
         self.ignore_class_notfound = ignore_class_notfound
+        self.targets = targets
+        self.parallel = parallel
+        # reclass core, created by core()
+        self._core = None
+        # set of the target names, for render_target()
+        self._target_names = None
+        # exports of all nodes read by inventory queries, set by render_target()
+        self._query_inventory = None
+
+    def __getstate__(self):
+        # the reclass core, target names and exports are read again by each process
+        state = self.__dict__.copy()
+        state["_core"] = None
+        state["_target_names"] = None
+        state["_query_inventory"] = None
+        return state
 
     def inventory(self):
         """
         Runs a reclass inventory in inventory_path
         (same output as running ./reclass.py -b inv_base_uri/ --inventory)
-        Will attempt to read reclass config from 'reclass-config.yml' otherwise
-        it will failback to the default config.
         Returns a reclass style dictionary
 
         Does not throw errors if a class is not found while --fetch flag is enabled
+
+        With targets, only the nodes of targets are rendered, and the nodes of other
+        targets are rendered when they are first read, e.g. by inventory_global.
+        With parallel, nodes are rendered by the compile processes in cached.pool
+        """
+        if not self.targets:
+            if self.parallel:
+                return self.parallel_inventory()
+            return self.reclass_call(lambda core: core.inventory())
+
+        names = self.target_names()
+        self._target_names = set(names)
+        nodes = {
+            target_name: self.render_target(target_name)
+            for target_name in self.targets
+            if target_name in names
+        }
+        return {
+            "__reclass__": {"timestamp": reclass.core.Core._get_timestamp()},
+            "nodes": RenderedNodes(self, names, nodes),
+        }
+
+    def parallel_inventory(self):
+        """
+        returns the inventory with its nodes rendered in chunks by the processes of cached.pool,
+        or of a new pool if it is not running
+        """
+        target_names = self.target_names()
+        pool = cached.running_pool()
+        own_pool = pool is None
+        if own_pool:
+            pool = multiprocessing.get_context("spawn").Pool()
+        try:
+            chunk_size = math.ceil(len(target_names) / (pool._processes * RENDER_CHUNKS_PER_PROCESS))
+            # worker cores are only reused within this render, classes may change between renders
+            render_id = uuid.uuid4().hex
+            chunks = [
+                (self, render_id, target_names[start : start + chunk_size])
+                for start in range(0, len(target_names), chunk_size or 1)
+            ]
+            nodes = {}
+            for rendered in pool.imap_unordered(render_nodes_worker, chunks):
+                nodes.update(rendered)
+        finally:
+            if own_pool:
+                pool.close()
+                pool.join()
+        logger.debug("Rendered %d nodes on %d processes", len(nodes), pool._processes)
+        return self.inventory_from_nodes({target_name: nodes[target_name] for target_name in target_names})
+
+    def target_names(self):
+        """returns the names of the targets, without rendering them"""
+        return self.reclass_call(lambda core: list(core._storage.enumerate_nodes()))
+
+    def render_target(self, target_name):
+        """renders and returns the node of target target_name"""
+        if self._target_names is None:
+            self._target_names = set(self.target_names())
+        if target_name not in self._target_names:
+            raise KeyError(target_name)
+        node, self._query_inventory = self.reclass_call(
+            lambda core: render_node(core, target_name, self._query_inventory)
+        )
+        return node
+
+    def node_sources(self, target_name, node):
+        """
+        returns the paths of the target file and the class files node of target_name was rendered from,
+        None if the reclass storage doesn't tell them
+        """
+
+        def sources(core):
+            # only the yaml_fs storage of the reclass fork bundled with kapitan (kapicorp-reclass 2.0)
+            # tells the files of nodes and classes, in private attributes
+            storage = getattr(core._storage, "_real_storage", core._storage)
+            paths = [os.path.join(storage.nodes_uri, storage._nodes[target_name])]
+            for class_name in node["classes"]:
+                if class_name in storage._classes:
+                    paths.append(os.path.join(storage.classes_uri, storage._classes[class_name]))
+            return paths
+
+        try:
+            return self.reclass_call(sources)
+        except (AttributeError, KeyError, TypeError) as e:
+            # the inventory cache renders the whole inventory again when the files are unknown
+            logger.debug("Inventory reclass: can't tell the files of %s: %r", target_name, e)
+            return None
+
+    def inventory_from_nodes(self, nodes):
+        """returns the reclass style inventory of nodes, as returned by inventory()"""
+        applications = {}
+        classes = {}
+        for name, node in nodes.items():
+            for application in node["applications"]:
+                applications.setdefault(application, []).append(name)
+            for class_name in node["classes"]:
+                classes.setdefault(class_name, []).append(name)
+        return {
+            "__reclass__": {"timestamp": reclass.core.Core._get_timestamp()},
+            "nodes": nodes,
+            "classes": classes,
+            "applications": applications,
+        }
+
+    def reclass_call(self, func):
+        """returns func(core) with the reclass core of the inventory, reclass errors raise InventoryError"""
+        try:
+            if self._core is None:
+                self._core = self.core()
+            return func(self._core)
+        except ReclassException as e:
+            if isinstance(e, NotFoundError):
+                logger.error("Inventory reclass error: inventory not found")
+            else:
+                logger.error("Inventory reclass error: %s", e.message)
+            raise InventoryError(e.message)
+
+    def core(self):
+        """
+        returns a reclass core for the inventory in inventory_path.
+        Will attempt to read reclass config from 'reclass-config.yml' otherwise
+        it will failback to the default config.
         """
         # set default values initially
         reclass_config = {
@@ -83,27 +271,18 @@ class ReclassBackend:
                 os.path.join(self.inventory_path, reclass_config[uri])
             )
 
-        try:
-            storage = reclass.get_storage(
-                reclass_config["storage_type"],
-                reclass_config["nodes_uri"],
-                reclass_config["classes_uri"],
-                reclass_config["compose_node_name"],
-            )
-            class_mappings = reclass_config.get(
-                "class_mappings"
-            )  # this defaults to None (disabled)
-            _reclass = reclass.core.Core(
-                storage, class_mappings, reclass.settings.Settings(reclass_config)
-            )
-
-            return _reclass.inventory()
-        except ReclassException as e:
-            if isinstance(e, NotFoundError):
-                logger.error("Inventory reclass error: inventory not found")
-            else:
-                logger.error("Inventory reclass error: %s", e.message)
-            raise InventoryError(e.message)
+        storage = reclass.get_storage(
+            reclass_config["storage_type"],
+            reclass_config["nodes_uri"],
+            reclass_config["classes_uri"],
+            reclass_config["compose_node_name"],
+        )
+        class_mappings = reclass_config.get(
+            "class_mappings"
+        )  # this defaults to None (disabled)
+        return reclass.core.Core(
+            storage, class_mappings, reclass.settings.Settings(reclass_config)
+        )
 
     def lint(self):
         raise NotImplementedError()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 The Kapitan Authors
+# SPDX-FileCopyrightText: 2020 The Kapitan Authors <kapitan-admins@googlegroups.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"read-only stores of the inventory nodes read by compile workers"
+
+import mmap
+import pickle
+import struct
+from collections.abc import Mapping
+
+# offset of the index, written at the end of the store
+FOOTER = struct.Struct("<Q")
+
+
+def save_nodes(path, nodes):
+    """writes each node in nodes pickled to path, followed by an index of their offsets"""
+    index = {}
+    with open(path, "wb") as fp:
+        for name, node in nodes.items():
+            data = pickle.dumps(node, pickle.HIGHEST_PROTOCOL)
+            index[name] = (fp.tell(), len(data))
+            fp.write(data)
+        index_offset = fp.tell()
+        pickle.dump(index, fp, pickle.HIGHEST_PROTOCOL)
+        fp.write(FOOTER.pack(index_offset))
+
+
+class NodeStore(Mapping):
+    """
+    Read-only mapping of the nodes saved by save_nodes() to path.
+    The file is memory-mapped, so processes reading the same store share its pages,
+    and a node is only unpickled when it is read
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as fp:
+            self.mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        index_end = len(self.mmap) - FOOTER.size
+        (index_offset,) = FOOTER.unpack_from(self.mmap, index_end)
+        self.index = pickle.loads(self.mmap[index_offset:index_end])
+        # nodes read since the last release()
+        self.nodes = {}
+
+    def __getitem__(self, name):
+        try:
+            return self.nodes[name]
+        except KeyError:
+            node = self.load(name)
+        self.nodes[name] = node
+        return node
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __reduce__(self):
+        return NodeStore, (self.path,)
+
+    def load(self, name):
+        """returns the node name unpickled from the store, without keeping it"""
+        offset, length = self.index[name]
+        return pickle.loads(self.mmap[offset : offset + length])
+
+    def to_dict(self):
+        """
+        returns a dict of all nodes, for consumers that only take dicts.
+        Nodes that were not read are unpickled for the dict only, and not kept by the store
+        """
+        return {name: self.nodes[name] if name in self.nodes else self.load(name) for name in self.index}
+
+    def release(self):
+        """drops the nodes read so far, which are unpickled again when read"""
+        self.nodes.clear()
+
+
+class RenderedNodes(Mapping):
+    """
+    Read-only mapping of the nodes of the targets in names, each rendered by the inventory
+    backend when it is first read. Compile workers read nodes from it to compile targets
+    as soon as their node is rendered, instead of after the whole inventory is.
+    Workers keep the nodes they render for their next targets.
+    Nodes already rendered can be passed in nodes, they are kept by release()
+    """
+
+    def __init__(self, backend, names, nodes=None):
+        self.backend = backend
+        self.names = list(names)
+        self.name_set = set(self.names)
+        self.rendered = dict(nodes or {})
+        # nodes rendered since the last release()
+        self.nodes = {}
+
+    def __getitem__(self, name):
+        try:
+            return self.nodes[name]
+        except KeyError:
+            if name in self.rendered:
+                return self.rendered[name]
+            if name not in self.name_set:
+                raise
+        node = self.backend.render_target(name)
+        self.nodes[name] = node
+        return node
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.name_set
+
+    def __reduce__(self):
+        return RenderedNodes, (self.backend, self.names, {**self.rendered, **self.nodes})
+
+    def to_dict(self):
+        """
+        returns a dict of all nodes, for consumers that only take dicts.
+        Every node is rendered, and kept as when it is read
+        """
+        return {name: self[name] for name in self.names}
+
+    def release(self):
+        """drops the nodes rendered so far, which are rendered again when read"""
+        self.nodes.clear()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 The Kapitan Authors
+# SPDX-FileCopyrightText: 2020 The Kapitan Authors <kapitan-admins@googlegroups.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"profiling module"
+
+import cProfile
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# trace events recorded in this process, None when tracing is disabled
+trace_events = None
+
+# functions listed in the summary of a profiled target
+PROFILE_TOP_FUNCTIONS = 10
+# allocation sites listed in the allocations report of a profiled target
+PROFILE_TOP_ALLOCATIONS = 50
+
+
+def enable_trace():
+    """starts recording trace events in this process"""
+    global trace_events
+    if trace_events is None:
+        trace_events = []
+
+
+def disable_trace():
+    """stops recording trace events in this process and drops the recorded ones"""
+    global trace_events
+    trace_events = None
+
+
+def add_span(name, category, start, **args):
+    """records a span from start (as returned by time.time()) until now, if tracing is enabled"""
+    if trace_events is None:
+        return
+    trace_events.append(
+        {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": int(start * 1e6),
+            "dur": int((time.time() - start) * 1e6),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": args,
+        }
+    )
+
+
+@contextmanager
+def span(name, category, **args):
+    """records a span for the duration of the with block, if tracing is enabled"""
+    if trace_events is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        add_span(name, category, start, **args)
+
+
+def take_trace_events():
+    """returns the trace events recorded so far and clears them, for the process collecting them"""
+    if trace_events is None:
+        return []
+    events = list(trace_events)
+    trace_events.clear()
+    return events
+
+
+def add_trace_events(events):
+    """adds events recorded by another process"""
+    if trace_events is not None:
+        trace_events.extend(events)
+
+
+def write_trace(path):
+    """writes the trace events recorded so far to path in the Chrome trace event format"""
+    events = take_trace_events()
+    main_pid = os.getpid()
+    # name the processes in the timeline
+    for pid in sorted({event["pid"] for event in events}):
+        events.append(
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "args": {"name": "kapitan" if pid == main_pid else "kapitan worker {}".format(pid)},
+            }
+        )
+    with open(path, "w") as fp:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fp)
+    logger.info("Wrote trace to %s", path)
+
+
+def start_profile(memory=False):
+    """starts a cProfile profiler, and tracemalloc if memory is set, and returns the profiler"""
+    if memory:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profile(profiler, name, profile_path, memory=False):
+    """
+    stops profiler started by start_profile() and writes its stats to name.pstats in profile_path,
+    and the top allocations to name.allocations.txt if memory is set.
+    Returns a short summary of the top functions and peak memory
+    """
+    profiler.disable()
+    os.makedirs(profile_path, exist_ok=True)
+
+    memory_summary = None
+    if memory:
+        # the snapshot is taken first and leaves out the allocations of the profilers
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, cProfile.__file__), tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        allocations_path = os.path.join(profile_path, name + ".allocations.txt")
+        with open(allocations_path, "w") as fp:
+            fp.write("peak memory: {:.1f} MiB\n".format(peak / 2**20))
+            for stat in snapshot.statistics("lineno")[:PROFILE_TOP_ALLOCATIONS]:
+                fp.write("{}\n".format(stat))
+        memory_summary = "peak memory {:.1f} MiB, wrote {}".format(peak / 2**20, allocations_path)
+
+    stats_path = os.path.join(profile_path, name + ".pstats")
+    profiler.dump_stats(stats_path)
+    stats = pstats.Stats(profiler)
+    # (cumulative time, total time, calls, function) of each function, longest first
+    functions = sorted(
+        ((cumulative, total, calls, func) for func, (_, calls, total, cumulative, _) in stats.stats.items()),
+        reverse=True,
+    )
+    lines = ["Profiled {} ({:.2f}s), wrote {}".format(name, stats.total_tt, stats_path)]
+    if memory_summary:
+        lines.append(memory_summary)
+    lines.append("{:>10} {:>10} {:>8}  function".format("cumtime", "tottime", "calls"))
+    for cumulative, total, calls, func in functions[:PROFILE_TOP_FUNCTIONS]:
+        lines.append(
+            "{:>10.3f} {:>10.3f} {:>8}  {}".format(cumulative, total, calls, pstats.func_std_string(func))
+        )
+    return "\n".join(lines)
+
+
+def peak_rss():
+    """returns the peak resident memory of this process in bytes, None if it can't be read"""
+    try:
+        import resource
+    except ImportError:
+        # not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss():
+    """returns the resident memory of this process in bytes, None if it can't be read, e.g. on macOS"""
+    try:
+        with open("/proc/self/statm") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
@@ -25,7 +25,7 @@ from kapitan.errors import (
     RefHashMismatchError,
 )
 from kapitan.refs.functions import eval_func, get_func_lookup
-from kapitan.utils import PrettyDumper, list_all_paths
+from kapitan.utils import PrettyDumper, list_all_paths, record_read
 
 try:
     from yaml import CSafeLoader as YamlLoader
@@ -148,6 +148,7 @@ class PlainRefBackend(object):
         # remove the substring notation, if any
         ref_file_path = re.sub(REF_TOKEN_SUBVAR_PATTERN, "", ref_path)
         full_ref_path = os.path.join(self.path, ref_file_path)
+        record_read(full_ref_path)
         ref = self.ref_type.from_path(full_ref_path, **self.ref_kwargs)
 
         if ref is not None:
@@ -21,13 +21,18 @@ import yaml
 
 import kapitan.cached as cached
 from kapitan import __file__ as kapitan_install_path
+from kapitan import defaults
 from kapitan.errors import CompileError, InventoryError, KapitanError
+from kapitan.inventory.cache import InventoryCache
 from kapitan.inventory.omegaconf_inv import OmegaConfBackend
 from kapitan.inventory.reclass import ReclassBackend
+from kapitan.inventory.store import NodeStore, RenderedNodes
 from kapitan.utils import (
     PrettyDumper,
     deep_get,
     flatten_dict,
+    record_inventory_read,
+    record_read,
     render_jinja2_file,
     sha256_string,
 )
@@ -35,6 +40,7 @@ from kapitan.utils import (
 logger = logging.getLogger(__name__)
 
 
+# import path -> (mtime, content), mtimes are checked so long running processes see changed files
 JSONNET_CACHE = {}
 
 
@@ -47,7 +53,7 @@ def resource_callbacks(search_paths):
 
     return {
         "jinja2_render_file": (("name", "ctx"), partial(jinja2_render_file, search_paths)),
-        "inventory": (("target", "inv_path"), partial(inventory, search_paths)),
+        "inventory": (("target", "inv_path"), partial(inventory_dict, search_paths)),
         "file_read": (("name",), partial(read_file, search_paths)),
         "file_exists": (("name",), partial(file_exists, search_paths)),
         "dir_files_list": (("name",), partial(dir_files_list, search_paths)),
@@ -113,6 +119,7 @@ def jinja2_render_file(search_paths, name, ctx):
     for path in search_paths:
         _full_path = os.path.join(path, name)
         logger.debug("jinja2_render_file trying file %s", _full_path)
+        record_read(_full_path)
         if os.path.exists(_full_path):
             logger.debug("jinja2_render_file found file at %s", _full_path)
             try:
@@ -128,6 +135,7 @@ def yaml_load(search_paths, name):
     for path in search_paths:
         _full_path = os.path.join(path, name)
         logger.debug("yaml_load trying file %s", _full_path)
+        record_read(_full_path)
         if os.path.exists(_full_path) and (name.endswith(".yml") or name.endswith(".yaml")):
             logger.debug("yaml_load found file at %s", _full_path)
             try:
@@ -144,6 +152,7 @@ def yaml_load_stream(search_paths, name):
     for path in search_paths:
         _full_path = os.path.join(path, name)
         logger.debug("yaml_load_stream trying file %s", _full_path)
+        record_read(_full_path)
         if os.path.exists(_full_path) and (name.endswith(".yml") or name.endswith(".yaml")):
             logger.debug("yaml_load_stream found file at %s", _full_path)
             try:
@@ -161,6 +170,7 @@ def read_file(search_paths, name):
     for path in search_paths:
         full_path = os.path.join(path, name)
         logger.debug("read_file trying file %s", full_path)
+        record_read(full_path)
         if os.path.exists(full_path):
             logger.debug("read_file found file at %s", full_path)
             with io.open(full_path, newline="") as f:
@@ -176,6 +186,7 @@ def file_exists(search_paths, name):
     for path in search_paths:
         full_path = os.path.join(path, name)
         logger.debug("file_exists trying file %s", full_path)
+        record_read(full_path)
         if os.path.exists(full_path):
             logger.debug("file_exists found file at %s", full_path)
             return {"exists": True, "path": full_path}
@@ -188,6 +199,7 @@ def dir_files_list(search_paths, name):
     for path in search_paths:
         full_path = os.path.join(path, name)
         logger.debug("dir_files_list trying directory %s", full_path)
+        record_read(full_path)
         if os.path.exists(full_path):
             return [f for f in os.listdir(full_path) if os.path.isfile(os.path.join(full_path, f))]
     raise IOError("Could not find folder {}".format(name))
@@ -199,6 +211,7 @@ def dir_files_read(search_paths, name):
     for path in search_paths:
         full_path = os.path.join(path, name)
         logger.debug("dir_files_list trying directory %s", full_path)
+        record_read(full_path)
         if os.path.exists(full_path):
             return {f: read_file([full_path], f) for f in dir_files_list([full_path], "")}
 
@@ -217,8 +230,15 @@ def search_imports(cwd, import_str, search_paths):
     basename = os.path.basename(import_str)
     full_import_path = os.path.normpath(os.path.join(cwd, import_str))
 
+    record_read(full_import_path)
     if full_import_path in JSONNET_CACHE:
-        return full_import_path, JSONNET_CACHE[full_import_path].encode()
+        mtime, content = JSONNET_CACHE[full_import_path]
+        try:
+            if os.stat(full_import_path).st_mtime_ns == mtime:
+                return full_import_path, content.encode()
+        except FileNotFoundError:
+            pass
+        del JSONNET_CACHE[full_import_path]
 
     if not os.path.exists(full_import_path):
         # if import_str not found, search in install_path
@@ -232,6 +252,7 @@ def search_imports(cwd, import_str, search_paths):
             # if import_str not found, search in search_paths
             for path in search_paths:
                 _full_import_path = os.path.join(path, import_str)
+                record_read(_full_import_path)
                 # if found, set as full_import_path
                 if os.path.exists(_full_import_path):
                     full_import_path = _full_import_path
@@ -246,8 +267,9 @@ def search_imports(cwd, import_str, search_paths):
 
     normalised_path_content = ""
     with open(normalised_path) as f:
+        mtime = os.fstat(f.fileno()).st_mtime_ns
         normalised_path_content = f.read()
-        JSONNET_CACHE[normalised_path] = normalised_path_content
+        JSONNET_CACHE[normalised_path] = (mtime, normalised_path_content)
 
     return normalised_path, normalised_path_content.encode()
 
@@ -283,14 +305,39 @@ def inventory(search_paths, target, inventory_path=None):
         raise InventoryError(f"Inventory not found in search paths: {search_paths}")
 
     if target is None:
+        # every target's inventory was read
+        record_read(full_inv_path)
         return get_inventory(full_inv_path)["nodes"]
 
+    record_inventory_read(target)
     return get_inventory(full_inv_path)["nodes"][target]
 
 
+def inventory_dict(search_paths, target, inventory_path=None):
+    """
+    inventory() for jsonnet native callbacks, which only convert dicts.
+    Compile workers read nodes from a read-only NodeStore or RenderedNodes mapping,
+    which only builds a dict here, for the nodes of all targets
+    """
+    inv = inventory(search_paths, target, inventory_path)
+    if isinstance(inv, (NodeStore, RenderedNodes)):
+        return inv.to_dict()
+    return inv
+
+
 def generate_inventory(args):
     try:
-        inv = get_inventory(args.inventory_path)
+        if args.affected_by:
+            inventory_backend = get_inventory_backend(args.inventory_path)
+            # the index is only saved for later runs with --inventory-cache
+            inventory_cache = hasattr(args, "inventory_cache") and args.inventory_cache
+            cache_path = defaults.INVENTORY_CACHE_PATH if inventory_cache else None
+            cache = InventoryCache(inventory_backend, cache_path)
+            for target_name in cache.affected_by(args.affected_by):
+                print(target_name)
+            return
+        targets = [args.target_name] if args.target_name != "" else []
+        inv = get_inventory(args.inventory_path, targets=targets)
         if args.target_name != "":
             inv = inv["nodes"][args.target_name]
             if args.pattern != "":
@@ -307,6 +354,22 @@ def generate_inventory(args):
         logger.error(e)
 
 
+def get_inventory_backend(inventory_path, ignore_class_notfound=False, targets=[]):
+    """returns the inventory backend selected by the cli args, reclass by default"""
+    args = cached.args.get("all", {})
+    reclass_parallel = hasattr(args, "reclass_parallel") and args.reclass_parallel
+
+    if hasattr(args, "reclass") and args.reclass:
+        return ReclassBackend(inventory_path, ignore_class_notfound, targets, reclass_parallel)
+    elif hasattr(args, "omegaconf") and args.omegaconf:
+        return OmegaConfBackend(inventory_path, ignore_class_notfound, targets)
+    else:
+        # warning or hint to use omegaconf (TODO)
+        # error that that no backend is specified (TODO)
+        # legacy (default at the moment)
+        return ReclassBackend(inventory_path, ignore_class_notfound, targets, reclass_parallel)
+
+
 def get_inventory(inventory_path, ignore_class_notfound=False, targets=[]):
     """
     generic inventory function that makes inventory backend pluggable
@@ -318,17 +381,11 @@ def get_inventory(inventory_path, ignore_class_notfound=False, targets=[]):
         return cached.inv
 
     args = cached.args.get("all", {})
-
-    # initialize inventory backend
-    if hasattr(args, "reclass") and args.reclass:
-        inventory_backend = ReclassBackend(inventory_path, ignore_class_notfound)
-    elif hasattr(args, "omegaconf") and args.omegaconf:
-        inventory_backend = OmegaConfBackend(inventory_path, ignore_class_notfound, targets)
-    else:
-        # warning or hint to use omegaconf (TODO)
-        # error that that no backend is specified (TODO)
-        # legacy (default at the moment)
-        inventory_backend = ReclassBackend(inventory_path, ignore_class_notfound)
+    inventory_cache = hasattr(args, "inventory_cache") and args.inventory_cache
+    # the inventory cache saves the nodes of all targets
+    inventory_backend = get_inventory_backend(
+        inventory_path, ignore_class_notfound, [] if inventory_cache else targets
+    )
 
     # migrate if neccessary
     if hasattr(args, "migrate") and args.migrate:
@@ -336,7 +393,10 @@ def get_inventory(inventory_path, ignore_class_notfound=False, targets=[]):
 
     # fetch inventory
     try:
-        inventory = inventory_backend.inventory()
+        if inventory_cache:
+            inventory = InventoryCache(inventory_backend, defaults.INVENTORY_CACHE_PATH).get()
+        else:
+            inventory = inventory_backend.inventory()
     except Exception as e:
         raise InventoryError(e)
 
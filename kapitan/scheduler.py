@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 The Kapitan Authors
+# SPDX-FileCopyrightText: 2020 The Kapitan Authors <kapitan-admins@googlegroups.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"scheduler module"
+
+import heapq
+import itertools
+import logging
+import multiprocessing.pool
+import queue
+from collections import defaultdict
+from functools import partial
+
+from kapitan.errors import KapitanError
+from kapitan.profiling import current_rss
+
+logger = logging.getLogger(__name__)
+
+
+class TaskScheduler(object):
+    """
+    Runs tasks on a multiprocessing pool as soon as the tasks they depend on are done.
+    Tasks can be added before and while run() is waiting for results.
+    Set max_running to the number of pool processes to submit ready tasks by priority
+    """
+
+    def __init__(self, pool, max_running=None):
+        self.pool = pool
+        self.max_running = max_running
+        self.tasks = {}
+        self.done = set()
+        # task name -> names of the tasks it still waits for
+        self.waiting = {}
+        # task name -> names of the tasks waiting for it
+        self.dependents = defaultdict(list)
+        # heap of (-priority, order, name) for tasks ready to be submitted
+        self.ready = []
+        self.order = itertools.count()
+        self.running = 0
+        # results are passed from the pool's result thread to run()
+        self.results = queue.Queue()
+
+    def add(self, name, func, args=(), deps=(), callback=None, priority=0):
+        """
+        adds task name, running func(*args) once every task in deps is done.
+        Ready tasks with a higher priority are submitted first.
+        callback is called with the result of func in the process calling run()
+        """
+        if name in self.tasks:
+            raise KapitanError("Task {} was already added".format(name))
+        self.tasks[name] = (func, args, callback, priority)
+
+        pending = {dep for dep in deps if dep not in self.done}
+        if pending:
+            self.waiting[name] = pending
+            for dep in pending:
+                self.dependents[dep].append(name)
+        else:
+            self._push_ready(name)
+
+    def _push_ready(self, name):
+        heapq.heappush(self.ready, (-self.tasks[name][3], next(self.order), name))
+
+    def _submit_ready(self):
+        while self.ready and (self.max_running is None or self.running < self.max_running):
+            _, _, name = heapq.heappop(self.ready)
+            func, args, _, _ = self.tasks[name]
+            self.running += 1
+            logger.debug("Scheduler: submitting %s", name)
+            self.pool.apply_async(
+                func,
+                args,
+                callback=partial(self._put_result, name),
+                error_callback=partial(self._put_error, name),
+            )
+
+    def _put_result(self, name, result):
+        self.results.put((name, result, None))
+
+    def _put_error(self, name, error):
+        self.results.put((name, None, error))
+
+    def run(self):
+        """waits until every task is done, raises the first error of a task"""
+        self._submit_ready()
+        while self.running:
+            name, result, error = self.results.get()
+            self.running -= 1
+            if error is not None:
+                raise error
+
+            self.done.add(name)
+            callback = self.tasks[name][2]
+            if callback is not None:
+                callback(result)
+
+            for dependent in self.dependents.pop(name, []):
+                pending = self.waiting[dependent]
+                pending.discard(name)
+                if not pending:
+                    del self.waiting[dependent]
+                    self._push_ready(dependent)
+            self._submit_ready()
+
+        if self.waiting:
+            raise KapitanError(
+                "Tasks waiting for tasks that were never added: {}".format(sorted(self.waiting))
+            )
+
+
+class RecyclingPool(multiprocessing.pool.Pool):
+    """
+    multiprocessing pool whose worker processes are replaced by new ones after maxtasksperchild tasks,
+    or before their next task once they use more than max_rss bytes of resident memory
+    """
+
+    def __init__(
+        self, processes=None, initializer=None, initargs=(), maxtasksperchild=None, context=None, max_rss=None
+    ):
+        # set before the parent class starts the worker processes
+        self.max_rss = max_rss
+        super().__init__(processes, initializer, initargs, maxtasksperchild, context)
+
+    def Process(self, ctx, *args, **kwds):
+        if self.max_rss is not None:
+            inqueue, *worker_args = kwds["args"]
+            kwds["args"] = (RecyclingQueue(inqueue, self.max_rss), *worker_args)
+        return super().Process(ctx, *args, **kwds)
+
+
+class RecyclingQueue(object):
+    """
+    task queue of a RecyclingPool worker, which returns the sentinel ending the worker
+    instead of its next task once it uses more than max_rss bytes.
+    Every worker runs at least one task, as forked workers start with the memory of their parent
+    """
+
+    def __init__(self, queue, max_rss):
+        self.queue = queue
+        self.max_rss = max_rss
+        self.tasks = 0
+
+    def get(self):
+        if self.tasks and current_rss() > self.max_rss:
+            logger.debug(
+                "Worker memory above %d MiB after %d tasks, exiting", self.max_rss // 2**20, self.tasks
+            )
+            return None
+        self.tasks += 1
+        return self.queue.get()
+
+    def __getattr__(self, name):
+        # the worker closes the unused ends of the queue
+        if name == "queue":
+            raise AttributeError(name)
+        return getattr(self.queue, name)
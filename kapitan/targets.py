@@ -6,14 +6,18 @@
 # SPDX-License-Identifier: Apache-2.0
 
 "kapitan targets"
+import filecmp
 import json
 import logging
+import math
 import multiprocessing
 import os
+import pickle
 import shutil
 import sys
 import tempfile
 import time
+import traceback
 from collections import defaultdict
 from functools import partial
 
@@ -21,9 +25,10 @@ import jsonschema
 import yaml
 from reclass.errors import NotFoundError, ReclassException
 
-from kapitan import cached, defaults
-from kapitan.dependency_manager.base import fetch_dependencies
+from kapitan import cached, defaults, setup_logging
+from kapitan.dependency_manager.base import dependency_fetches
 from kapitan.errors import CompileError, InventoryError, KapitanError
+from kapitan.inputs.base import CompiledFile, OutputWriter, glob_base
 from kapitan.inputs.copy import Copy
 from kapitan.inputs.external import External
 from kapitan.inputs.helm import Helm
@@ -31,13 +36,51 @@ from kapitan.inputs.jinja2 import Jinja2
 from kapitan.inputs.jsonnet import Jsonnet
 from kapitan.inputs.kadet import Kadet
 from kapitan.inputs.remove import Remove
+from kapitan.inventory.store import NodeStore, RenderedNodes, save_nodes
+from kapitan.profiling import (
+    add_span,
+    add_trace_events,
+    current_rss,
+    disable_trace,
+    enable_trace,
+    peak_rss,
+    span,
+    start_profile,
+    stop_profile,
+    take_trace_events,
+    write_trace,
+)
 from kapitan.remoteinventory.fetch import fetch_inventories, list_sources
-from kapitan.resources import get_inventory
-from kapitan.utils import dictionary_hash, directory_hash, hashable_lru_cache
+from kapitan.resources import get_inventory, get_inventory_backend
+from kapitan.scheduler import RecyclingPool, TaskScheduler
+from kapitan.utils import (
+    dictionary_hash,
+    directory_hash,
+    file_sha256,
+    hashable_lru_cache,
+    normalise_read_path,
+    path_hash,
+)
 from kapitan.validator.kubernetes_validator import KubernetesManifestValidator
 
 logger = logging.getLogger(__name__)
 
+# modules imported once by the forkserver of --worker-start-method forkserver,
+# instead of by every compile process
+WORKER_PRELOAD_MODULES = [
+    "kapitan.targets",
+    "kapitan.inventory.omegaconf_inv",
+    "kapitan.inventory.reclass",
+    "kapitan.refs.base64",
+    "kapitan.refs.env",
+    "kapitan.refs.secrets.awskms",
+    "kapitan.refs.secrets.azkms",
+    "kapitan.refs.secrets.gkms",
+    "kapitan.refs.secrets.gpg",
+    "kapitan.refs.secrets.vaultkv",
+    "kapitan.refs.secrets.vaulttransit",
+]
+
 
 def compile_targets(
     inventory_path,
@@ -52,10 +95,32 @@ def compile_targets(
     """
     Searches and loads target files, and runs compile_target() on a
     multiprocessing pool with parallel number of processes.
+    Set pool to reuse a running pool, which is left open.
     kwargs are passed to compile_target()
+    Returns a dict with the read-set of each compiled target
     """
+    pool = kwargs.pop("pool", None)
+    atomic_output = kwargs.get("atomic_output", False)
+    profile_out = kwargs.get("profile_out", None)
+    if profile_out:
+        enable_trace()
+    # with --stream-inventory, targets are compiled as soon as their node is rendered
+    stream_inventory = kwargs.get("stream_inventory", False)
+    whole_inventory_options = ("fetch", "force_fetch", "force", "cache", "shard", "parallel_inputs")
+    if stream_inventory and (labels or any(kwargs.get(option) for option in whole_inventory_options)):
+        logger.warning(
+            "Ignoring --stream-inventory: --labels, --fetch, --cache, --shard and --parallel-inputs "
+            "need the whole inventory first"
+        )
+        stream_inventory = False
     # temp_path will hold compiled items
-    temp_path = tempfile.mkdtemp(suffix=".kapitan")
+    if atomic_output:
+        # stage compiled items next to the output path, so that targets
+        # can be moved into place with renames on the same filesystem
+        os.makedirs(output_path, exist_ok=True)
+        temp_path = tempfile.mkdtemp(prefix=".", suffix=".kapitan", dir=output_path)
+    else:
+        temp_path = tempfile.mkdtemp(suffix=".kapitan")
     # enable previously compiled items to be reference in other compile inputs
     search_paths.append(temp_path)
     temp_compile_path = os.path.join(temp_path, "compiled")
@@ -63,11 +128,42 @@ def compile_targets(
 
     updated_targets = targets
     try:
-        updated_targets = search_targets(inventory_path, targets, labels)
+        with span("search targets", "inventory"):
+            updated_targets = search_targets(inventory_path, targets, labels)
     except CompileError as e:
         logger.error(e)
         sys.exit(1)
 
+    # compile durations of previous runs, saved with --cache
+    saved_durations = {}
+    saved_inv_cache = None
+    if kwargs.get("cache") or kwargs.get("shard_by_duration"):
+        saved_inv_cache = load_inv_cache(output_path)
+        if saved_inv_cache:
+            saved_durations = saved_inv_cache.get("durations") or {}
+
+    # with --shard, only compile this machine's part of the targets
+    shard = kwargs.get("shard")
+    shard_paths = None
+    if shard:
+        shard_index, shard_count = shard
+        inv = get_inventory(inventory_path)
+        all_targets = updated_targets or list(inv["nodes"])
+        shard_durations = saved_durations if kwargs.get("shard_by_duration") else None
+        updated_targets = shard_targets(all_targets, shard_index, shard_count, shard_durations)
+        shard_paths = {
+            target: inv["nodes"][target]["parameters"]["_reclass_"]["name"]["path"]
+            for target in updated_targets
+        }
+        logger.info(
+            "Shard %d/%d: %d of %d targets", shard_index, shard_count, len(updated_targets), len(all_targets)
+        )
+        if not updated_targets:
+            logger.info("No targets in shard %d/%d.", shard_index, shard_count)
+            write_shard_manifest(output_path, shard, shard_paths)
+            shutil.rmtree(temp_path)
+            return
+
     # If --cache is set
     if kwargs.get("cache"):
         additional_cache_paths = kwargs.get("cache_paths")
@@ -77,18 +173,47 @@ def compile_targets(
         os.makedirs(dep_cache_dir, exist_ok=True)
 
         if not targets:
-            updated_targets = changed_targets(inventory_path, output_path)
+            changed = changed_targets(inventory_path, output_path, additional_cache_paths, saved_inv_cache)
+            if shard:
+                updated_targets = [target for target in updated_targets if target in changed]
+            else:
+                updated_targets = changed
             logger.debug("Changed targets since last compilation: %s", updated_targets)
             if not updated_targets:
                 logger.info("No changes since last compilation.")
+                if shard:
+                    write_shard_manifest(output_path, shard, shard_paths)
+                    save_inv_cache(os.path.join(output_path, "compiled"), list(shard_paths))
+                shutil.rmtree(temp_path)
                 return
 
-    # calculate optimal pool size
-    num_targets = 0
-    for _, _, files in os.walk(os.path.join(inventory_path, "targets")):
-        num_targets += len(files)
-    num_processes = max(1, min(parallel, num_targets))
-    pool = multiprocessing.Pool(num_processes)
+    own_pool = pool is None
+    num_processes = None
+    if own_pool:
+        # calculate optimal pool size
+        if updated_targets:
+            num_targets = len(updated_targets)
+        else:
+            num_targets = 0
+            for _, _, files in os.walk(os.path.join(inventory_path, "targets")):
+                num_targets += len(files)
+        target_durations = [
+            duration["total"]
+            for target, duration in saved_durations.items()
+            if not updated_targets or target in updated_targets
+        ]
+        # the longest compile list item of a target is unknown until targets are loaded
+        if kwargs.get("parallel_inputs", False):
+            target_durations = []
+        num_processes = pool_size(parallel, num_targets, target_durations)
+        pool = worker_pool(
+            num_processes,
+            kwargs.get("worker_max_targets"),
+            kwargs.get("worker_max_memory"),
+            kwargs.get("worker_start_method"),
+        )
+    # the pool is left in cached.pool for the inventory backends until compile_targets returns
+    previous_pool = cached.pool
     cached.pool = pool
 
     try:
@@ -108,9 +233,17 @@ def compile_targets(
             )
             force_fetch = True
 
+        target_objs = None
+        if stream_inventory:
+            # the compile workers render the nodes they read, other targets' nodes included
+            backend = get_inventory_backend(inventory_path)
+            cached.inv = {"nodes": RenderedNodes(backend, backend.target_names())}
+
         # -------------------------------------------------
         # Fetch inventory and dependencies
         # -------------------------------------------------
+        # dependencies are fetched while compiling the targets that don't read them
+        fetches = []
         if fetch:
             # skip classes that are not yet available
             target_objs = load_target_inventory(inventory_path, updated_targets, ignore_class_notfound=True)
@@ -118,13 +251,14 @@ def compile_targets(
             # new_source checks for new sources in fetched inventory items
             new_sources = list(set(list_sources(target_objs)) - cached.inv_sources)
             while new_sources:
-                fetch_inventories(
-                    inventory_path,
-                    target_objs,
-                    dep_cache_dir,
-                    force_fetch,
-                    pool,
-                )
+                with span("fetch inventories", "fetch"):
+                    fetch_inventories(
+                        inventory_path,
+                        target_objs,
+                        dep_cache_dir,
+                        force_fetch,
+                        pool,
+                    )
                 cached.reset_inv()
                 target_objs = load_target_inventory(
                     inventory_path, updated_targets, ignore_class_notfound=True
@@ -135,10 +269,10 @@ def compile_targets(
             cached.reset_inv()
             target_objs = load_target_inventory(inventory_path, updated_targets, ignore_class_notfound=False)
 
-            fetch_dependencies(output_path, target_objs, dep_cache_dir, force_fetch, pool)
+            fetches += dependency_fetches(output_path, target_objs, dep_cache_dir, force_fetch)
 
         # only fetch dependencies which have 'force_fetch: true' (regardless of --fetch)
-        if not force_fetch:
+        if not force_fetch and not stream_inventory:
             # ignore_class_notfound = False by default
             target_objs = load_target_inventory(inventory_path, updated_targets)
 
@@ -161,67 +295,160 @@ def compile_targets(
             # fetch the specified dependencies with force-fetch
             fetch_objs = [t for t in target_objs if t.get("dependencies")]
             if fetch_objs:
-                fetch_dependencies(output_path, target_objs, dep_cache_dir, True, pool)
+                fetches += dependency_fetches(output_path, target_objs, dep_cache_dir, True)
 
-        if not target_objs:
-            raise CompileError("Error: no targets found")
+        if not stream_inventory:
+            if not target_objs:
+                raise CompileError("Error: no targets found")
 
-        logger.info("Rendered inventory (%.2fs)", time.time() - rendering_start)
+            logger.info("Rendered inventory (%.2fs)", time.time() - rendering_start)
+            add_span("render inventory", "inventory", rendering_start)
 
         # -------------------------------------------------
         # Compile targets
         # -------------------------------------------------
+        compile_start = time.time()
+        # the globals and ref controller are pickled once and loaded once per worker process,
+        # so that only the target is pickled for each task
+        globals_path = save_globals(temp_path, ref_controller)
         worker = partial(
             compile_target,
             search_paths=search_paths,
             compile_path=temp_compile_path,
-            ref_controller=ref_controller,
+            ref_controller=None,
             inventory_path=inventory_path,
-            globals_cached=cached.as_dict(),
+            reference_compile_path=os.path.join(output_path, "compiled"),
+            globals_path=globals_path,
+            profile_path=os.path.join(output_path, "profiles"),
             **kwargs,
         )
-
-        # compile_target() returns None on success
-        # so p is only not None when raising an exception
-        [p.get() for p in pool.imap_unordered(worker, target_objs) if p]
+        # with --keep-going, failed targets are reported once the other targets are written
+        keep_going = kwargs.get("keep_going", False)
+        if keep_going and not stream_inventory:
+            worker = partial(keep_going_worker, worker=worker)
+
+        if stream_inventory:
+            target_names = updated_targets or cached.inv["nodes"]
+            results, target_objs = compile_rendered_targets(
+                pool, worker, target_names, inventory_path, globals_path, keep_going
+            )
+            if not target_objs:
+                raise CompileError("Error: no targets found")
+        elif kwargs.get("parallel_inputs", False) or fetches:
+            results = schedule_compile(
+                pool,
+                worker,
+                target_objs,
+                saved_durations,
+                num_processes,
+                parallel_inputs=kwargs.get("parallel_inputs", False),
+                fetches=[
+                    (fetch, dep_mapping) for fetch, dep_mappings in fetches for dep_mapping in dep_mappings
+                ],
+                search_paths=search_paths,
+                fetch_overlap=kwargs.get("fetch_overlap", False),
+            )
+        else:
+            # compile the longest targets first, so no process is left with a long target at the end.
+            # compile_target() returns a dict with the read-set and durations of each target,
+            # exceptions are raised when iterating over the results
+            results = {}
+            for result in pool.imap_unordered(worker, order_by_duration(target_objs, saved_durations)):
+                add_trace_events(result.pop("trace"))
+                results[result["target"]] = result
+
+        failures = {}
+        for target, result in list(results.items()):
+            if "error" in result:
+                failures[target] = results.pop(target)
+        if failures:
+            target_objs = [
+                target_obj for target_obj in target_objs if target_obj["vars"]["target"] not in failures
+            ]
+        read_sets = {target: result["read_set"] for target, result in results.items()}
+
+        profile_targets = set(kwargs.get("profile_targets") or ())
+        missing_profile_targets = profile_targets - set(results)
+        if missing_profile_targets:
+            logger.warning("Targets to profile not compiled: %s", ", ".join(sorted(missing_profile_targets)))
+
+        manifest_files = None
+        if kwargs.get("manifest"):
+            manifest_files = {}
+            for target_obj in target_objs:
+                files = results[target_obj["vars"]["target"]]["files"]
+                if kwargs.get("parallel_inputs", False):
+                    files = target_manifest(temp_compile_path, target_obj, files)
+                manifest_files.update(files)
+            # a manifest of all targets is written along with them
+            if not updated_targets and not failures:
+                save_manifest(temp_compile_path, manifest_files)
+        add_span("compile targets", "compile", compile_start)
 
         # -------------------------------------------------
         # Write output to files
         # -------------------------------------------------
+        write_start = time.time()
         # append "compiled" to output_path so we can safely overwrite it
         compile_path = os.path.join(output_path, "compiled")
         os.makedirs(compile_path, exist_ok=True)
 
-        # if '-t' is set on compile or only a few changed, only override selected targets
-        if updated_targets:
+        # if '-t' is set on compile or only a few changed, only override selected targets,
+        # and keep the previous output of failed targets
+        if updated_targets or failures:
             for target_obj in target_objs:
                 path = target_obj["target_full_path"]
                 compile_path_target = os.path.join(compile_path, path)
                 temp_path_target = os.path.join(temp_compile_path, path)
 
-                os.makedirs(compile_path_target, exist_ok=True)
+                if atomic_output:
+                    replace_path(temp_path_target, compile_path_target, temp_path)
+                    logger.debug("Moved %s into %s", temp_path_target, compile_path_target)
+                    continue
 
-                shutil.rmtree(compile_path_target)
-                shutil.copytree(temp_path_target, compile_path_target)
+                sync_path(temp_path_target, compile_path_target)
                 logger.debug("Copied %s into %s", temp_path_target, compile_path_target)
         # otherwise override all targets
+        elif atomic_output:
+            replace_path(temp_compile_path, compile_path, temp_path)
+            logger.debug("Moved %s into %s", temp_compile_path, compile_path)
         else:
-            shutil.rmtree(compile_path)
-            shutil.copytree(temp_compile_path, compile_path)
+            sync_path(temp_compile_path, compile_path)
             logger.debug("Copied %s into %s", temp_compile_path, compile_path)
+        if manifest_files is not None and (updated_targets or failures):
+            save_manifest(
+                compile_path,
+                manifest_files,
+                [target_obj["target_full_path"] for target_obj in target_objs],
+            )
+        if shard:
+            write_shard_manifest(output_path, shard, shard_paths)
+        add_span("write output", "output", write_start)
 
         # validate the compiled outputs
         if kwargs.get("validate", False):
+            validate_start = time.time()
             validate_map = create_validate_mapping(target_objs, compile_path)
             worker = partial(
                 schema_validate_kubernetes_output,
                 cache_dir=kwargs.get("schemas_path", "./schemas"),
             )
             [p.get() for p in pool.imap_unordered(worker, validate_map.items()) if p]
+            add_span("validate", "validate", validate_start)
 
-        # Save inventory and folders cache
-        save_inv_cache(compile_path, targets)
-        pool.close()
+        # Save inventory and folders cache, a shard only owns the cache of its targets
+        save_inv_cache(compile_path, list(shard_paths) if shard else targets, results, failures)
+        if own_pool:
+            pool.close()
+
+        report = worker_memory_report(list(results.values()) + list(failures.values()))
+        if kwargs.get("worker_max_targets") or kwargs.get("worker_max_memory"):
+            logger.info(report)
+        else:
+            logger.debug(report)
+        if failures:
+            raise CompileError(failure_report(failures, len(results) + len(failures)))
+        return read_sets
 
     except ReclassException as e:
         if isinstance(e, NotFoundError):
@@ -231,8 +458,9 @@ def compile_targets(
         raise InventoryError(e.message)
     except Exception as e:
         # if compile worker fails, terminate immediately
-        pool.terminate()
-        logger.debug("Compile pool terminated")
+        if own_pool:
+            pool.terminate()
+            logger.debug("Compile pool terminated")
         # only print traceback for errors we don't know about
         if not isinstance(e, KapitanError):
             logger.exception("\nUnknown (Non-Kapitan) error occurred:\n")
@@ -245,9 +473,716 @@ def compile_targets(
         sys.exit(1)
     finally:
         # always wait for other worker processes to terminate
-        pool.join()
+        if own_pool:
+            pool.join()
+        cached.pool = previous_pool
         shutil.rmtree(temp_path)
         logger.debug("Removed %s", temp_path)
+        if profile_out:
+            write_trace(profile_out)
+            disable_trace()
+
+
+def compile_rendered_targets(pool, worker, target_names, inventory_path, globals_path, keep_going=False):
+    """
+    Renders the node of each target in target_names in the pool processes,
+    and runs worker on it as soon as it is rendered.
+    Set keep_going to return the errors of failed targets in their results, see keep_going_worker()
+    Returns a dict with the result of each target, as returned by compile_target(),
+    and the list of compiled target objects
+    """
+    render_worker = partial(
+        render_compile_target, worker=worker, inventory_path=inventory_path, globals_path=globals_path
+    )
+    if keep_going:
+        render_worker = partial(keep_going_worker, worker=render_worker)
+    results = {}
+    target_objs = []
+    for result in pool.imap_unordered(render_worker, target_names):
+        # targets without a compile list
+        if result is None:
+            continue
+        add_trace_events(result.pop("trace"))
+        # failed targets have no target object
+        if "target_obj" in result:
+            target_objs.append(result.pop("target_obj"))
+        results[result["target"]] = result
+    return results, target_objs
+
+
+def render_compile_target(target_name, worker, inventory_path, globals_path):
+    """
+    renders the node of target_name with the globals saved by save_globals() to globals_path,
+    and compiles it with worker. Returns the result of worker with the target object,
+    or None if target_name has nothing to compile
+    """
+    start = time.time()
+    if worker.keywords.get("profile_out"):
+        enable_trace()
+    ref_controller = load_globals(globals_path)
+    target_objs = load_target_inventory(inventory_path, [target_name])
+    if not target_objs:
+        return None
+    target_obj = target_objs[0]
+    add_span("render " + target_name, "inventory", start, target=target_name)
+
+    # dependencies are fetched by the main process, which only has the nodes the workers render
+    if any(dep.get("force_fetch", False) for dep in target_obj.get("dependencies") or ()):
+        raise CompileError(
+            "{}: dependencies with force_fetch can't be fetched with --stream-inventory".format(target_name)
+        )
+
+    result = worker(target_obj, ref_controller=ref_controller, globals_path=None)
+    result["target_obj"] = target_obj
+    return result
+
+
+def keep_going_worker(arg, worker, **kwargs):
+    """
+    runs worker with arg, a target object or the name of a target to render, for --keep-going.
+    Returns the result of worker, or if it fails, a result with the error of the target
+    """
+    start = time.time()
+    try:
+        return worker(arg, **kwargs)
+    except Exception as e:
+        target_name = arg if isinstance(arg, str) else arg["vars"]["target"]
+        # only keep the traceback of errors we don't know about
+        error = str(e) if isinstance(e, KapitanError) else traceback.format_exc().rstrip()
+        logger.error("Failed to compile %s", target_name)
+        return {
+            "target": target_name,
+            "error": error,
+            "read_set": None,
+            "duration": time.time() - start,
+            "input_durations": {},
+            "files": None,
+            "workers": [(os.getpid(), peak_rss())],
+            "trace": take_trace_events(),
+        }
+
+
+def failure_report(failures, num_targets):
+    """returns the report of the failed targets in failures, with their error and duration"""
+    lines = ["Failed to compile {} of {} targets:".format(len(failures), num_targets)]
+    for target in sorted(failures):
+        result = failures[target]
+        lines.append("")
+        lines.append("{} ({:.2f}s):".format(target, result["duration"]))
+        lines.extend("    " + line for line in result["error"].strip().splitlines())
+    return "\n".join(lines)
+
+
+def schedule_compile(
+    pool,
+    worker,
+    target_objs,
+    durations=None,
+    max_running=None,
+    parallel_inputs=False,
+    fetches=(),
+    search_paths=(),
+    fetch_overlap=False,
+):
+    """
+    Runs worker for each target in target_objs, or with parallel_inputs, for each item of the compile list
+    of every target, in parallel unless an item depends on an earlier one.
+    Items on the longest chain of dependent items, estimated from the saved durations, run first.
+    fetches are (fetch, (source, deps)) items as returned by dependency_fetches(), run before every target,
+    or with fetch_overlap, while compiling the targets that don't read their output paths,
+    see fetch_read_paths()
+    Returns a dict with the result of each target, as returned by compile_target()
+    """
+    durations = durations or {}
+    scheduler = TaskScheduler(pool, max_running=max_running)
+    results = {}
+    remaining_inputs = {}
+
+    # fetch tasks have no target, and depend on earlier fetches of the same source or paths
+    fetch_paths = {}
+    fetch_sources = {}
+    fetch_start = time.time()
+    remaining_fetches = len(fetches)
+
+    def fetch_done(_):
+        nonlocal remaining_fetches
+        remaining_fetches -= 1
+        if remaining_fetches == 0:
+            add_span("fetch dependencies", "fetch", fetch_start)
+
+    for index, (fetch, dep_mapping) in enumerate(fetches):
+        source, deps = dep_mapping
+        name = (None, index)
+        paths = [os.path.abspath(dep["output_path"]) for dep in deps]
+        earlier_fetches = [
+            earlier_name
+            for earlier_name, earlier_paths in fetch_paths.items()
+            if fetch_sources[earlier_name] == source or paths_overlap(paths, earlier_paths)
+        ]
+        fetch_paths[name] = paths
+        fetch_sources[name] = source
+        scheduler.add(
+            name, fetch, args=(dep_mapping,), deps=earlier_fetches, callback=fetch_done, priority=math.inf
+        )
+
+    def input_done(target_obj, result):
+        add_trace_events(result.pop("trace"))
+        target_name = result["target"]
+        if target_name not in results:
+            results[target_name] = result
+        else:
+            target_result = results[target_name]
+            # the first error of a target with --keep-going
+            if "error" in result:
+                target_result.setdefault("error", result["error"])
+            target_result["duration"] += result["duration"]
+            target_result["input_durations"].update(result["input_durations"])
+            target_result["workers"] += result["workers"]
+            if result["files"] is not None:
+                target_result["files"].update(result["files"])
+            read_set = result["read_set"]
+            if target_result["read_set"] is None or read_set is None:
+                target_result["read_set"] = None
+            else:
+                target_result["read_set"]["paths"].update(read_set["paths"])
+                target_result["read_set"]["targets"] = sorted(
+                    set(target_result["read_set"]["targets"]) | set(read_set["targets"])
+                )
+        remaining_inputs[target_name] -= 1
+        if parallel_inputs and remaining_inputs[target_name] == 0:
+            logger.info(
+                "Compiled %s (%.2fs)", target_obj["target_full_path"], results[target_name]["duration"]
+            )
+
+    known = [duration["total"] for duration in durations.values()]
+    default_duration = sum(known) / len(known) if known else 0
+
+    for target_obj in target_objs:
+        target_name = target_obj["vars"]["target"]
+        if fetch_overlap:
+            read_paths = fetch_read_paths(target_obj, search_paths)
+            target_fetches = [name for name, paths in fetch_paths.items() if paths_overlap(paths, read_paths)]
+        else:
+            # inputs can import fetched files through any search path without declaring them
+            target_fetches = list(fetch_paths)
+        if target_fetches:
+            logger.debug("%s waits for %d dependency fetches", target_name, len(target_fetches))
+
+        if not parallel_inputs:
+            remaining_inputs[target_name] = 1
+            scheduler.add(
+                (target_name, None),
+                worker,
+                args=(target_obj,),
+                deps=target_fetches,
+                callback=partial(input_done, target_obj),
+                priority=durations.get(target_name, {}).get("total", default_duration),
+            )
+            continue
+
+        compile_objs = target_obj["compile"]
+        remaining_inputs[target_name] = len(compile_objs)
+        dependencies = compile_obj_dependencies(compile_objs)
+        priorities = critical_paths(dependencies, durations.get(target_name))
+        for index, deps in enumerate(dependencies):
+            scheduler.add(
+                (target_name, index),
+                partial(worker, input_index=index),
+                args=(target_obj,),
+                deps=[(target_name, dep) for dep in deps] + target_fetches,
+                callback=partial(input_done, target_obj),
+                priority=priorities[index],
+            )
+
+    scheduler.run()
+    return results
+
+
+def fetch_read_paths(target_obj, search_paths):
+    """
+    returns the absolute paths target_obj may read fetched dependencies from: the output paths
+    of its own dependencies, its input paths in each of search_paths, and the search paths
+    other than the working directory, whose files can be imported by any input
+    """
+    paths = [os.path.abspath(dep["output_path"]) for dep in target_obj.get("dependencies") or ()]
+    cwd = os.getcwd()
+    for search_path in search_paths:
+        search_path = os.path.abspath(search_path)
+        if search_path != cwd:
+            paths.append(search_path)
+        for comp_obj in target_obj["compile"]:
+            for input_path in comp_obj["input_paths"]:
+                paths.append(os.path.normpath(os.path.join(search_path, glob_base(input_path))))
+    return paths
+
+
+def paths_overlap(paths, other_paths):
+    """returns True if a path in paths is, or contains or is in, a path in other_paths"""
+    for path in paths:
+        for other_path in other_paths:
+            if (
+                path == other_path
+                or path.startswith(other_path + os.sep)
+                or other_path.startswith(path + os.sep)
+            ):
+                return True
+    return False
+
+
+def critical_paths(dependencies, duration=None):
+    """
+    returns the estimated time from the start of each compile list item to the end of its target,
+    given the dependencies of each item and the saved duration of the target.
+    Items without a saved duration are estimated with the mean of the others
+    """
+    input_durations = {}
+    if duration:
+        input_durations = {int(index): secs for index, secs in (duration.get("inputs") or {}).items()}
+    if input_durations:
+        default = sum(input_durations.values()) / len(input_durations)
+    elif duration and dependencies:
+        default = duration["total"] / len(dependencies)
+    else:
+        default = 0
+
+    dependents = defaultdict(list)
+    for index, deps in enumerate(dependencies):
+        for dep in deps:
+            dependents[dep].append(index)
+
+    paths = [0] * len(dependencies)
+    for index in reversed(range(len(dependencies))):
+        longest_dependent = max((paths[dependent] for dependent in dependents[index]), default=0)
+        paths[index] = input_durations.get(index, default) + longest_dependent
+    return paths
+
+
+def order_by_duration(target_objs, durations):
+    """
+    returns target_objs sorted by their saved duration, longest first.
+    Targets without a saved duration are estimated with the mean of the others
+    """
+    known = [
+        durations[target_obj["vars"]["target"]]["total"]
+        for target_obj in target_objs
+        if target_obj["vars"]["target"] in durations
+    ]
+    if not known:
+        return list(target_objs)
+    default = sum(known) / len(known)
+
+    def duration(target_obj):
+        saved = durations.get(target_obj["vars"]["target"])
+        return saved["total"] if saved else default
+
+    return sorted(target_objs, key=duration, reverse=True)
+
+
+def worker_pool(processes, max_targets=None, max_memory=None, start_method=None):
+    """
+    returns a pool of processes worker processes started with start_method, see worker_context(),
+    replaced by new ones after compiling max_targets targets, or once they use more than max_memory MiB,
+    to release what workers accumulate between targets
+    """
+    max_rss = None
+    main_rss = current_rss() if max_memory else None
+    if max_memory and main_rss is None:
+        # the peak memory only grows, it would replace workers after every target once above the limit
+        logger.warning("Can't read the resident memory of processes, ignoring --worker-max-memory")
+    elif max_memory:
+        max_rss = max_memory * 2**20
+        if main_rss > max_rss:
+            # forked workers start with the memory of this process
+            logger.warning(
+                "Workers start with %d MiB, above --worker-max-memory %d MiB: "
+                "they will be replaced after every target",
+                main_rss // 2**20,
+                max_memory,
+            )
+    context = worker_context(start_method)
+    initializer = None
+    if context.get_start_method() == "forkserver":
+        initializer = forkserver_worker_init
+    return RecyclingPool(
+        processes, initializer, maxtasksperchild=max_targets, context=context, max_rss=max_rss
+    )
+
+
+def worker_context(start_method=None):
+    """
+    returns the multiprocessing context starting compile processes with start_method,
+    or the default start method if None. The forkserver preloads WORKER_PRELOAD_MODULES,
+    so that compile processes are forked with kapitan imported
+    """
+    if start_method == "forkserver" and "forkserver" not in multiprocessing.get_all_start_methods():
+        logger.warning("The forkserver start method is not available on this platform, using spawn")
+        start_method = "spawn"
+    context = multiprocessing.get_context(start_method)
+    if start_method == "forkserver":
+        context.set_forkserver_preload(WORKER_PRELOAD_MODULES)
+    return context
+
+
+def forkserver_worker_init():
+    """
+    sets up the logging of a compile process forked by the forkserver,
+    which imported kapitan without the command line arguments
+    """
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    setup_logging(sys.argv)
+
+
+def worker_memory_report(results):
+    """returns a report of the tasks and peak memory of each worker process that compiled results"""
+    workers = {}
+    for result in results:
+        for pid, peak in result["workers"]:
+            tasks, worker_peak = workers.get(pid, (0, 0))
+            # peak is None where it can't be read
+            workers[pid] = (tasks + 1, max(peak or 0, worker_peak))
+    lines = ["Worker peak memory:"]
+    for pid, (tasks, peak) in sorted(workers.items(), key=lambda item: (-item[1][1], item[0])):
+        lines.append("    worker {}: {} tasks, {:.1f} MiB".format(pid, tasks, peak / 2**20))
+    return "\n".join(lines)
+
+
+def pool_size(parallel, num_targets, durations=()):
+    """
+    returns the number of processes to compile num_targets targets with.
+    With the saved durations of (some of) the targets, processes that would be left idle
+    by the longest target are not started
+    """
+    num_processes = min(parallel, num_targets)
+    durations = list(durations)
+    if durations and max(durations) > 0:
+        # targets without a saved duration are estimated with the mean of the others
+        total = sum(durations) * max(num_targets, len(durations)) / len(durations)
+        # longest-first scheduling can't finish before the longest target, so more processes
+        # than the total time divided by the longest target don't shorten the compilation
+        num_processes = min(num_processes, math.ceil(total / max(durations)))
+    return max(1, num_processes)
+
+
+def shard_targets(targets, index, count, durations=None):
+    """
+    returns the sorted targets of shard index (1-based) of count shards.
+    Targets are spread so that every shard gets the same number of targets, or with
+    the saved durations, about the same total duration. Targets without a saved
+    duration are estimated with the mean of the others.
+    The shards only depend on the arguments, so every machine computes the same ones
+    """
+    if not 1 <= index <= count:
+        raise CompileError("Shard {}/{} is out of range".format(index, count))
+
+    weights = {target: 1 for target in targets}
+    known = [durations[target]["total"] for target in targets if target in (durations or {})]
+    if known:
+        default = sum(known) / len(known)
+        weights = {
+            target: durations[target]["total"] if target in durations else default for target in targets
+        }
+
+    # the longest targets first, each to the shard with the least total weight
+    loads = [0] * count
+    shards = [[] for _ in range(count)]
+    for target in sorted(targets, key=lambda target: (-weights[target], target)):
+        shard = loads.index(min(loads))
+        loads[shard] += weights[target]
+        shards[shard].append(target)
+    return sorted(shards[index - 1])
+
+
+def write_shard_manifest(output_path, shard, target_paths):
+    """
+    writes .kapitan_shard to the compiled path of output_path, listing the shard and the
+    compiled path of each of its targets, for merge_shards()
+    """
+    compile_path = os.path.join(output_path, "compiled")
+    os.makedirs(compile_path, exist_ok=True)
+    index, count = shard
+    with open(os.path.join(compile_path, ".kapitan_shard"), "w") as f:
+        yaml.safe_dump({"index": index, "count": count, "targets": target_paths}, f, default_flow_style=False)
+
+
+def merge_shards(shard_paths, output_path):
+    """
+    merges the compiled targets, .kapitan_cache and .kapitan_manifest.json of the compile --shard
+    outputs in shard_paths into the compiled path of output_path.
+    Only the targets of each shard are taken from it
+    """
+    compile_path = os.path.join(output_path, "compiled")
+    manifests = []
+    for shard_path in shard_paths:
+        manifest_path = os.path.join(shard_path, "compiled", ".kapitan_shard")
+        try:
+            with open(manifest_path, "r") as f:
+                manifests.append(yaml.safe_load(f))
+        except OSError:
+            raise KapitanError("{} is not the output of compile --shard".format(shard_path))
+
+    counts = {manifest["count"] for manifest in manifests}
+    if len(counts) > 1:
+        raise KapitanError("Shards of different counts can't be merged: {}".format(sorted(counts)))
+    indexes = [manifest["index"] for manifest in manifests]
+    duplicates = sorted({index for index in indexes if indexes.count(index) > 1})
+    if duplicates:
+        raise KapitanError("Shards merged more than once: {}".format(duplicates))
+    if manifests:
+        missing = sorted(set(range(1, manifests[0]["count"] + 1)) - set(indexes))
+        if missing:
+            logger.warning("Shards not merged: %s", ", ".join(str(index) for index in missing))
+
+    os.makedirs(compile_path, exist_ok=True)
+    merged_cache = load_inv_cache(output_path) or {}
+    for shard_path, manifest in zip(shard_paths, manifests):
+        shard_compile_path = os.path.join(shard_path, "compiled")
+        for target, path in manifest["targets"].items():
+            target_path = os.path.join(shard_compile_path, path)
+            # targets without a compile list have no output
+            if not os.path.isdir(target_path):
+                continue
+            merged_path = os.path.join(compile_path, path)
+            # the output path can be one of the shards
+            if os.path.realpath(merged_path) == os.path.realpath(target_path):
+                continue
+            if os.path.exists(merged_path):
+                shutil.rmtree(merged_path)
+            shutil.copytree(target_path, merged_path)
+            logger.debug("Copied %s into %s", target_path, merged_path)
+        logger.info("Merged shard %d/%d from %s", manifest["index"], manifest["count"], shard_path)
+
+        # files compiled with --manifest
+        try:
+            with open(os.path.join(shard_compile_path, ".kapitan_manifest.json"), "r") as f:
+                shard_files = json.load(f)["files"]
+        except OSError:
+            shard_files = None
+        if shard_files is not None:
+            files = {
+                path: entry for path, entry in shard_files.items() if entry["target"] in manifest["targets"]
+            }
+            save_manifest(compile_path, files, list(manifest["targets"].values()))
+
+        shard_cache = load_inv_cache(shard_path)
+        if not shard_cache:
+            continue
+        merged_cache.setdefault("folder", {}).update(shard_cache.get("folder") or {})
+        for key in ("inventory", "read_set", "durations"):
+            merged_cache.setdefault(key, {})
+            for target in manifest["targets"]:
+                if target in (shard_cache.get(key) or {}):
+                    merged_cache[key][target] = shard_cache[key][target]
+
+    if merged_cache:
+        with open(os.path.join(compile_path, ".kapitan_cache"), "w") as f:
+            yaml.dump(merged_cache, stream=f, default_flow_style=False)
+
+    # the merged output is not a shard, even if it is in one of the shard paths
+    merged_manifest_path = os.path.join(compile_path, ".kapitan_shard")
+    if os.path.exists(merged_manifest_path):
+        os.remove(merged_manifest_path)
+
+
+def compile_obj_paths(comp_obj):
+    """
+    returns the paths comp_obj reads from and writes to in the compile path of its target,
+    where "" is the whole compile path of the target
+    """
+    input_type = comp_obj["input_type"]
+    # external inputs can read and write anything
+    if input_type == "external":
+        return {""}, {""}
+
+    read_paths = set()
+    # input paths in compiled/ are read from previously compiled items through the temp search path
+    if any(os.path.normpath(path).split(os.sep)[0] == "compiled" for path in comp_obj["input_paths"]):
+        read_paths.add("")
+
+    if input_type == "remove":
+        # removed paths are in compiled/
+        write_paths = {""}
+    else:
+        output_path = os.path.normpath(comp_obj["output_path"])
+        write_paths = {"" if output_path == "." else output_path}
+
+    return read_paths, write_paths
+
+
+def compile_obj_dependencies(compile_objs):
+    """
+    returns a list with the set of indexes of the earlier compile_objs each item of compile_objs
+    depends on: items writing to overlapping paths, or reading paths written by the other
+    """
+
+    def overlap(paths, other_paths):
+        for path in paths:
+            for other_path in other_paths:
+                if (
+                    path == ""
+                    or other_path == ""
+                    or path == other_path
+                    or path.startswith(other_path + os.sep)
+                    or other_path.startswith(path + os.sep)
+                ):
+                    return True
+        return False
+
+    obj_paths = [compile_obj_paths(comp_obj) for comp_obj in compile_objs]
+    dependencies = []
+    for index, (read_paths, write_paths) in enumerate(obj_paths):
+        deps = set()
+        for earlier_index, (earlier_read_paths, earlier_write_paths) in enumerate(obj_paths[:index]):
+            if (
+                overlap(write_paths, earlier_write_paths)
+                or overlap(read_paths, earlier_write_paths)
+                or overlap(write_paths, earlier_read_paths)
+            ):
+                deps.add(earlier_index)
+        dependencies.append(deps)
+    return dependencies
+
+
+def replace_path(src, dst, trash_path):
+    """
+    Moves src to dst using renames only, so dst is never seen half-written.
+    An existing dst is first moved into trash_path, which must be on the same
+    filesystem as src and dst, and is left there for the caller to remove
+    """
+    parent_path = os.path.dirname(dst)
+    if parent_path:
+        os.makedirs(parent_path, exist_ok=True)
+
+    old_path = None
+    if os.path.lexists(dst):
+        old_path = tempfile.mkdtemp(dir=trash_path)
+        old_path = os.path.join(old_path, os.path.basename(dst))
+        os.rename(dst, old_path)
+
+    try:
+        os.rename(src, dst)
+    except OSError:
+        # put back the previous output if src could not be moved in place
+        if old_path:
+            os.rename(old_path, dst)
+        raise
+
+
+def remove_path(path):
+    """removes the file, symlink or directory at path"""
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.unlink(path)
+
+
+def same_file(src, dst):
+    """returns True if the regular file dst has the content and mode of src"""
+    if os.path.islink(dst) or not os.path.isfile(dst):
+        return False
+    if os.stat(src).st_mode != os.stat(dst).st_mode:
+        return False
+    return filecmp.cmp(src, dst, shallow=False)
+
+
+def sync_path(src, dst):
+    """
+    Copies src to dst, skipping the files of dst whose content and mode are those in src,
+    so unchanged files are not rewritten and keep their modification time.
+    Paths in dst that are not in src are removed
+    """
+    for dirpath, dirnames, filenames in os.walk(src):
+        dst_dirpath = os.path.normpath(os.path.join(dst, os.path.relpath(dirpath, src)))
+        if os.path.lexists(dst_dirpath) and (os.path.islink(dst_dirpath) or not os.path.isdir(dst_dirpath)):
+            os.unlink(dst_dirpath)
+        os.makedirs(dst_dirpath, exist_ok=True)
+
+        names = set(dirnames) | set(filenames)
+        for name in os.listdir(dst_dirpath):
+            if name not in names:
+                remove_path(os.path.join(dst_dirpath, name))
+
+        for filename in filenames:
+            src_file = os.path.join(dirpath, filename)
+            dst_file = os.path.join(dst_dirpath, filename)
+            if same_file(src_file, dst_file):
+                continue
+            if os.path.lexists(dst_file):
+                remove_path(dst_file)
+            shutil.copy2(src_file, dst_file)
+
+
+def target_manifest(compile_path, target_obj, recorded=None):
+    """
+    returns the sha256, size and producing compile list item of each file compiled for target_obj
+    in compile_path, by path relative to compile_path. Hashes recorded by CompiledFile are reused
+    unless the file was modified after
+    """
+    compile_objs = target_obj["compile"]
+    # the paths each item of the compile list writes to, the last one wins
+    write_paths = [
+        (index, compile_obj_paths(comp_obj)[1])
+        for index, comp_obj in reversed(list(enumerate(compile_objs)))
+        if comp_obj["input_type"] != "remove"
+    ]
+    recorded = recorded or {}
+    files = {}
+    target_path = os.path.join(compile_path, target_obj["target_full_path"])
+    for root, _, names in os.walk(target_path):
+        for name in names:
+            file_path = os.path.join(root, name)
+            rel_path = os.path.relpath(file_path, compile_path)
+            file_stat = os.stat(file_path)
+            entry = recorded.get(rel_path)
+            if entry and entry["size"] == file_stat.st_size and entry["mtime_ns"] == file_stat.st_mtime_ns:
+                sha256, input_index = entry["sha256"], entry["input_index"]
+            else:
+                sha256, input_index = file_sha256(file_path), None
+                target_rel_path = os.path.relpath(file_path, target_path)
+                for index, paths in write_paths:
+                    if any(
+                        path == "" or target_rel_path == path or target_rel_path.startswith(path + os.sep)
+                        for path in paths
+                    ):
+                        input_index = index
+                        break
+            files[rel_path] = {
+                "sha256": sha256,
+                "size": file_stat.st_size,
+                "target": target_obj["vars"]["target"],
+                "input_index": input_index,
+                "input_type": None if input_index is None else compile_objs[input_index]["input_type"],
+            }
+    return files
+
+
+def save_manifest(compile_path, files, target_paths=None):
+    """
+    writes the files of the compiled targets to .kapitan_manifest.json in compile_path.
+    With target_paths, only the files of the targets compiled to them are replaced
+    """
+    manifest_path = os.path.join(compile_path, ".kapitan_manifest.json")
+    manifest_files = {}
+    if target_paths is not None:
+        try:
+            with open(manifest_path, "r") as f:
+                manifest_files = json.load(f)["files"]
+        except (OSError, ValueError, KeyError):
+            pass
+        manifest_files = {
+            path: entry
+            for path, entry in manifest_files.items()
+            if not any(path.startswith(target_path + os.sep) for target_path in target_paths)
+        }
+    manifest_files.update(files)
+
+    # readers never see a partly written manifest
+    temp_manifest_path = manifest_path + ".tmp"
+    with open(temp_manifest_path, "w") as f:
+        json.dump({"files": manifest_files}, f, indent=2, sort_keys=True)
+    os.replace(temp_manifest_path, manifest_path)
+    logger.debug("Saved .kapitan_manifest.json")
 
 
 def generate_inv_cache_hashes(inventory_path, targets, cache_paths):
@@ -317,11 +1252,8 @@ def generate_inv_cache_hashes(inventory_path, targets, cache_paths):
                     cached.inv_cache["folder"][common] = directory_hash(common)
 
 
-def changed_targets(inventory_path, output_path):
-    """returns a list of targets that have changed since last compilation"""
-    targets = []
-    inv = get_inventory(inventory_path)
-
+def load_inv_cache(output_path):
+    """returns the .kapitan_cache saved by the last compilation to output_path, None if there is none"""
     saved_inv_cache = None
     saved_inv_cache_path = os.path.join(output_path, "compiled/.kapitan_cache")
     if os.path.exists(saved_inv_cache_path):
@@ -330,6 +1262,19 @@ def changed_targets(inventory_path, output_path):
                 saved_inv_cache = yaml.safe_load(f)
             except Exception:
                 raise CompileError("Failed to load kapitan cache: %s", saved_inv_cache_path)
+    return saved_inv_cache
+
+
+def changed_targets(inventory_path, output_path, cache_paths=(), saved_inv_cache=None):
+    """
+    returns a list of targets that have changed since last compilation.
+    saved_inv_cache is loaded from output_path if not set
+    """
+    targets = []
+    inv = get_inventory(inventory_path)
+
+    if saved_inv_cache is None:
+        saved_inv_cache = load_inv_cache(output_path)
 
     targets_list = list(inv["nodes"])
 
@@ -337,16 +1282,22 @@ def changed_targets(inventory_path, output_path):
     if not saved_inv_cache:
         return targets_list
     else:
+        changed_folders = []
         for key, hash in cached.inv_cache["folder"].items():
             try:
                 if hash != saved_inv_cache["folder"][key]:
-                    logger.debug("%s folder hash changed, recompiling all targets", key)
-                    return targets_list
+                    changed_folders.append(key)
             except KeyError:
                 # Errors usually occur when saved_inv_cache doesn't contain a new folder
                 # Recompile anyway to be safe
+                changed_folders.append(key)
+
+        for key in changed_folders:
+            if key in (cache_paths or ()):
+                logger.debug("%s folder hash changed, recompiling all targets", key)
                 return targets_list
 
+        changed_inventories = set()
         for target in targets_list:
             try:
                 if (
@@ -354,34 +1305,87 @@ def changed_targets(inventory_path, output_path):
                     != saved_inv_cache["inventory"][target]["classes"]
                 ):
                     logger.debug("classes hash changed in %s, recompiling", target)
-                    targets.append(target)
+                    changed_inventories.add(target)
                 elif (
                     cached.inv_cache["inventory"][target]["parameters"]
                     != saved_inv_cache["inventory"][target]["parameters"]
                 ):
                     logger.debug("parameters hash changed in %s, recompiling", target)
-                    targets.append(target)
+                    changed_inventories.add(target)
             except KeyError:
                 # Errors usually occur when saved_inv_cache doesn't contain a new target
                 # Recompile anyway to be safe
+                changed_inventories.add(target)
+
+        saved_read_sets = saved_inv_cache.get("read_set", {})
+        path_hashes = {}
+        for target in targets_list:
+            if target in changed_inventories:
                 targets.append(target)
+                continue
+
+            read_set = saved_read_sets.get(target)
+            # targets without a read-set depend on every cached folder
+            if read_set is None:
+                if changed_folders:
+                    logger.debug("%s folder hash changed, recompiling %s", changed_folders[0], target)
+                    targets.append(target)
+                continue
+
+            for path, hash in read_set["paths"].items():
+                if path not in path_hashes:
+                    path_hashes[path] = path_hash(path)
+                if path_hashes[path] != hash:
+                    logger.debug("%s changed, recompiling %s", path, target)
+                    targets.append(target)
+                    break
+            else:
+                for read_target in read_set["targets"]:
+                    if read_target in changed_inventories or read_target not in inv["nodes"]:
+                        logger.debug("inventory of %s changed, recompiling %s", read_target, target)
+                        targets.append(target)
+                        break
 
     return targets
 
 
-def save_inv_cache(compile_path, targets):
-    """save the cache to .kapitan_cache for inventories per target and folders"""
+def save_inv_cache(compile_path, targets, results=None, failed_targets=()):
+    """
+    save the cache to .kapitan_cache for inventories per target and folders,
+    and the read-sets and durations of the compiled targets in results.
+    failed_targets are left out of the cache, so that they are compiled again
+    """
     if cached.inv_cache:
         inv_cache_path = os.path.join(compile_path, ".kapitan_cache")
+        saved_inv_cache = None
+        try:
+            with open(inv_cache_path, "r") as f:
+                saved_inv_cache = yaml.safe_load(f)
+        except Exception:
+            pass
+
+        # keep the read-sets and durations of targets that were not compiled this time
+        saved_read_sets = {}
+        saved_durations = {}
+        if saved_inv_cache:
+            saved_read_sets = saved_inv_cache.get("read_set") or {}
+            saved_durations = saved_inv_cache.get("durations") or {}
+        for target in failed_targets:
+            saved_read_sets.pop(target, None)
+        for target, result in (results or {}).items():
+            if result["read_set"] is None:
+                saved_read_sets.pop(target, None)
+            else:
+                saved_read_sets[target] = result["read_set"]
+            saved_durations[target] = {
+                "total": round(result["duration"], 3),
+                "inputs": {
+                    index: round(duration, 3) for index, duration in result["input_durations"].items()
+                },
+            }
+
         # If only some targets were selected (-t), overwride only their inventory
         if targets:
-            saved_inv_cache = None
-            try:
-                with open(inv_cache_path, "r") as f:
-                    saved_inv_cache = yaml.safe_load(f)
-            except Exception:
-                pass
-
             if saved_inv_cache:
                 if "inventory" not in saved_inv_cache:
                     saved_inv_cache["inventory"] = {}
@@ -399,12 +1403,31 @@ def save_inv_cache(compile_path, targets):
                 saved_inv_cache["inventory"][target]["parameters"] = cached.inv_cache["inventory"][target][
                     "parameters"
                 ]
+            for target in failed_targets:
+                saved_inv_cache["inventory"].pop(target, None)
+            # folders are only hashed when all targets are, e.g. for a --shard
+            if cached.inv_cache["folder"]:
+                saved_inv_cache["folder"] = cached.inv_cache["folder"]
+            saved_inv_cache["read_set"] = saved_read_sets
+            saved_inv_cache["durations"] = saved_durations
 
             with open(inv_cache_path, "w") as f:
                 logger.debug("Saved .kapitan_cache for targets: %s", targets)
                 yaml.dump(saved_inv_cache, stream=f, default_flow_style=False)
 
         else:
+            for target in failed_targets:
+                cached.inv_cache["inventory"].pop(target, None)
+            cached.inv_cache["read_set"] = {
+                target: read_set
+                for target, read_set in saved_read_sets.items()
+                if target in cached.inv_cache["inventory"]
+            }
+            cached.inv_cache["durations"] = {
+                target: duration
+                for target, duration in saved_durations.items()
+                if target in cached.inv_cache["inventory"]
+            }
             with open(inv_cache_path, "w") as f:
                 logger.debug("Saved .kapitan_cache")
                 yaml.dump(cached.inv_cache, stream=f, default_flow_style=False)
@@ -480,23 +1503,121 @@ def search_targets(inventory_path, targets, labels):
     return targets_found
 
 
+def save_globals(temp_path, ref_controller):
+    """
+    pickles the cached globals and ref_controller to a file in temp_path and returns its path.
+    The inventory nodes are saved to a NodeStore, read by workers one node at a time
+    """
+    globals_cached = cached.as_dict()
+    nodes_path = None
+    # rendered nodes are rendered by each worker, and only the backend is pickled
+    if cached.inv.get("nodes") is not None and not isinstance(cached.inv["nodes"], RenderedNodes):
+        nodes_path = os.path.join(temp_path, "inventory.nodes")
+        save_nodes(nodes_path, cached.inv["nodes"])
+        globals_cached["inv"] = {key: value for key, value in cached.inv.items() if key != "nodes"}
+
+    globals_path = os.path.join(temp_path, "globals.pickle")
+    with open(globals_path, "wb") as fp:
+        pickle.dump(
+            {"cached": globals_cached, "ref_controller": ref_controller, "nodes_path": nodes_path},
+            fp,
+            pickle.HIGHEST_PROTOCOL,
+        )
+    logger.debug("Saved globals to %s (%d bytes)", globals_path, os.path.getsize(globals_path))
+    return globals_path
+
+
+# path and ref controller of the globals loaded by load_globals() in this process
+_loaded_globals = (None, None)
+
+
+def load_globals(globals_path):
+    """
+    sets the cached globals saved by save_globals() to globals_path and returns the saved ref controller.
+    Each worker process only loads globals_path once, and later calls release the nodes read from a NodeStore
+    """
+    global _loaded_globals
+    loaded_path, ref_controller = _loaded_globals
+    if loaded_path != globals_path:
+        with open(globals_path, "rb") as fp:
+            saved_globals = pickle.load(fp)
+        cached.from_dict(saved_globals["cached"])
+        if saved_globals["nodes_path"]:
+            cached.inv["nodes"] = NodeStore(saved_globals["nodes_path"])
+        ref_controller = saved_globals["ref_controller"]
+        _loaded_globals = (globals_path, ref_controller)
+    elif isinstance(cached.inv.get("nodes"), NodeStore):
+        # rendered nodes are kept, as targets reading inventory_global would render every node again
+        cached.inv["nodes"].release()
+    return ref_controller
+
+
 def compile_target(target_obj, search_paths, compile_path, ref_controller, globals_cached=None, **kwargs):
-    """Compiles target_obj and writes to compile_path"""
+    """
+    Compiles target_obj and writes to compile_path
+    Set input_index to only compile that item of the target's compile list
+    Set globals_path to load the globals and ref controller saved by save_globals()
+    Set profile_targets to profile the targets in it, writing to profile_path
+    Returns a dict with the target name, the compile duration of the target and of each compiled item,
+    if --cache is set, its read-set, and if --manifest is set, the hash of each file
+    """
     start = time.time()
+    input_index = kwargs.pop("input_index", None)
     compile_objs = target_obj["compile"]
     ext_vars = target_obj["vars"]
     target_name = ext_vars["target"]
 
-    if globals_cached:
+    if kwargs.get("profile_out"):
+        enable_trace()
+
+    globals_path = kwargs.pop("globals_path", None)
+    if globals_path:
+        ref_controller = load_globals(globals_path)
+    elif globals_cached:
         cached.from_dict(globals_cached)
 
     use_go_jsonnet = kwargs.get("use_go_jsonnet", False)
     if use_go_jsonnet:
         logger.debug("Using go-jsonnet over jsonnet")
 
-    for comp_obj in compile_objs:
+    # profile the targets selected with --profile-targets
+    profile_memory = kwargs.get("profile_memory", False)
+    profiler = None
+    if target_name in (kwargs.get("profile_targets") or ()):
+        profiler = start_profile(memory=profile_memory)
+
+    # with --async-output, files are written in the background while the next ones are rendered
+    CompiledFile.writer = None
+    if kwargs.get("async_output", False):
+        CompiledFile.writer = OutputWriter.get()
+        # drop the files left by a target that failed in this process
+        CompiledFile.writer.flush(raise_error=False)
+
+    # compare written files against the previous output so unchanged files are not rewritten
+    CompiledFile.stage_path = compile_path
+    CompiledFile.reference_path = kwargs.get("reference_compile_path", None)
+    # copy and external inputs may modify files in place, so they must not share inodes with the previous output
+    CompiledFile.link_unchanged = not any(obj["input_type"] in ("copy", "external") for obj in compile_objs)
+    CompiledFile.stats.clear()
+    # record the hashes of written files for the --manifest
+    CompiledFile.files = {} if kwargs.get("manifest") else None
+
+    # record the files read by the target for --cache and --watch,
+    # unless an external input may read any file
+    record_read_set = kwargs.get("cache", False) or kwargs.get("watch", False)
+    if record_read_set and not any(obj["input_type"] == "external" for obj in compile_objs):
+        cached.read_set = {"paths": set(), "targets": set()}
+    else:
+        cached.read_set = None
+
+    input_durations = {}
+    for index, comp_obj in enumerate(compile_objs):
+        if input_index is not None and index != input_index:
+            continue
+        input_start = time.time()
         input_type = comp_obj["input_type"]
         output_path = comp_obj["output_path"]
+        CompiledFile.input_index = index
         input_params = comp_obj.setdefault("input_params", {})
 
         if input_type == "jinja2":
@@ -524,8 +1645,82 @@ def compile_target(target_obj, search_paths, compile_path, ref_controller, globa
 
         input_compiler.make_compile_dirs(target_name, output_path, **kwargs)
         input_compiler.compile_obj(comp_obj, ext_vars, **kwargs)
+        if CompiledFile.writer is not None:
+            # later items may read the files written by this one
+            CompiledFile.writer.flush()
+        input_durations[index] = time.time() - input_start
+        add_span(
+            "{} {}".format(input_type, ", ".join(comp_obj["input_paths"])),
+            "input",
+            input_start,
+            target=target_name,
+            input_type=input_type,
+            input_paths=comp_obj["input_paths"],
+            output_path=output_path,
+        )
+
+    if input_index is None:
+        logger.info("Compiled %s (%.2fs)", target_obj["target_full_path"], time.time() - start)
+    else:
+        logger.debug(
+            "Compiled input %d of %s (%.2fs)",
+            input_index,
+            target_obj["target_full_path"],
+            time.time() - start,
+        )
+    logger.debug(
+        "Compiled %s: %d files written, %d unchanged",
+        target_obj["target_full_path"],
+        CompiledFile.stats["written"],
+        CompiledFile.stats["unchanged"],
+    )
+
+    read_set = None
+    if cached.read_set is not None:
+        read_set = hash_read_set(cached.read_set, os.path.dirname(compile_path))
+        cached.read_set = None
+
+    files = CompiledFile.files
+    CompiledFile.files = None
+    # a single compile list item can't tell which files of the target other items write
+    if files is not None and input_index is None:
+        files = target_manifest(compile_path, target_obj, files)
+
+    if profiler is not None:
+        profile_name = target_name if input_index is None else "{}.{}".format(target_name, input_index)
+        logger.info(stop_profile(profiler, profile_name, kwargs["profile_path"], memory=profile_memory))
+
+    add_span(target_name, "target", start, target=target_name, input_index=input_index)
+    return {
+        "target": target_name,
+        "read_set": read_set,
+        "duration": time.time() - start,
+        "input_durations": input_durations,
+        # with --manifest, the files of the target, or those written by the compiled item
+        "files": files,
+        # the worker process and its peak memory, for the worker memory report
+        "workers": [(os.getpid(), peak_rss())],
+        # trace events recorded in this worker, collected by the process writing --profile-out
+        "trace": take_trace_events(),
+    }
+
+
+def hash_read_set(read_set, exclude_path):
+    """
+    returns read_set with the hash of each path read, leaving out paths in exclude_path.
+    paths in the current directory are made relative to it
+    """
+    exclude_path = os.path.abspath(exclude_path)
+    path_hashes = {}
+    for path in read_set["paths"]:
+        abs_path = os.path.abspath(path)
+        if abs_path == exclude_path or abs_path.startswith(exclude_path + os.sep):
+            continue
+        path = normalise_read_path(abs_path)
+        if path not in path_hashes:
+            path_hashes[path] = path_hash(path)
 
-    logger.info("Compiled %s (%.2fs)", target_obj["target_full_path"], time.time() - start)
+    return {"paths": path_hashes, "targets": sorted(read_set["targets"])}
 
 
 @hashable_lru_cache
@@ -113,6 +113,70 @@ def sha256_string(string):
     return sha256(string.encode("UTF-8")).hexdigest()
 
 
+def file_sha256(name, chunk_size=1 << 20):
+    """Returns sha256 hex digest for the contents of file name"""
+    file_hash = sha256()
+    with open(name, "rb") as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def record_read(path):
+    """Adds path to the read-set of the target being compiled, if read-sets are being recorded"""
+    if cached.read_set is not None:
+        cached.read_set["paths"].add(path)
+
+
+def record_inventory_read(target):
+    """Adds the inventory of target to the read-set of the target being compiled"""
+    if cached.read_set is not None:
+        cached.read_set["targets"].add(target)
+
+
+def normalise_read_path(path):
+    """Returns path relative to the current directory if path is in it, otherwise the absolute path"""
+    path = os.path.abspath(path)
+    cwd = os.getcwd()
+    if path.startswith(cwd + os.sep):
+        return os.path.relpath(path, cwd)
+    return path
+
+
+def path_hash(path):
+    """
+    Returns sha256 hex digest for path: the file contents for files,
+    every file name and contents for directories, None if path doesn't exist
+    """
+    if os.path.isfile(path):
+        return file_sha256(path)
+    if not os.path.isdir(path):
+        return None
+
+    hash = sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            hash.update(os.path.relpath(file_path, path).encode("UTF-8"))
+            hash.update(file_sha256(file_path).encode("UTF-8"))
+    return hash.hexdigest()
+
+
+class ReadSetFileSystemLoader(jinja2.FileSystemLoader):
+    """FileSystemLoader that records the template paths it looks up in the read-set"""
+
+    def get_source(self, environment, template):
+        if cached.read_set is not None:
+            pieces = jinja2.loaders.split_template_path(template)
+            for search_path in self.searchpath:
+                template_path = os.path.join(search_path, *pieces)
+                record_read(template_path)
+                if os.path.isfile(template_path):
+                    break
+        return super().get_source(environment, template)
+
+
 def _jinja_error_info(trace_data):
     """Extract jinja2 templating related frames from traceback data"""
     try:
@@ -127,12 +191,13 @@ def render_jinja2_file(name, context, jinja2_filters=defaults.DEFAULT_JINJA2_FIL
     search_paths = [path or "./"] + (search_paths or [])
     env = jinja2.Environment(
         undefined=jinja2.StrictUndefined,
-        loader=jinja2.FileSystemLoader(search_paths),
+        loader=ReadSetFileSystemLoader(search_paths),
         trim_blocks=True,
         lstrip_blocks=True,
         extensions=["jinja2.ext.do"],
     )
     load_jinja2_filters(env)
+    record_read(jinja2_filters)
     load_jinja2_filters_from_file(env, jinja2_filters)
     try:
         return env.get_template(filename).render(context)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 The Kapitan Authors
+# SPDX-FileCopyrightText: 2020 The Kapitan Authors <kapitan-admins@googlegroups.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"watch module"
+
+import logging
+import os
+import sys
+import time
+
+import yaml
+
+import kapitan.cached as cached
+from kapitan.errors import KapitanError
+from kapitan.resources import get_inventory
+from kapitan.targets import compile_targets, search_targets, worker_pool
+from kapitan.utils import dictionary_hash, normalise_read_path
+
+logger = logging.getLogger(__name__)
+
+# seconds between two scans of the watched paths
+WATCH_INTERVAL = 0.5
+
+
+def watch_targets(
+    inventory_path, search_paths, output_path, parallel, targets, labels, ref_controller, **kwargs
+):
+    """
+    Compiles targets, then watches inventory_path and the paths read by the targets for changes
+    and recompiles the targets affected by each change until interrupted.
+    The inventory, jsonnet imports and worker pool are kept between compilations.
+    kwargs are passed to compile_targets()
+    """
+    if kwargs.get("fetch") or kwargs.get("force_fetch"):
+        # fetched dependencies are written to the watched paths and would be compiled again and again
+        logger.error("--watch can't be used with --fetch or --force-fetch, fetch dependencies first")
+        sys.exit(1)
+
+    try:
+        selected_targets = search_targets(inventory_path, targets, labels)
+    except KapitanError as e:
+        logger.error(e)
+        return
+
+    pool = worker_pool(
+        max(1, parallel),
+        kwargs.get("worker_max_targets"),
+        kwargs.get("worker_max_memory"),
+        kwargs.get("worker_start_method"),
+    )
+    compile_path = os.path.join(output_path, "compiled")
+    excluded_paths = [compile_path, os.path.join(output_path, ".dependency_cache")]
+
+    def compile_selected(names):
+        """returns the read-sets of targets in names, None if compilation failed"""
+        try:
+            # compile_targets() appends its temp path to search_paths
+            read_sets = compile_targets(
+                inventory_path,
+                list(search_paths),
+                output_path,
+                parallel,
+                names,
+                [],
+                ref_controller,
+                pool=pool,
+                watch=True,
+                **kwargs,
+            )
+        except (KapitanError, SystemExit):
+            logger.error("Compile failed, waiting for changes")
+            return None
+        if read_sets is None:
+            # --cache found nothing to compile, use the read-sets saved by the last compilation
+            read_sets = saved_read_sets(compile_path)
+        return read_sets
+
+    try:
+        roots = watched_paths(inventory_path, search_paths, None, ())
+        snapshot = paths_snapshot(roots, excluded_paths)
+        inventory_hashes = {}
+        try:
+            inventory_hashes = target_inventory_hashes(inventory_path)
+        except KapitanError as e:
+            logger.error(e)
+
+        read_sets = compile_selected(selected_targets)
+        # targets to compile on the next change, whatever it is
+        failed_targets = set()
+        if read_sets is None:
+            read_sets = {}
+            failed_targets = set(selected_targets or inventory_hashes)
+        logger.info("Watching for changes, press Ctrl+C to stop")
+
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            new_roots = watched_paths(inventory_path, search_paths, read_sets, failed_targets)
+            new_snapshot = paths_snapshot(new_roots, excluded_paths)
+            changed_paths = snapshot_changes(snapshot, new_snapshot, roots, new_roots)
+            snapshot, roots = new_snapshot, new_roots
+            if not changed_paths:
+                continue
+            logger.debug("Changed paths: %s", sorted(changed_paths))
+
+            changed_inventories = set()
+            inventory_dir = normalise_read_path(inventory_path)
+            if any(
+                path == inventory_dir or path.startswith(inventory_dir + os.sep) for path in changed_paths
+            ):
+                cached.reset_inv()
+                try:
+                    new_inventory_hashes = target_inventory_hashes(inventory_path)
+                except KapitanError as e:
+                    logger.error(e)
+                    logger.error("Inventory failed to render, waiting for changes")
+                    continue
+                changed_inventories = {
+                    target
+                    for target in inventory_hashes.keys() | new_inventory_hashes.keys()
+                    if inventory_hashes.get(target) != new_inventory_hashes.get(target)
+                }
+                inventory_hashes = new_inventory_hashes
+
+            names = affected_targets(read_sets, changed_paths, changed_inventories) | failed_targets
+            names = sorted(name for name in names if name in inventory_hashes)
+            if selected_targets:
+                names = [name for name in names if name in selected_targets]
+            if not names:
+                logger.debug("No targets affected by changes")
+                continue
+
+            logger.info("Recompiling %s", ", ".join(names))
+            start = time.time()
+            new_read_sets = compile_selected(names)
+            if new_read_sets is None:
+                failed_targets.update(names)
+                continue
+            read_sets.update(new_read_sets)
+            failed_targets.difference_update(names)
+            logger.info("Recompiled %d targets (%.2fs)", len(names), time.time() - start)
+
+    except KeyboardInterrupt:
+        logger.info("Stopped watching")
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def watched_paths(inventory_path, search_paths, read_sets, failed_targets):
+    """
+    returns the paths to watch: inventory_path and the paths in read_sets,
+    or every search path until all targets compiled with a read-set
+    """
+    if read_sets is None or failed_targets or any(read_set is None for read_set in read_sets.values()):
+        return [inventory_path] + list(search_paths)
+    paths = {path for read_set in read_sets.values() for path in read_set["paths"]}
+    return [inventory_path] + sorted(paths)
+
+
+def in_paths(path, paths):
+    """returns True if the absolute path is one of the absolute paths in the set paths, or in one of them"""
+    while True:
+        if path in paths:
+            return True
+        parent = os.path.dirname(path)
+        if parent == path:
+            return False
+        path = parent
+
+
+def paths_snapshot(paths, excluded_paths):
+    """
+    returns a dict with the (mtime, size) of every file in paths, files or directories,
+    keyed like read-set paths. hidden directories and excluded_paths are skipped
+    """
+    excluded_paths = {os.path.abspath(path) for path in excluded_paths}
+    roots = sorted({os.path.abspath(path) for path in paths})
+    snapshot = {}
+    walked_roots = set()
+    for root in roots:
+        # skip paths already walked as part of another path
+        if in_paths(root, walked_roots) or in_paths(root, excluded_paths):
+            continue
+        walked_roots.add(root)
+        if not os.path.isdir(root):
+            try:
+                stat = os.stat(root)
+            except FileNotFoundError:
+                continue
+            snapshot[normalise_read_path(root)] = (stat.st_mtime_ns, stat.st_size)
+            continue
+        for dir_path, dir_names, file_names in os.walk(root):
+            dir_names[:] = [
+                name
+                for name in dir_names
+                if not name.startswith(".") and os.path.join(dir_path, name) not in excluded_paths
+            ]
+            for name in file_names:
+                file_path = os.path.join(dir_path, name)
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                snapshot[normalise_read_path(file_path)] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+def snapshot_changes(snapshot, new_snapshot, roots, new_roots):
+    """
+    returns the paths that changed between snapshot of the paths roots and new_snapshot of new_roots.
+    Paths watched in only one of them, as read-sets changed, are left out
+    """
+    roots = {os.path.abspath(path) for path in roots}
+    new_roots = {os.path.abspath(path) for path in new_roots}
+    changed_paths = set()
+    for path in snapshot.keys() | new_snapshot.keys():
+        if snapshot.get(path) == new_snapshot.get(path):
+            continue
+        abs_path = os.path.abspath(path)
+        if in_paths(abs_path, roots) and in_paths(abs_path, new_roots):
+            changed_paths.add(path)
+    return changed_paths
+
+
+def target_inventory_hashes(inventory_path):
+    """returns a dict with a hash of the classes and parameters of every target in the inventory"""
+    inv = get_inventory(inventory_path)
+    return {
+        target: dictionary_hash({"classes": node["classes"], "parameters": node["parameters"]})
+        for target, node in inv["nodes"].items()
+    }
+
+
+def affected_targets(read_sets, changed_paths, changed_inventories):
+    """
+    returns the set of targets in read_sets that read a path in changed_paths,
+    or the inventory of a target in changed_inventories
+    """
+    affected = set(changed_inventories)
+    for target, read_set in read_sets.items():
+        # targets without a read-set may depend on any path
+        if read_set is None:
+            affected.add(target)
+            continue
+        if changed_inventories.intersection(read_set["targets"]):
+            affected.add(target)
+            continue
+        for path in read_set["paths"]:
+            if path in changed_paths or any(
+                changed_path.startswith(path + os.sep) for changed_path in changed_paths
+            ):
+                affected.add(target)
+                break
+    return affected
+
+
+def saved_read_sets(compile_path):
+    """returns the read-sets saved in .kapitan_cache in compile_path"""
+    try:
+        with open(os.path.join(compile_path, ".kapitan_cache")) as f:
+            return (yaml.safe_load(f) or {}).get("read_set") or {}
+    except OSError:
+        return {}
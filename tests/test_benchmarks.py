@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 The Kapitan Authors
+# SPDX-FileCopyrightText: 2020 The Kapitan Authors <kapitan-admins@googlegroups.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"benchmarks tests"
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import yaml
+
+from benchmarks.inventory_generator import generate_project, parameter_tree
+from benchmarks.micro_benchmark import kubernetes_manifests, measure
+from benchmarks.reclass_parallel import run as reclass_parallel
+from benchmarks.worker_startup import run as worker_startup
+from kapitan.cached import reset_cache
+from kapitan.cli import main
+
+
+class InventoryGeneratorTest(unittest.TestCase):
+    def setUp(self):
+        reset_cache()
+        self.argv = sys.argv
+        self.cwd = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp()
+        os.chdir(self.temp_dir)
+
+    def test_parameter_tree(self):
+        def leaves(tree):
+            return sum(leaves(value) if isinstance(value, dict) else 1 for value in tree.values())
+
+        self.assertEqual(leaves(parameter_tree(5)), 5)
+        self.assertEqual(leaves(parameter_tree(123)), 123)
+
+    def test_compile(self):
+        generate_project(".", targets=2, classes=2, depth=2, parameters=20)
+        sys.argv = ["kapitan", "compile", "--ignore-version-check"]
+        main()
+        for target in ("target0", "target1"):
+            with open(os.path.join("compiled", target, "kadet", "chain1.yaml")) as fp:
+                chain = yaml.safe_load(fp)
+            # level is overridden by the class deepest in the chain
+            self.assertEqual(chain["level"], 1)
+            self.assertEqual(sorted(chain), ["level", "level0", "level1"])
+            self.assertEqual(
+                sorted(os.listdir(os.path.join("compiled", target))), ["copy", "docs", "jsonnet", "kadet"]
+            )
+
+    def tearDown(self):
+        sys.argv = self.argv
+        os.chdir(self.cwd)
+        shutil.rmtree(self.temp_dir)
+        reset_cache()
+
+
+class MicroBenchmarkTest(unittest.TestCase):
+    def test_measure(self):
+        manifests = kubernetes_manifests(10)
+        result = measure(lambda obj: [dict(manifest) for manifest in obj], lambda: (manifests,), min_time=0)
+        self.assertEqual(result["runs"], 1)
+        # the result holds the 10 copied manifests
+        self.assertGreaterEqual(result["allocated_blocks"], 10)
+        self.assertGreater(result["peak_bytes"], 0)
+
+
+class WorkerStartupTest(unittest.TestCase):
+    def test_run(self):
+        result = worker_startup("forkserver", processes=2, pools=2)
+        self.assertEqual(result["processes"], 2)
+        self.assertGreater(result["first_pool"], 0)
+        # the second pool is forked by the running forkserver
+        self.assertLess(result["next_pools"], result["first_pool"])
+
+
+class ReclassParallelTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        generate_project(self.temp_dir, targets=20, classes=2, depth=2, parameters=10)
+
+    def test_run(self):
+        result = reclass_parallel(os.path.join(self.temp_dir, "inventory"), processes=[2])
+        self.assertEqual(result["nodes"], 20)
+        self.assertGreater(result["serial"], 0)
+        self.assertGreater(result["parallel"][2], 0)
+
+    def test_run_queries(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            generate_project(temp_dir, targets=20, classes=2, depth=2, parameters=10, queries=True)
+            result = reclass_parallel(os.path.join(temp_dir, "inventory"), processes=[2])
+        finally:
+            shutil.rmtree(temp_dir)
+        self.assertEqual(result["nodes"], 20)
+        self.assertGreater(result["parallel"][2], 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
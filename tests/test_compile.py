@@ -10,20 +10,46 @@
 import contextlib
 import glob
 import io
+import json
 import os
+import pstats
 import shutil
 import sys
+import tempfile
+import threading
+import time
 import unittest
+from multiprocessing.pool import ThreadPool
+from unittest import mock
 
 import toml
 import yaml
 
+from kapitan import cached
 from kapitan.cached import reset_cache
 from kapitan.cli import main
-from kapitan.errors import InventoryError
-from kapitan.resources import get_inventory
-from kapitan.targets import validate_matching_target_name
-from kapitan.utils import directory_hash
+from kapitan.errors import CompileError, InventoryError
+from kapitan.inputs.base import CompiledFile, OutputWriter
+from kapitan.inventory.reclass import ReclassBackend
+from kapitan.inventory.store import NodeStore, RenderedNodes
+from kapitan.resources import get_inventory, inventory, inventory_dict
+from kapitan.targets import (
+    changed_targets,
+    compile_obj_dependencies,
+    critical_paths,
+    failure_report,
+    generate_inv_cache_hashes,
+    load_globals,
+    order_by_duration,
+    pool_size,
+    save_globals,
+    schedule_compile,
+    shard_targets,
+    validate_matching_target_name,
+    worker_memory_report,
+    worker_pool,
+)
+from kapitan.utils import directory_hash, file_sha256
 
 
 class CompileTestResourcesTestObjs(unittest.TestCase):
@@ -234,6 +260,659 @@ class CompileTerraformTest(unittest.TestCase):
         reset_cache()
 
 
+class CompileAtomicOutputTest(unittest.TestCase):
+    def setUp(self):
+        os.chdir(os.getcwd() + "/examples/terraform/")
+
+    def test_compile(self):
+        sys.argv = ["kapitan", "compile", "--atomic-output"]
+        main()
+        compiled_dir_hash = directory_hash(os.getcwd() + "/compiled")
+        test_compiled_dir_hash = directory_hash(os.getcwd() + "/../../tests/test_terraform_compiled")
+        self.assertEqual(compiled_dir_hash, test_compiled_dir_hash)
+        # staging directories are removed once targets are moved in place
+        self.assertEqual(glob.glob(".*.kapitan"), [])
+
+    def test_compile_specific_target(self):
+        sys.argv = ["kapitan", "compile", "--atomic-output", "-t", "project1"]
+        main()
+        compiled_dir_hash = directory_hash(os.getcwd() + "/compiled")
+        test_compiled_dir_hash = directory_hash(os.getcwd() + "/../../tests/test_terraform_compiled")
+        self.assertEqual(compiled_dir_hash, test_compiled_dir_hash)
+        self.assertEqual(glob.glob(".*.kapitan"), [])
+
+    def tearDown(self):
+        os.chdir(os.getcwd() + "/../../")
+        reset_cache()
+
+
+class CompileUnchangedOutputTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp()
+        shutil.copytree("examples/terraform", os.path.join(self.temp_dir, "terraform"))
+        os.chdir(os.path.join(self.temp_dir, "terraform"))
+        self.unchanged_file = "compiled/project1/terraform/provider.tf.json"
+        self.changed_file = "compiled/project1/terraform/dns.tf.json"
+
+    def compile_and_check(self, argv):
+        # mark the previous output so rewritten files can be told apart
+        os.utime(self.unchanged_file, (0, 0))
+        unchanged_inode = os.stat(self.unchanged_file).st_ino
+        with open(self.changed_file, "a") as fp:
+            fp.write("\n")
+        sys.argv = argv
+        main()
+        compiled_dir_hash = directory_hash("compiled")
+        test_compiled_dir_hash = directory_hash(os.path.join(self.cwd, "tests/test_terraform_compiled"))
+        self.assertEqual(compiled_dir_hash, test_compiled_dir_hash)
+        self.assertEqual(os.stat(self.unchanged_file).st_mtime, 0)
+        self.assertEqual(os.stat(self.unchanged_file).st_ino, unchanged_inode)
+        self.assertNotEqual(os.stat(self.changed_file).st_mtime, 0)
+
+    def test_compile(self):
+        self.compile_and_check(["kapitan", "compile"])
+
+    def test_compile_specific_target(self):
+        self.compile_and_check(["kapitan", "compile", "-t", "project1"])
+
+    def test_compile_atomic_output(self):
+        self.compile_and_check(["kapitan", "compile", "--atomic-output", "-t", "project1"])
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.temp_dir)
+        reset_cache()
+
+
+class CompileReadSetCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp()
+        shutil.copytree("examples/terraform", os.path.join(self.temp_dir, "terraform"))
+        os.chdir(os.path.join(self.temp_dir, "terraform"))
+        sys.argv = ["kapitan", "compile", "--cache"]
+        main()
+
+    def changed_targets(self):
+        reset_cache()
+        generate_inv_cache_hashes("inventory", [], [])
+        return changed_targets("inventory", ".")
+
+    def test_unchanged(self):
+        self.assertEqual(self.changed_targets(), [])
+
+    def test_file_not_read(self):
+        with open("templates/terraform/unused.jsonnet", "w") as fp:
+            fp.write("{}")
+        self.assertEqual(self.changed_targets(), [])
+
+    def test_file_read(self):
+        # kms.jsonnet is only imported by project2
+        with open("templates/terraform/kms.jsonnet", "a") as fp:
+            fp.write("\n")
+        self.assertEqual(self.changed_targets(), ["project2"])
+
+    def test_saved_durations(self):
+        with open("compiled/.kapitan_cache") as fp:
+            durations = yaml.safe_load(fp)["durations"]
+        self.assertEqual(sorted(durations), ["project1", "project2", "project3"])
+        self.assertEqual(sorted(durations["project2"]["inputs"]), [0, 1])
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.temp_dir)
+        reset_cache()
+
+
+class CompileSchedulingTest(unittest.TestCase):
+    def test_order_by_duration(self):
+        target_objs = [{"vars": {"target": name}} for name in ("short", "new", "long")]
+        durations = {"short": {"total": 1.0}, "long": {"total": 5.0}}
+        ordered = order_by_duration(target_objs, durations)
+        self.assertEqual([obj["vars"]["target"] for obj in ordered], ["long", "new", "short"])
+
+    def test_pool_size(self):
+        self.assertEqual(pool_size(8, 3), 3)
+        self.assertEqual(pool_size(8, 0), 1)
+        # a target as long as all the others together only needs 2 processes
+        self.assertEqual(pool_size(8, 4, [3.0, 1.0, 1.0, 1.0]), 2)
+        # targets without a saved duration are estimated with the mean
+        self.assertEqual(pool_size(8, 8, [1.0, 1.0]), 8)
+
+    def test_critical_paths(self):
+        # 0 -> 2, 1 -> 2
+        dependencies = [set(), set(), {0, 1}]
+        duration = {"total": 6.0, "inputs": {0: 1.0, 1: 3.0, 2: 2.0}}
+        self.assertEqual(critical_paths(dependencies, duration), [3.0, 5.0, 2.0])
+        self.assertEqual(critical_paths(dependencies, {"total": 6.0}), [4.0, 4.0, 2.0])
+        self.assertEqual(critical_paths(dependencies), [0, 0, 0])
+
+
+class CompileShardTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp()
+        shutil.copytree("examples/terraform", os.path.join(self.temp_dir, "terraform"))
+        os.chdir(os.path.join(self.temp_dir, "terraform"))
+
+    def test_shard_targets(self):
+        targets = ["target{}".format(index) for index in range(10)]
+        shards = [shard_targets(targets, index, 3) for index in (1, 2, 3)]
+        self.assertEqual(sorted(sum(shards, [])), sorted(targets))
+        self.assertEqual([len(shard) for shard in shards], [4, 3, 3])
+        # shards don't depend on the order of the targets
+        self.assertEqual(shard_targets(list(reversed(targets)), 2, 3), shards[1])
+        with self.assertRaises(CompileError):
+            shard_targets(targets, 4, 3)
+
+    def test_shard_targets_by_duration(self):
+        durations = {"long": {"total": 10.0}, "a": {"total": 4.0}, "b": {"total": 4.0}}
+        targets = ["long", "a", "b", "new"]
+        # new is estimated with the mean duration, 6s, so both shards take 14s
+        self.assertEqual(shard_targets(targets, 1, 2, durations), ["b", "long"])
+        self.assertEqual(shard_targets(targets, 2, 2, durations), ["a", "new"])
+
+    def test_compile_merge(self):
+        sys.argv = ["kapitan", "compile", "--cache", "--output-path", "full"]
+        main()
+        for index in (1, 2):
+            reset_cache()
+            sys.argv = ["kapitan", "compile", "--cache", "--output-path", "shard{}".format(index)]
+            sys.argv += ["--shard", "{}/2".format(index)]
+            main()
+        with open("shard1/compiled/.kapitan_shard") as fp:
+            self.assertEqual(yaml.safe_load(fp)["targets"], {"project1": "project1", "project3": "project3"})
+        self.assertEqual(
+            sorted(os.listdir("shard2/compiled")), [".kapitan_cache", ".kapitan_shard", "project2"]
+        )
+
+        sys.argv = ["kapitan", "merge", "shard1", "shard2", "--output-path", "merged"]
+        main()
+        self.assertEqual(sorted(os.listdir("merged/compiled")), sorted(os.listdir("full/compiled")))
+        for target in ("project1", "project2", "project3"):
+            self.assertEqual(
+                directory_hash(os.path.join("merged/compiled", target)),
+                directory_hash(os.path.join("full/compiled", target)),
+            )
+        with open("merged/compiled/.kapitan_cache") as fp:
+            merged_cache = yaml.safe_load(fp)
+        with open("full/compiled/.kapitan_cache") as fp:
+            full_cache = yaml.safe_load(fp)
+        for key in ("inventory", "folder", "read_set"):
+            self.assertEqual(merged_cache[key], full_cache[key])
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.temp_dir)
+        reset_cache()
+
+
+class CompileKeepGoingTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp()
+        shutil.copytree("examples/terraform", os.path.join(self.temp_dir, "terraform"))
+        os.chdir(os.path.join(self.temp_dir, "terraform"))
+        # a target whose input is missing
+        broken_target = {
+            "parameters": {
+                "kapitan": {
+                    "vars": {"target": "broken"},
+                    "compile": [
+                        {"input_type": "jsonnet", "input_paths": ["missing.jsonnet"], "output_path": "."}
+                    ],
+                }
+            }
+        }
+        with open("inventory/targets/broken.yml", "w") as fp:
+            yaml.safe_dump(broken_target, fp)
+
+    def test_compile(self):
+        for extra_args in ([], ["--parallel-inputs"]):
+            with self.subTest(extra_args=extra_args):
+                shutil.rmtree("compiled", ignore_errors=True)
+                sys.argv = ["kapitan", "compile", "--cache", "--keep-going"] + extra_args
+                with self.assertRaises(SystemExit) as cm:
+                    main()
+                self.assertEqual(cm.exception.code, 1)
+                reset_cache()
+                # the other targets are compiled and cached, the failed one is compiled again next time
+                self.assertEqual(
+                    sorted(os.listdir("compiled")), [".kapitan_cache", "project1", "project2", "project3"]
+                )
+                with open("compiled/.kapitan_cache") as fp:
+                    inv_cache = yaml.safe_load(fp)
+                self.assertEqual(sorted(inv_cache["inventory"]), ["project1", "project2", "project3"])
+
+    def test_failure_report(self):
+        failures = {
+            "b": {"error": "Compile error: b failed", "duration": 1.5},
+            "a": {"error": "one\ntwo", "duration": 0},
+        }
+        self.assertEqual(
+            failure_report(failures, 5),
+            "Failed to compile 2 of 5 targets:\n\na (0.00s):\n    one\n    two\n\nb (1.50s):\n    Compile error: b failed",
+        )
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.temp_dir)
+        reset_cache()
+
+
+class CompileWorkerPoolTest(unittest.TestCase):
+    def test_worker_pool(self):
+        for kwargs in ({"max_targets": 1}, {"max_memory": 1}):
+            with self.subTest(**kwargs):
+                pool = worker_pool(2, **kwargs)
+                try:
+                    pids = [pool.apply(os.getpid) for _ in range(4)]
+                finally:
+                    pool.terminate()
+                    pool.join()
+                # every worker is replaced after one task
+                self.assertEqual(len(set(pids)), 4)
+
+    def test_worker_pool_without_rss(self):
+        with mock.patch("kapitan.targets.current_rss", return_value=None):
+            pool = worker_pool(2, max_memory=1)
+        try:
+            pids = [pool.apply(os.getpid) for _ in range(4)]
+        finally:
+            pool.terminate()
+            pool.join()
+        # --worker-max-memory is ignored where the resident memory can't be read
+        self.assertLessEqual(len(set(pids)), 2)
+
+    def test_worker_memory_report(self):
+        results = [
+            {"workers": [(100, 2**20)]},
+            {"workers": [(200, 3 * 2**20), (100, 2 * 2**20)]},
+        ]
+        self.assertEqual(
+            worker_memory_report(results),
+            "Worker peak memory:\n    worker 200: 1 tasks, 3.0 MiB\n    worker 100: 2 tasks, 2.0 MiB",
+        )
+
+    def test_compile(self):
+        cwd = os.getcwd()
+        temp_dir = tempfile.mkdtemp()
+        os.chdir(os.path.join(cwd, "tests", "test_resources"))
+        try:
+            sys.argv = ["kapitan", "compile", "--output-path", temp_dir, "--worker-max-targets", "1"]
+            sys.argv += ["-t", "kadet-test", "test-objects", "external-test"]
+            with self.assertLogs("kapitan.targets", "INFO") as logs:
+                main()
+            report = [line for line in logs.output if "Worker peak memory" in line]
+            self.assertEqual(len(report), 1)
+            self.assertEqual(report[0].count(" 1 tasks, "), 3)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(temp_dir)
+            reset_cache()
+
+    def test_forkserver(self):
+        cwd = os.getcwd()
+        temp_dir = tempfile.mkdtemp()
+        os.chdir(os.path.join(cwd, "tests", "test_resources"))
+        try:
+            targets = ["kadet-test", "test-objects", "external-test"]
+            sys.argv = ["kapitan", "compile", "--output-path", temp_dir + "/spawn", "-t"] + targets
+            main()
+            sys.argv = ["kapitan", "compile", "--output-path", temp_dir + "/forkserver", "-t"] + targets
+            sys.argv += ["--worker-start-method", "forkserver"]
+            main()
+            self.assertEqual(
+                directory_hash(temp_dir + "/spawn/compiled"),
+                directory_hash(temp_dir + "/forkserver/compiled"),
+            )
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(temp_dir)
+            reset_cache()
+
+
+class CompileAsyncOutputTest(unittest.TestCase):
+    def setUp(self):
+        os.chdir(os.getcwd() + "/tests/test_resources/")
+        self.temp_dir = tempfile.mkdtemp()
+
+    def test_compile(self):
+        targets = ["kadet-test", "external-test", "test-objects", "jinja2-input-params"]
+        sys.argv = ["kapitan", "compile", "--output-path", self.temp_dir + "/sync", "-t"] + targets
+        main()
+        sys.argv = ["kapitan", "compile", "--output-path", self.temp_dir + "/async", "--async-output"]
+        sys.argv += ["-t"] + targets
+        main()
+        self.assertEqual(
+            directory_hash(self.temp_dir + "/sync/compiled"),
+            directory_hash(self.temp_dir + "/async/compiled"),
+        )
+
+    def test_output_writer(self):
+        writer = OutputWriter(max_bytes=10)
+        for index in range(5):
+            name = os.path.join(self.temp_dir, "file{}".format(index))
+            writer.write(CompiledFile(name, None), b"content-" + str(index).encode())
+            # two files are more than max_bytes, so each waits for the previous one
+            self.assertLessEqual(writer.pending, 1)
+        writer.flush()
+        self.assertEqual(writer.pending_bytes, 0)
+        with open(os.path.join(self.temp_dir, "file4")) as fp:
+            self.assertEqual(fp.read(), "content-4")
+
+        # errors are raised by flush()
+        writer.write(CompiledFile(os.path.join(self.temp_dir, "missing", "file"), None), b"content")
+        with self.assertRaises(FileNotFoundError):
+            writer.flush()
+        writer.flush()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        os.chdir(os.getcwd() + "/../../")
+        reset_cache()
+
+
+class CompileFetchDependenciesTest(unittest.TestCase):
+    def test_schedule_compile(self):
+        events = []
+        compiled_unaffected = threading.Event()
+
+        def fetch(dep_mapping):
+            # targets that don't read the dependency compile while it is fetched
+            compiled_unaffected.wait(10)
+            events.append("fetched " + dep_mapping[0])
+
+        def worker(target_obj):
+            target_name = target_obj["vars"]["target"]
+            events.append("compiled " + target_name)
+            if target_name == "unaffected":
+                compiled_unaffected.set()
+            return {
+                "target": target_name,
+                "read_set": None,
+                "duration": 0,
+                "input_durations": {},
+                "files": None,
+                "trace": [],
+            }
+
+        def target_obj(name, input_path, dependencies=()):
+            compile_obj = {"input_type": "jsonnet", "input_paths": [input_path], "output_path": "."}
+            return {"vars": {"target": name}, "compile": [compile_obj], "dependencies": list(dependencies)}
+
+        target_objs = [
+            target_obj("declares", "components/a.jsonnet", [{"output_path": "vendor/chart"}]),
+            target_obj("reads", "vendor/chart/main.jsonnet"),
+            target_obj("unaffected", "components/b.jsonnet"),
+        ]
+        fetches = [(fetch, ("chart", [{"output_path": "vendor/chart"}]))]
+        with ThreadPool(2) as pool:
+            results = schedule_compile(
+                pool, worker, target_objs, fetches=fetches, search_paths=["."], fetch_overlap=True
+            )
+        self.assertEqual(sorted(results), ["declares", "reads", "unaffected"])
+        self.assertEqual(events[:2], ["compiled unaffected", "fetched chart"])
+        self.assertEqual(sorted(events[2:]), ["compiled declares", "compiled reads"])
+
+    def test_schedule_compile_after_fetches(self):
+        temp_dir = tempfile.mkdtemp()
+        fetched_path = os.path.join(temp_dir, "vendor", "lib", "x.libsonnet")
+
+        def fetch(dep_mapping):
+            # the target would read the fetched file before it is written if it didn't wait
+            time.sleep(0.2)
+            os.makedirs(os.path.dirname(fetched_path))
+            with open(fetched_path, "w") as fp:
+                fp.write("{}")
+
+        def worker(target_obj):
+            # the input imports the fetched file through the working directory, e.g.
+            # import "vendor/lib/x.libsonnet", without declaring the dependency
+            with open(fetched_path) as fp:
+                fp.read()
+            return {
+                "target": target_obj["vars"]["target"],
+                "read_set": None,
+                "duration": 0,
+                "input_durations": {},
+                "files": None,
+                "trace": [],
+            }
+
+        compile_obj = {"input_type": "jsonnet", "input_paths": ["components/a.jsonnet"], "output_path": "."}
+        target_objs = [{"vars": {"target": "imports"}, "compile": [compile_obj], "dependencies": []}]
+        fetches = [(fetch, ("lib", [{"output_path": os.path.join(temp_dir, "vendor", "lib")}]))]
+        try:
+            with ThreadPool(2) as pool:
+                results = schedule_compile(pool, worker, target_objs, fetches=fetches, search_paths=["."])
+        finally:
+            shutil.rmtree(temp_dir)
+        self.assertEqual(list(results), ["imports"])
+
+
+class CompileParallelInputsTest(unittest.TestCase):
+    def setUp(self):
+        os.chdir(os.getcwd() + "/tests/test_resources/")
+        self.temp_dir = tempfile.mkdtemp()
+
+    def test_compile(self):
+        targets = ["kadet-test", "external-test", "test-objects"]
+        sys.argv = ["kapitan", "compile", "--output-path", self.temp_dir + "/serial", "-t"] + targets
+        main()
+        reset_cache()
+        sys.argv = ["kapitan", "compile", "--output-path", self.temp_dir + "/parallel", "--parallel-inputs"]
+        sys.argv += ["-t"] + targets
+        main()
+        self.assertEqual(
+            directory_hash(self.temp_dir + "/serial/compiled"),
+            directory_hash(self.temp_dir + "/parallel/compiled"),
+        )
+
+    def test_dependencies(self):
+        compile_objs = [
+            {"input_type": "jsonnet", "input_paths": ["a.jsonnet"], "output_path": "a"},
+            {"input_type": "helm", "input_paths": ["charts/b"], "output_path": "b"},
+            {"input_type": "kadet", "input_paths": ["kadet/a"], "output_path": "a/extra"},
+            {"input_type": "copy", "input_paths": ["compiled/target/b"], "output_path": "c"},
+            {"input_type": "jinja2", "input_paths": ["docs"], "output_path": "docs"},
+            {"input_type": "external", "input_paths": ["script.sh"], "output_path": "."},
+            {"input_type": "jsonnet", "input_paths": ["d.jsonnet"], "output_path": "d"},
+        ]
+        self.assertEqual(
+            compile_obj_dependencies(compile_objs),
+            [set(), set(), {0}, {0, 1, 2}, {3}, {0, 1, 2, 3, 4}, {3, 5}],
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        os.chdir(os.getcwd() + "/../../")
+        reset_cache()
+
+
+class CountingReclassBackend(ReclassBackend):
+    """reclass backend recording the targets it renders"""
+
+    def __init__(self, inventory_path):
+        super().__init__(inventory_path, False)
+        self.rendered = []
+
+    def render_target(self, target_name):
+        self.rendered.append(target_name)
+        return super().render_target(target_name)
+
+
+class CompileStreamInventoryTest(unittest.TestCase):
+    def setUp(self):
+        os.chdir(os.getcwd() + "/tests/test_resources/")
+        self.temp_dir = tempfile.mkdtemp()
+
+    def test_compile(self):
+        targets = ["kadet-test", "external-test", "test-objects"]
+        sys.argv = ["kapitan", "compile", "--output-path", self.temp_dir + "/inventory", "-t"] + targets
+        main()
+        reset_cache()
+        sys.argv = ["kapitan", "compile", "--output-path", self.temp_dir + "/stream", "--stream-inventory"]
+        sys.argv += ["-t"] + targets
+        main()
+        self.assertEqual(
+            directory_hash(self.temp_dir + "/inventory/compiled"),
+            directory_hash(self.temp_dir + "/stream/compiled"),
+        )
+
+    def test_rendered_nodes(self):
+        inv = get_inventory("inventory")
+        backend = ReclassBackend("inventory", False)
+        nodes = RenderedNodes(backend, backend.target_names())
+        self.assertEqual(sorted(nodes), sorted(inv["nodes"]))
+        self.assertEqual(nodes.nodes, {})
+        self.assertEqual(nodes["test-objects"]["parameters"], inv["nodes"]["test-objects"]["parameters"])
+        self.assertEqual(list(nodes.nodes), ["test-objects"])
+        self.assertIsNone(nodes.get("missing-target"))
+
+    def test_inventory_global_renders(self):
+        backend = CountingReclassBackend("inventory")
+        target_names = backend.target_names()
+        cached.inv = {"nodes": RenderedNodes(backend, target_names)}
+        globals_path = save_globals(self.temp_dir, ref_controller=None)
+        reset_cache()
+        # each target compiled by a worker reads the inventory of all targets, as inventory_global does
+        for _ in range(3):
+            load_globals(globals_path)
+            inventory_dict([], None, "inventory")
+        self.assertEqual(sorted(cached.inv["nodes"].backend.rendered), sorted(target_names))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        os.chdir(os.getcwd() + "/../../")
+        reset_cache()
+
+
+class CompileProfileOutTest(unittest.TestCase):
+    def setUp(self):
+        os.chdir(os.getcwd() + "/tests/test_resources/")
+        self.temp_dir = tempfile.mkdtemp()
+
+    def test_compile(self):
+        trace_path = os.path.join(self.temp_dir, "trace.json")
+        sys.argv = ["kapitan", "compile", "-t", "test-objects", "--profile-out", trace_path]
+        main()
+        with open(trace_path) as fp:
+            events = json.load(fp)["traceEvents"]
+        spans = [event for event in events if event["ph"] == "X"]
+        self.assertEqual(
+            {event["cat"] for event in spans},
+            {"inventory", "compile", "target", "input", "refs", "serialize", "output"},
+        )
+        target_span = [event for event in spans if event["cat"] == "target"][0]
+        self.assertEqual(target_span["name"], "test-objects")
+        # the target is compiled by a worker process
+        self.assertNotEqual(target_span["pid"], os.getpid())
+
+    def test_profile_targets(self):
+        sys.argv = ["kapitan", "compile", "--output-path", self.temp_dir, "-t", "test-objects", "kadet-test"]
+        sys.argv += ["--profile-targets", "kadet-test", "--profile-memory"]
+        main()
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.temp_dir, "profiles"))),
+            ["kadet-test.allocations.txt", "kadet-test.pstats"],
+        )
+        stats = pstats.Stats(os.path.join(self.temp_dir, "profiles", "kadet-test.pstats"))
+        self.assertTrue(any(func[2] == "compile_obj" for func in stats.stats))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        os.chdir(os.getcwd() + "/../../")
+        reset_cache()
+
+
+class CompileManifestTest(unittest.TestCase):
+    def setUp(self):
+        os.chdir(os.getcwd() + "/tests/test_resources/")
+        self.temp_dir = tempfile.mkdtemp()
+
+    def compile(self, output_path, *args):
+        reset_cache()
+        sys.argv = ["kapitan", "compile", "--manifest", "--output-path", output_path] + list(args)
+        main()
+        with open(os.path.join(output_path, "compiled", ".kapitan_manifest.json")) as fp:
+            return json.load(fp)["files"]
+
+    def test_manifest(self):
+        targets = ["test-objects", "kadet-test", "external-test"]
+        files = self.compile(self.temp_dir, "-t", *targets)
+        compile_path = os.path.join(self.temp_dir, "compiled")
+        compiled_files = [
+            os.path.relpath(os.path.join(root, name), compile_path)
+            for target in targets
+            for root, _, names in os.walk(os.path.join(compile_path, target))
+            for name in names
+        ]
+        self.assertEqual(sorted(files), sorted(compiled_files))
+        for path, entry in files.items():
+            self.assertEqual(entry["sha256"], file_sha256(os.path.join(compile_path, path)))
+            self.assertEqual(entry["size"], os.path.getsize(os.path.join(compile_path, path)))
+            self.assertEqual(entry["target"], path.split(os.sep)[0])
+        self.assertEqual(files["external-test/test.md"]["input_type"], "external")
+
+        # the same manifest is written when the inputs are compiled in parallel
+        parallel_files = self.compile(
+            os.path.join(self.temp_dir, "parallel"), "--parallel-inputs", "-t", *targets
+        )
+        self.assertEqual(parallel_files, files)
+
+        # only the files of the compiled targets are replaced
+        self.assertEqual(self.compile(self.temp_dir, "-t", "kadet-test"), files)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        os.chdir(os.getcwd() + "/../../")
+        reset_cache()
+
+
+class CompileGlobalsTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def test_save_load_globals(self):
+        cached.inv = {"nodes": {"target": {"parameters": {"key": "value"}}}}
+        globals_path = save_globals(self.temp_dir, ref_controller="refs")
+        reset_cache()
+        self.assertEqual(load_globals(globals_path), "refs")
+        # nodes are read from the store one at a time
+        self.assertIsInstance(cached.inv["nodes"], NodeStore)
+        self.assertEqual(list(cached.inv["nodes"]), ["target"])
+        self.assertEqual(cached.inv["nodes"]["target"]["parameters"]["key"], "value")
+        self.assertEqual(
+            inventory_dict([], None, self.temp_dir), {"target": {"parameters": {"key": "value"}}}
+        )
+        # loading the same globals again releases the nodes read so far
+        self.assertEqual(load_globals(globals_path), "refs")
+        self.assertEqual(cached.inv["nodes"].nodes, {})
+
+    def test_global_inventory_view(self):
+        cached.inv = {"nodes": {name: {"parameters": {"key": name}} for name in ("a", "b")}}
+        globals_path = save_globals(self.temp_dir, ref_controller="refs")
+        reset_cache()
+        load_globals(globals_path)
+        nodes = cached.inv["nodes"]
+        # jinja2 and kadet read the store itself, which unpickles the nodes they read
+        self.assertIs(inventory([], None, self.temp_dir), nodes)
+        self.assertEqual(nodes["a"]["parameters"]["key"], "a")
+        # jsonnet takes a dict of all nodes, whose nodes the store doesn't keep
+        self.assertEqual(
+            inventory_dict([], None, self.temp_dir),
+            {"a": {"parameters": {"key": "a"}}, "b": {"parameters": {"key": "b"}}},
+        )
+        self.assertEqual(list(nodes.nodes), ["a"])
+        self.assertEqual(inventory_dict([], "b", self.temp_dir), {"parameters": {"key": "b"}})
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        reset_cache()
+
+
 class PlainOutputTest(unittest.TestCase):
     def setUp(self):
         os.chdir(os.getcwd() + "/examples/docker/")
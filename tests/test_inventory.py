@@ -7,8 +7,23 @@
 
 "inventory tests"
 
+import contextlib
+import io
+import multiprocessing
+import os
+import pickle
+import shutil
+import sys
+import tempfile
 import unittest
+from unittest import mock
 
+import reclass.core
+
+from kapitan import cached
+from kapitan.cli import main
+from kapitan.inventory.cache import InventoryCache
+from kapitan.inventory.reclass import ReclassBackend
 from kapitan.resources import inventory
 
 
@@ -20,3 +35,257 @@ class InventoryTargetTest(unittest.TestCase):
     def test_inventory_all_targets(self):
         inv = inventory(["examples/kubernetes"], None)
         self.assertNotEqual(inv.get("minikube-es"), None)
+
+
+class CountingReclassBackend(ReclassBackend):
+    """reclass backend counting the targets it renders"""
+
+    def __init__(self, inventory_path, targets=[]):
+        super().__init__(inventory_path, False, targets)
+        self.rendered = []
+        self.listed = 0
+
+    def inventory(self):
+        inv = super().inventory()
+        if not self.targets:
+            self.rendered.extend(inv["nodes"])
+        return inv
+
+    def target_names(self):
+        self.listed += 1
+        return super().target_names()
+
+    def render_target(self, target_name):
+        self.rendered.append(target_name)
+        return super().render_target(target_name)
+
+
+class ReclassSelectedTargetsTest(unittest.TestCase):
+    def test_selected_targets(self):
+        backend = CountingReclassBackend("examples/kubernetes/inventory", ["minikube-es"])
+        inv = backend.inventory()
+        self.assertEqual(backend.rendered, ["minikube-es"])
+        self.assertIn("minikube-mysql", inv["nodes"])
+
+        expected = ReclassBackend("examples/kubernetes/inventory", False).inventory()["nodes"]
+        for name in ("minikube-es", "minikube-mysql"):
+            self.assertEqual(inv["nodes"][name]["parameters"], expected[name]["parameters"])
+        self.assertEqual(backend.rendered, ["minikube-es", "minikube-mysql"])
+
+    def test_target_names_listed_once(self):
+        backend = CountingReclassBackend("examples/kubernetes/inventory", ["minikube-es"])
+        nodes = backend.inventory()["nodes"]
+        for name in list(nodes):
+            self.assertEqual(nodes[name]["parameters"]["target_name"], name)
+        self.assertGreater(len(backend.rendered), 2)
+        self.assertEqual(backend.listed, 1)
+
+    def test_pickled_nodes(self):
+        backend = CountingReclassBackend("examples/kubernetes/inventory", ["minikube-es"])
+        nodes = pickle.loads(pickle.dumps(backend.inventory()["nodes"]))
+        nodes.release()
+        nodes.backend.rendered.clear()
+        self.assertEqual(nodes["minikube-es"]["parameters"]["target_name"], "minikube-es")
+        self.assertEqual(nodes.backend.rendered, [])
+
+
+class ReclassParallelTest(unittest.TestCase):
+    def test_parallel_inventory(self):
+        inv = ReclassBackend("examples/kubernetes/inventory", False, parallel=True).inventory()
+        expected = ReclassBackend("examples/kubernetes/inventory", False).inventory()
+        self.assertEqual(list(inv["nodes"]), list(expected["nodes"]))
+        for name, node in inv["nodes"].items():
+            self.assertEqual(node["parameters"], expected["nodes"][name]["parameters"])
+        self.assertEqual(inv["classes"], expected["classes"])
+
+    def test_closed_pool(self):
+        # e.g. the pool of a finished compilation
+        pool = multiprocessing.get_context("spawn").Pool(1)
+        pool.close()
+        pool.join()
+        cached.pool = pool
+        try:
+            inv = ReclassBackend("examples/kubernetes/inventory", False, parallel=True).inventory()
+        finally:
+            cached.pool = None
+        self.assertIn("minikube-es", inv["nodes"])
+
+
+def write_query_inventory(inventory_path, num_targets):
+    """writes an inventory of num_targets targets exporting their ip, and reading the ips of all targets"""
+    os.makedirs(os.path.join(inventory_path, "classes"))
+    os.makedirs(os.path.join(inventory_path, "targets"))
+    with open(os.path.join(inventory_path, "classes", "common.yml"), "w") as fp:
+        fp.write("exports:\n  ip: ${ip}\nparameters:\n  ips: $[ exports:ip ]\n")
+    for index in range(num_targets):
+        with open(os.path.join(inventory_path, "targets", "node{}.yml".format(index)), "w") as fp:
+            fp.write("classes:\n  - common\nparameters:\n  ip: 10.0.0.{}\n".format(index))
+
+
+class ReclassInventoryQueriesTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        write_query_inventory(self.temp_dir, 8)
+        self.expected = ReclassBackend(self.temp_dir, False).inventory()["nodes"]
+        self.ips = {"node{}".format(index): "10.0.0.{}".format(index) for index in range(8)}
+
+    def assertSameNodes(self, nodes):
+        self.assertEqual(sorted(nodes), sorted(self.expected))
+        for name, node in nodes.items():
+            self.assertEqual(node["parameters"], self.expected[name]["parameters"])
+            self.assertEqual(node["exports"], self.expected[name]["exports"])
+            self.assertEqual(node["parameters"]["ips"], self.ips)
+
+    def test_parallel_inventory(self):
+        inv = ReclassBackend(self.temp_dir, False, parallel=True).inventory()
+        self.assertSameNodes(inv["nodes"])
+
+    def test_selected_targets(self):
+        get_inventory = reclass.core.Core._get_inventory
+        with mock.patch.object(
+            reclass.core.Core, "_get_inventory", autospec=True, side_effect=get_inventory
+        ) as patched:
+            nodes = ReclassBackend(self.temp_dir, False, ["node0"]).inventory()["nodes"]
+            self.assertSameNodes({name: nodes[name] for name in list(nodes)})
+        # the exports read by inventory queries are rendered once, not for every node
+        self.assertEqual(patched.call_count, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+
+class InventoryCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.inventory_path = os.path.join(self.temp_dir, "inventory")
+        self.cache_path = os.path.join(self.temp_dir, "cache")
+        shutil.copytree("examples/kubernetes/inventory", self.inventory_path)
+
+    def cached_inventory(self):
+        backend = CountingReclassBackend(self.inventory_path)
+        return InventoryCache(backend, self.cache_path).get(), backend.rendered
+
+    def edit(self, path, old, new):
+        path = os.path.join(self.inventory_path, path)
+        with open(path) as fp:
+            content = fp.read()
+        with open(path, "w") as fp:
+            fp.write(content.replace(old, new))
+
+    def assertSameNodes(self, inv):
+        """asserts the nodes of inv are the nodes of the inventory rendered without cache"""
+        expected = ReclassBackend(self.inventory_path, False).inventory()
+        for nodes in (inv["nodes"], expected["nodes"]):
+            for node in nodes.values():
+                del node["__reclass__"]["timestamp"]
+        self.assertEqual(inv["nodes"], expected["nodes"])
+        self.assertEqual(inv["classes"], expected["classes"])
+
+    def test_unchanged(self):
+        inv, rendered = self.cached_inventory()
+        self.assertIn("minikube-es", rendered)
+        cached_inv, rendered = self.cached_inventory()
+        self.assertEqual(rendered, [])
+        self.assertEqual(cached_inv["nodes"], inv["nodes"])
+
+    def test_touched(self):
+        self.cached_inventory()
+        os.utime(os.path.join(self.inventory_path, "classes", "common.yml"))
+        _, rendered = self.cached_inventory()
+        self.assertEqual(rendered, [])
+
+    def test_changed_class(self):
+        self.cached_inventory()
+        self.edit("classes/component/elasticsearch.yml", "5.5.0", "5.6.0")
+        inv, rendered = self.cached_inventory()
+        self.assertEqual(rendered, ["minikube-es"])
+        self.assertSameNodes(inv)
+
+    def test_added_and_removed_targets(self):
+        self.cached_inventory()
+        with open(os.path.join(self.inventory_path, "targets", "new.yml"), "w") as fp:
+            fp.write("classes:\n  - common\n")
+        os.remove(os.path.join(self.inventory_path, "targets", "minikube-es.yml"))
+        inv, rendered = self.cached_inventory()
+        self.assertEqual(rendered, ["new"])
+        self.assertNotIn("minikube-es", inv["nodes"])
+        self.assertSameNodes(inv)
+
+    def test_changed_config(self):
+        inv, _ = self.cached_inventory()
+        with open(os.path.join(self.inventory_path, "reclass-config.yml"), "w") as fp:
+            fp.write("compose_node_name: false\n")
+        _, rendered = self.cached_inventory()
+        self.assertEqual(sorted(rendered), sorted(inv["nodes"]))
+
+    def test_unknown_sources(self):
+        backend = CountingReclassBackend(self.inventory_path)
+        # e.g. a reclass version whose storage keeps the files of nodes differently
+        backend.reclass_call(lambda core: core._storage._real_storage._nodes.clear())
+        self.assertIsNone(backend.node_sources("minikube-es", {"classes": []}))
+
+        with mock.patch.object(CountingReclassBackend, "node_sources", return_value=None):
+            self.cached_inventory()
+            self.edit("classes/component/elasticsearch.yml", "replicas: 1", "replicas: 2")
+            inv, rendered = self.cached_inventory()
+        # the whole inventory is rendered again
+        self.assertEqual(sorted(rendered), sorted(inv["nodes"]))
+        self.assertSameNodes(inv)
+
+    def test_affected_by(self):
+        cache = InventoryCache(ReclassBackend(self.inventory_path, False), self.cache_path)
+        classes_path = os.path.join(self.inventory_path, "classes")
+        self.assertEqual(
+            cache.affected_by([os.path.join(classes_path, "component", "elasticsearch.yml")]), ["minikube-es"]
+        )
+        # included through cluster.minikube
+        affected = cache.affected_by([os.path.join(classes_path, "cluster", "common.yml")])
+        self.assertIn("minikube-mysql", affected)
+        self.assertNotIn("busybox", affected)
+        self.assertEqual(
+            cache.affected_by([os.path.join(classes_path, "component")]),
+            cache.affected_by(
+                [
+                    os.path.join(classes_path, "component", name)
+                    for name in os.listdir(os.path.join(classes_path, "component"))
+                ]
+            ),
+        )
+        all_targets = cache.affected_by([self.inventory_path])
+        self.assertEqual(
+            cache.affected_by([os.path.join(self.inventory_path, "reclass-config.yml")]), all_targets
+        )
+        self.assertEqual(cache.affected_by([self.temp_dir + "/README.md"]), [])
+
+    def test_affected_by_cli(self):
+        def affected_by(*flags):
+            argv = sys.argv
+            sys.argv = [
+                "kapitan",
+                "inventory",
+                "--affected-by",
+                "inventory/classes/component/elasticsearch.yml",
+            ]
+            sys.argv += list(flags)
+            stdout = io.StringIO()
+            try:
+                with contextlib.redirect_stdout(stdout):
+                    main()
+            finally:
+                sys.argv = argv
+                cached.reset_cache()
+            return stdout.getvalue().split()
+
+        cwd = os.getcwd()
+        os.chdir(self.temp_dir)
+        try:
+            self.assertEqual(affected_by(), ["minikube-es"])
+            # the query leaves no cache behind for later runs without --inventory-cache
+            self.assertFalse(os.path.exists(".kapitan_inventory_cache"))
+            self.assertEqual(affected_by("--inventory-cache"), ["minikube-es"])
+            self.assertTrue(os.path.isdir(".kapitan_inventory_cache"))
+        finally:
+            os.chdir(cwd)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
@@ -2,13 +2,17 @@
 
 # Copyright 2023 neXenio
 
+import multiprocessing
 import os
+import shutil
 import tempfile
 import unittest
+from unittest import mock
 
 import yaml
 
-from kapitan.inventory.omegaconf_inv import OmegaConfBackend
+from kapitan import cached
+from kapitan.inventory.omegaconf_inv import MP_MIN_TARGETS, InventoryTarget, OmegaConfBackend
 
 
 class OmegaConfMigrationTest(unittest.TestCase):
@@ -224,3 +228,50 @@ class OmegaConfInventoryTest(unittest.TestCase):
 
         expected = "value 'redundant' is defined redundantly in 'redundant'"
         self.assertEqual(content, expected)
+
+
+def fake_load_target(self, target):
+    """sets the parameters of target to the process rendering it, instead of loading its classes"""
+    target.parameters = {"name": target.name, "pid": os.getpid()}
+
+
+class OmegaConfRenderTest(unittest.TestCase):
+    def setUp(self):
+        self.inventory_path = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.inventory_path, "targets"))
+        os.makedirs(os.path.join(self.inventory_path, "classes"))
+
+    def render(self, num_targets):
+        """returns the nodes of num_targets targets, with a running pool in cached.pool"""
+        for index in range(num_targets):
+            with open(os.path.join(self.inventory_path, "targets", f"target{index}.yml"), "w") as fp:
+                fp.write("parameters: {}\n")
+        with mock.patch.object(OmegaConfBackend, "load_target", fake_load_target):
+            # forked workers keep the mocked load_target
+            cached.pool = multiprocessing.get_context("fork").Pool(2)
+            try:
+                return OmegaConfBackend(self.inventory_path).inventory()["nodes"]
+            finally:
+                cached.pool.terminate()
+                cached.pool.join()
+                cached.pool = None
+
+    def test_in_process(self):
+        nodes = self.render(MP_MIN_TARGETS - 1)
+        self.assertEqual(len(nodes), MP_MIN_TARGETS - 1)
+        self.assertEqual({node["parameters"]["pid"] for node in nodes.values()}, {os.getpid()})
+
+    def test_pool(self):
+        nodes = self.render(MP_MIN_TARGETS)
+        self.assertEqual(len(nodes), MP_MIN_TARGETS)
+        self.assertEqual(nodes["target0"]["parameters"]["name"], "target0")
+        self.assertNotIn(os.getpid(), {node["parameters"]["pid"] for node in nodes.values()})
+
+    def test_worker_failure(self):
+        backend = OmegaConfBackend(self.inventory_path)
+        target = InventoryTarget("broken", os.path.join(self.inventory_path, "targets", "broken.yml"))
+        with mock.patch.object(OmegaConfBackend, "load_target", side_effect=ValueError("broken class")):
+            self.assertEqual(OmegaConfBackend.inventory_worker((backend, target)), ("broken", None))
+
+    def tearDown(self):
+        shutil.rmtree(self.inventory_path)
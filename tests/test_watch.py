@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 The Kapitan Authors
+# SPDX-FileCopyrightText: 2020 The Kapitan Authors <kapitan-admins@googlegroups.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"watch tests"
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from kapitan.watch import (
+    affected_targets,
+    paths_snapshot,
+    snapshot_changes,
+    watch_targets,
+    watched_paths,
+)
+
+
+class WatchAffectedTargetsTest(unittest.TestCase):
+    def setUp(self):
+        self.read_sets = {
+            "target-a": {
+                "paths": {"components/a.jsonnet": "hash", "lib/templates": "hash"},
+                "targets": ["target-a"],
+            },
+            "target-b": {"paths": {"components/b.jsonnet": "hash"}, "targets": ["target-b", "target-a"]},
+            "target-external": None,
+        }
+
+    def test_changed_file(self):
+        affected = affected_targets(self.read_sets, {"components/b.jsonnet"}, set())
+        self.assertEqual(affected, {"target-b", "target-external"})
+
+    def test_changed_file_in_directory(self):
+        affected = affected_targets(self.read_sets, {"lib/templates/new.j2"}, set())
+        self.assertEqual(affected, {"target-a", "target-external"})
+
+    def test_changed_inventory(self):
+        affected = affected_targets(self.read_sets, {"inventory/targets/target-a.yml"}, {"target-a"})
+        self.assertEqual(affected, {"target-a", "target-b", "target-external"})
+
+
+class WatchPathsSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp()
+        os.chdir(self.temp_dir)
+        for path in ("components/a.jsonnet", "compiled/a/a.yml", ".git/HEAD"):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as fp:
+                fp.write("a")
+
+    def test_snapshot(self):
+        snapshot = paths_snapshot([".", "components"], ["compiled"])
+        self.assertEqual(list(snapshot), [os.path.join("components", "a.jsonnet")])
+
+    def test_snapshot_files(self):
+        paths = [os.path.join("components", "a.jsonnet"), os.path.join("components", "missing.jsonnet")]
+        snapshot = paths_snapshot(paths + [os.path.join("compiled", "a", "a.yml")], ["compiled"])
+        self.assertEqual(list(snapshot), [os.path.join("components", "a.jsonnet")])
+
+    def test_snapshot_changes(self):
+        snapshot = {"components/a.jsonnet": (1, 1), "lib/b.libsonnet": (1, 1)}
+        new_snapshot = {"components/a.jsonnet": (2, 1), "components/c.jsonnet": (1, 1)}
+        # lib is not watched anymore, and components/c.jsonnet was not watched before
+        changes = snapshot_changes(snapshot, new_snapshot, ["."], ["components/a.jsonnet"])
+        self.assertEqual(changes, {"components/a.jsonnet"})
+        changes = snapshot_changes(snapshot, new_snapshot, ["."], ["."])
+        self.assertEqual(changes, {"components/a.jsonnet", "components/c.jsonnet", "lib/b.libsonnet"})
+
+    def test_watched_paths(self):
+        read_sets = {"target-a": {"paths": {"components/a.jsonnet": "hash"}, "targets": ["target-a"]}}
+        self.assertEqual(
+            watched_paths("inventory", ["."], read_sets, set()), ["inventory", "components/a.jsonnet"]
+        )
+        # every search path is watched while a target has no read-set
+        self.assertEqual(watched_paths("inventory", ["."], read_sets, {"target-b"}), ["inventory", "."])
+        self.assertEqual(watched_paths("inventory", ["."], {"target-a": None}, set()), ["inventory", "."])
+
+    def test_fetch(self):
+        with self.assertRaises(SystemExit):
+            watch_targets("inventory", ["."], ".", 1, [], [], None, fetch=True)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.temp_dir)